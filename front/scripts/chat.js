@@ -183,20 +183,52 @@ document.addEventListener('DOMContentLoaded', () => {
   async function processResponseStream(response, tempId) {
     const reader = response.body.getReader();
     const decoder = new TextDecoder();
-    let fullResponse = '';
+    const parts = [];
+    let buffer = '';
+    let streamError = null;
     const responseElement = document.querySelector(`#${tempId} .message-text`);
 
+    // Server-Sent Events: blocks separated by a blank line, each with `event:` and `data:` fields
+    const handleEvent = (block) => {
+      let type = 'message';
+      let data = '';
+      for (const line of block.split('\n')) {
+        if (line.startsWith('event: ')) type = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      if (type === 'token') {
+        parts.push(JSON.parse(data));
+        return true;
+      }
+      if (type === 'error') {
+        const payload = JSON.parse(data);
+        streamError = payload.error || 'Generation failed';
+      }
+      return false;
+    };
+
     while (true) {
       const { done, value } = await reader.read();
       if (done) break;
-      const chunk = decoder.decode(value, { stream: true });
-      fullResponse += chunk;
-      if (responseElement) {
-        responseElement.innerHTML = formatMessageContent(fullResponse);
+      buffer += decoder.decode(value, { stream: true });
+
+      let updated = false;
+      let boundary;
+      while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+        updated = handleEvent(buffer.slice(0, boundary)) || updated;
+        buffer = buffer.slice(boundary + 2);
+      }
+
+      if (updated && responseElement) {
+        responseElement.innerHTML = formatMessageContent(parts.join(''));
         scrollToBottom();
       }
     }
 
+    let fullResponse = parts.join('');
+    if (streamError && !fullResponse) {
+      fullResponse = `Error: ${streamError}`;
+    }
     finalizeMessage(tempId, fullResponse);
   }
 
@@ -1,14 +1,30 @@
 import os
+import re
 import json
+import time
+import zlib
+import heapq
+import sqlite3
 import asyncio
 import logging
-from typing import Any, Dict
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
 
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Query, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pathlib import Path
 import redis.asyncio as redis
 
+from segments import Key, Location, MemberReader, remove_expired, select_logs
+from spill import SpillLog
+from store import QueryError, aggregate, as_utc, rollup_series, select_rows
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; validation falls back to the json module
+    orjson = None
+
 
 # ───────────────────── Logging Configuration ─────────────────────
 logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
@@ -17,84 +33,764 @@ logger = logging.getLogger("log_collector")
 
 # ───────────────────── App Settings ─────────────────────
 REDIS_URL: str = os.getenv("REDIS_URL", "redis://redis:6379")
-QUEUE_NAME: str = "log_queue"
-LOG_DIR: Path = Path("/app/logs")
+REDIS_TIMEOUT: float = float(os.getenv("REDIS_TIMEOUT", "5"))  # seconds
+QUEUE_NAME: str = "log_queue"  # legacy list queue, drained into the stream at startup
+STREAM_NAME: str = os.getenv("LOG_STREAM", "log_stream")
+GROUP_NAME: str = os.getenv("LOG_GROUP", "log_workers")
+# Approximate cap on stream entries; beyond it the oldest entries are trimmed, processed or not
+STREAM_MAXLEN: int = int(os.getenv("STREAM_MAXLEN", "100000"))
+# Where log_worker moves entries it gave up on, and the prefix of the stats hashes it publishes
+DEAD_LETTER_STREAM: str = os.getenv("LOG_DEAD_LETTER_STREAM", "log_dead_letters")
+WORKER_STATS_PREFIX: str = os.getenv("WORKER_STATS_PREFIX", "log_worker:stats:")
+LOG_DIR: Path = Path(os.getenv("LOG_DIR", "/app/logs"))
+# Processed log segments (and legacy log files) older than this are deleted; 0 keeps them forever
+LOG_RETENTION_DAYS: float = float(os.getenv("LOG_RETENTION_DAYS", "30"))
+RETENTION_INTERVAL: float = 3600.0  # seconds
+EXPORT_MAX_LIMIT: int = 10000
+# Files younger than this are left for the next export: they may still be
+# being written, or have a lower name than a file another worker is writing
+EXPORT_SETTLE_MS: int = 2000
+EXPORT_CHUNK_BYTES: int = 64 * 1024
+# SQLite metrics store written by log_worker, served by /query/*
+METRICS_DB: Path = Path(os.getenv("METRICS_DB", str(LOG_DIR / "metrics.db")))
+QUERY_MAX_LIMIT: int = 10000
+ROLLUP_MAX_POINTS: int = 20000  # windows per field in one /rollups response
+MAX_BATCH_ITEMS: int = int(os.getenv("MAX_BATCH_ITEMS", "5000"))
+THROUGHPUT_WINDOW: float = 60.0  # seconds
+# Local spill log used while Redis is down, slow or backlogged; empty disables it
+SPILL_DIR: str = os.getenv("SPILL_DIR", "/app/spill")
+SPILL_SEGMENT_BYTES: int = int(os.getenv("SPILL_SEGMENT_BYTES", str(16 * 1024 * 1024)))
+SPILL_SLOW_MS: float = float(os.getenv("SPILL_SLOW_MS", "500"))  # a Redis push slower than this starts spilling
+SPILL_HIGH_WATER: int = int(os.getenv("SPILL_HIGH_WATER", "50000"))  # undelivered entries; 0 disables
+SPILL_REPLAY_BATCH: int = int(os.getenv("SPILL_REPLAY_BATCH", "500"))
 
 app = FastAPI(title="Log Collector", description="Receives logs and queues them in Redis")
 
 redis_conn: redis.Redis = None
+spill: Optional[SpillLog] = None
+# Why new logs go to the spill log instead of Redis; None while they go to Redis
+spill_reason: Optional[str] = None
+
+_json_decoder = json.JSONDecoder()
+
+# Legacy per-log files of older workers: log[_crushed]_<unix ms>_<hex id>.json.
+# Logs in segments have the same (unix ms, hex id) keys, so cursors cover both.
+LOG_FILE_NAME = re.compile(r"^log_(?:crushed_)?(\d+)_([0-9a-f]+)\.json$")
+CURSOR = re.compile(r"^(\d+)_([0-9a-f]+)$")
+
+
+# ───────────────────── Ingestion Metrics ─────────────────────
+class IngestStats:
+    """Ingestion counters and items/s over the last `THROUGHPUT_WINDOW` seconds."""
+
+    def __init__(self) -> None:
+        self.requests: Dict[str, int] = {"collect": 0, "batch": 0}
+        self.items: Dict[str, int] = {"queued": 0, "spilled": 0, "invalid": 0, "failed": 0}
+        self.bytes: int = 0
+        self.push_seconds: float = 0.0
+        self.pushes: int = 0
+        self._recent: Deque[Tuple[float, int]] = deque()
+        # Last queue monitor snapshot: stream length and {group: info}
+        self.stream_length: int = 0
+        self.groups: Dict[str, Dict[str, Any]] = {}
+        self.consumers: Dict[Tuple[str, str], Dict[str, int]] = {}  # (group, consumer) -> pending, idle
+        self.dead_letters: int = 0
+        self.workers: Dict[str, Dict[str, float]] = {}  # worker -> stats published by log_worker
+        self.exported: int = 0
+        self.expired: int = 0
+        self.replayed: int = 0
+
+    def record(
+        self, endpoint: str, size: int, queued: int, invalid: int, failed: int, push_time: float, spilled: int = 0
+    ) -> None:
+        now = time.monotonic()
+        self.requests[endpoint] += 1
+        self.items["queued"] += queued
+        self.items["spilled"] += spilled
+        self.items["invalid"] += invalid
+        self.items["failed"] += failed
+        self.bytes += size
+        self.push_seconds += push_time
+        self.pushes += 1
+        self._recent.append((now, queued + spilled))
+        self._trim(now)
+
+    def items_per_second(self) -> float:
+        now = time.monotonic()
+        self._trim(now)
+        return sum(n for _, n in self._recent) / THROUGHPUT_WINDOW
+
+    def render(self) -> str:
+        lines = [
+            "# HELP collector_requests_total Ingestion requests by endpoint",
+            "# TYPE collector_requests_total counter",
+            *(f'collector_requests_total{{endpoint="{k}"}} {v}' for k, v in self.requests.items()),
+            "# HELP collector_items_total Log items by outcome",
+            "# TYPE collector_items_total counter",
+            *(f'collector_items_total{{status="{k}"}} {v}' for k, v in self.items.items()),
+            "# HELP collector_bytes_total Ingested request body bytes",
+            "# TYPE collector_bytes_total counter",
+            f"collector_bytes_total {self.bytes}",
+            "# HELP collector_redis_push_seconds Time spent queueing logs (Redis or spill log)",
+            "# TYPE collector_redis_push_seconds summary",
+            f"collector_redis_push_seconds_sum {self.push_seconds}",
+            f"collector_redis_push_seconds_count {self.pushes}",
+            f"# HELP collector_items_per_second Queued items per second over the last {THROUGHPUT_WINDOW:.0f}s",
+            "# TYPE collector_items_per_second gauge",
+            f"collector_items_per_second {self.items_per_second()}",
+            "# HELP collector_stream_length Entries in the log stream",
+            "# TYPE collector_stream_length gauge",
+            f"collector_stream_length {self.stream_length}",
+            "# HELP collector_stream_lag Stream entries not yet delivered to the consumer group",
+            "# TYPE collector_stream_lag gauge",
+            *(f'collector_stream_lag{{group="{g}"}} {info["lag"]}'
+              for g, info in self.groups.items() if info["lag"] is not None),
+            "# HELP collector_stream_pending Entries delivered to the consumer group but not acknowledged",
+            "# TYPE collector_stream_pending gauge",
+            *(f'collector_stream_pending{{group="{g}"}} {info["pending"]}' for g, info in self.groups.items()),
+            "# HELP collector_stream_consumers Consumers in the group",
+            "# TYPE collector_stream_consumers gauge",
+            *(f'collector_stream_consumers{{group="{g}"}} {info["consumers"]}' for g, info in self.groups.items()),
+            "# HELP collector_consumer_pending Entries delivered to a consumer but not acknowledged",
+            "# TYPE collector_consumer_pending gauge",
+            *(f'collector_consumer_pending{{group="{g}",consumer="{c}"}} {info["pending"]}'
+              for (g, c), info in self.consumers.items()),
+            "# HELP collector_consumer_idle_seconds Time since a consumer last read or claimed entries",
+            "# TYPE collector_consumer_idle_seconds gauge",
+            *(f'collector_consumer_idle_seconds{{group="{g}",consumer="{c}"}} {info["idle"] / 1000}'
+              for (g, c), info in self.consumers.items()),
+            "# HELP collector_dead_letters Entries in the dead-letter stream",
+            "# TYPE collector_dead_letters gauge",
+            f"collector_dead_letters {self.dead_letters}",
+            "# HELP worker_logs_total Logs handled by each log_worker, by outcome",
+            "# TYPE worker_logs_total counter",
+            *(f'worker_logs_total{{worker="{w}",status="{k}"}} {int(info.get(k, 0))}'
+              for w, info in self.workers.items() for k in ("saved", "skipped", "retried", "dead")),
+            f"# HELP worker_logs_per_second Logs saved or skipped per second over the last {THROUGHPUT_WINDOW:.0f}s",
+            "# TYPE worker_logs_per_second gauge",
+            *(f'worker_logs_per_second{{worker="{w}"}} {info.get("logs_per_second", 0.0)}'
+              for w, info in self.workers.items()),
+            "# HELP worker_batch_seconds Time log_worker spends per batch of logs",
+            "# TYPE worker_batch_seconds summary",
+            *(line for w, info in self.workers.items() for line in (
+                f'worker_batch_seconds_sum{{worker="{w}"}} {info.get("batch_seconds", 0.0)}',
+                f'worker_batch_seconds_count{{worker="{w}"}} {int(info.get("batches", 0))}',
+            )),
+            "# HELP worker_consumers Concurrent stream consumers of each log_worker",
+            "# TYPE worker_consumers gauge",
+            *(f'worker_consumers{{worker="{w}"}} {int(info.get("consumers", 0))}' for w, info in self.workers.items()),
+            "# HELP collector_logs_exported_total Logs served by /logs",
+            "# TYPE collector_logs_exported_total counter",
+            f"collector_logs_exported_total {self.exported}",
+            "# HELP collector_logs_expired_total Logs deleted by the retention policy",
+            "# TYPE collector_logs_expired_total counter",
+            f"collector_logs_expired_total {self.expired}",
+            "# HELP collector_spilling Whether new logs are written to the spill log instead of Redis",
+            "# TYPE collector_spilling gauge",
+            f"collector_spilling {int(spill_reason is not None)}",
+            "# HELP collector_spill_bytes Size of the spill log not yet replayed into Redis",
+            "# TYPE collector_spill_bytes gauge",
+            f"collector_spill_bytes {spill.size() if spill is not None else 0}",
+            "# HELP collector_spill_segments Spill log segment files",
+            "# TYPE collector_spill_segments gauge",
+            f"collector_spill_segments {len(spill.segments) if spill is not None else 0}",
+            "# HELP collector_spill_replayed_total Spilled logs replayed into Redis",
+            "# TYPE collector_spill_replayed_total counter",
+            f"collector_spill_replayed_total {self.replayed}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def _trim(self, now: float) -> None:
+        while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW:
+            self._recent.popleft()
+
+
+stats = IngestStats()
+
+
+# ───────────────────── Parsing ─────────────────────
+def _text(value: str | bytes) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _check_object(raw: str | bytes) -> None:
+    """Raise ValueError unless `raw` is one JSON object."""
+    value = orjson.loads(raw) if orjson is not None else json.loads(raw)
+    if not isinstance(value, dict):
+        raise ValueError("log entry must be a JSON object")
+
+
+def _split_array(text: str) -> List[Tuple[str, Any]]:
+    """
+    Raw text and parsed value of every item of a JSON array, located with
+    the decoder's scanner so items can be queued without re-serializing.
+    """
+    ws = json.decoder.WHITESPACE.match
+    pos = ws(text, 0).end()
+    if not text.startswith("[", pos):
+        raise ValueError("expected a JSON array")
+    pos = ws(text, pos + 1).end()
+    items: List[Tuple[str, Any]] = []
+    if text.startswith("]", pos):
+        pos += 1
+    else:
+        while True:
+            try:
+                value, end = _json_decoder.raw_decode(text, pos)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"item {len(items)}: {e}") from None
+            items.append((text[pos:end], value))
+            pos = ws(text, end).end()
+            if text.startswith("]", pos):
+                pos += 1
+                break
+            if not text.startswith(",", pos):
+                raise ValueError(f"item {len(items)}: expected ',' or ']' at char {pos}")
+            pos = ws(text, pos + 1).end()
+    if ws(text, pos).end() != len(text):
+        raise ValueError(f"extra data after the array at char {pos}")
+    return items
+
+
+async def _push(values: List[str | bytes]) -> None:
+    """XADD all values in order in one pipelined round trip."""
+    if len(values) == 1:
+        await redis_conn.xadd(STREAM_NAME, {"data": values[0]}, maxlen=STREAM_MAXLEN, approximate=True)
+        return
+    async with redis_conn.pipeline(transaction=False) as pipe:
+        for value in values:
+            pipe.xadd(STREAM_NAME, {"data": value}, maxlen=STREAM_MAXLEN, approximate=True)
+        await pipe.execute()
+
+
+def _backlog() -> int:
+    """Entries not yet delivered to the workers, as of the last queue monitor run."""
+    return max((info["lag"] for info in stats.groups.values() if info["lag"] is not None), default=0)
+
+
+def _start_spilling(reason: str) -> None:
+    global spill_reason
+    if spill_reason is None:
+        spill_reason = reason
+        logger.warning(f"[Spill] Writing new logs to the spill log: {reason}")
+
+
+async def _queue(values: List[str | bytes]) -> bool:
+    """
+    Queue logs in order: XADD them to the stream or, while Redis is down,
+    slow or backlogged, append them to the spill log. Once anything has been
+    spilled, new logs keep going to the spill log until it has been replayed,
+    so the stream order is the arrival order. Returns True if spilled.
+    """
+    if spill is None:
+        await _push(values)
+        return False
+    if spill_reason is None and SPILL_HIGH_WATER and _backlog() >= SPILL_HIGH_WATER:
+        _start_spilling(f"backlog over {SPILL_HIGH_WATER}")
+    if spill_reason is None:
+        t0 = time.perf_counter()
+        try:
+            await _push(values)
+        except Exception as e:
+            _start_spilling(f"Redis error: {e}")
+        else:
+            elapsed_ms = (time.perf_counter() - t0) * 1000
+            if SPILL_SLOW_MS and elapsed_ms > SPILL_SLOW_MS:
+                _start_spilling(f"Redis push took {elapsed_ms:.0f} ms")
+            return False
+    await spill.append(values)
+    return True
+
+
+async def _replay_spill() -> None:
+    """
+    Replay spilled logs into the stream, oldest first. Every batch is added
+    in one MULTI/EXEC together with the replay checkpoint (segment, offset),
+    so a crash or Redis failure mid-replay neither loses nor repeats a log.
+    Switches new logs back to Redis once the spill log is empty.
+    """
+    global spill_reason
+    key = f"log_spill:{spill.id}"
+    checkpoint = await redis_conn.get(key)
+    done_seq, done_offset = map(int, _text(checkpoint).split(":")) if checkpoint else (0, 0)
+    spill.advance(done_seq)
+
+    while spill.segments:
+        seq = spill.segments[0]
+        if seq < done_seq:  # replayed before the segment could be deleted
+            spill.remove(seq)
+            continue
+        if seq == spill.active:
+            await spill.seal()
+        offset = done_offset if seq == done_seq else 0
+        while True:
+            records, end = await asyncio.to_thread(spill.read, seq, offset, SPILL_REPLAY_BATCH)
+            if not records:
+                break
+            async with redis_conn.pipeline(transaction=True) as pipe:
+                for data in records:
+                    pipe.xadd(STREAM_NAME, {"data": data}, maxlen=STREAM_MAXLEN, approximate=True)
+                pipe.set(key, f"{seq}:{end}")
+                await pipe.execute()
+            offset = end
+            stats.replayed += len(records)
+        done_seq, done_offset = seq, offset
+        spill.remove(seq)
+
+    if spill_reason is not None:
+        logger.info(f"[Spill] Spill log replayed ({stats.replayed} logs so far); queueing to Redis again")
+        spill_reason = None
+
+
+async def _ensure_group() -> None:
+    """Create the stream and its consumer group (reading from the start) if missing."""
+    try:
+        await redis_conn.xgroup_create(STREAM_NAME, GROUP_NAME, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+
+async def _drain_legacy_queue() -> None:
+    """Move logs left in the old list queue into the stream, oldest first."""
+    moved = 0
+    while (raw := await redis_conn.rpop(QUEUE_NAME)) is not None:
+        await redis_conn.xadd(STREAM_NAME, {"data": raw}, maxlen=STREAM_MAXLEN, approximate=True)
+        moved += 1
+    if moved:
+        logger.info(f"[LogCollector] Moved {moved} logs from '{QUEUE_NAME}' to stream '{STREAM_NAME}'")
+
+
+# ───────────────────── Log Files ─────────────────────
+def _file_key(name: str) -> Optional[Key]:
+    """(timestamp ms, id) of a worker log file, None for any other file."""
+    match = LOG_FILE_NAME.match(name)
+    return (int(match.group(1)), match.group(2)) if match else None
+
+
+def _to_ms(value: datetime) -> int:
+    return int(as_utc(value).timestamp() * 1000)
+
+
+def _select_logs(
+    after: Optional[Key], since_ms: Optional[int], until_ms: int, limit: int
+) -> List[Tuple[Key, str | Location]]:
+    """
+    Keys and sources (segment location, or name of a legacy file) of the first
+    `limit` + 1 logs after the cursor key whose timestamp is in
+    [since_ms, until_ms), in cursor order. Only segment indexes and file
+    names are read.
+    """
+    def _legacy() -> Iterator[Tuple[Key, str]]:
+        with os.scandir(LOG_DIR) as entries:
+            for entry in entries:
+                key = _file_key(entry.name)
+                if key is None or key[0] >= until_ms:
+                    continue
+                if (since_ms is not None and key[0] < since_ms) or (after is not None and key <= after):
+                    continue
+                yield key, entry.name
+
+    try:
+        legacy = heapq.nsmallest(limit + 1, _legacy())
+    except FileNotFoundError:
+        legacy = []
+    return heapq.nsmallest(limit + 1, legacy + select_logs(LOG_DIR, after, since_ms, until_ms, limit))
+
+
+def _export_chunks(sources: List[str | Location], gzip: bool) -> Iterator[bytes]:
+    """
+    NDJSON of the given logs, one compact object per line, in chunks of
+    about `EXPORT_CHUNK_BYTES` (gzip-compressed if requested). Segment lines
+    are sent as stored; legacy files are compacted. Logs that vanished or
+    cannot be read are skipped.
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31) if gzip else None
+    reader = MemberReader(LOG_DIR)
+    buffer: List[bytes] = []
+    size = 0
+    for source in sources:
+        try:
+            if not isinstance(source, str):
+                line = reader.line(source)
+            elif orjson is not None:
+                line = orjson.dumps(orjson.loads((LOG_DIR / source).read_bytes()))
+            else:
+                line = json.dumps(json.loads((LOG_DIR / source).read_bytes()), ensure_ascii=False).encode()
+        except FileNotFoundError:
+            continue
+        except (OSError, ValueError) as e:
+            logger.warning(f"[Export] Skipping {source}: {e}")
+            continue
+        buffer.append(line + b"\n")
+        size += len(line) + 1
+        if size >= EXPORT_CHUNK_BYTES:
+            chunk = b"".join(buffer)
+            buffer, size = [], 0
+            yield compressor.compress(chunk) if compressor is not None else chunk
+    chunk = b"".join(buffer)
+    if compressor is not None:
+        yield compressor.compress(chunk) + compressor.flush()
+    elif chunk:
+        yield chunk
+
+
+def _apply_retention() -> int:
+    """Delete processed logs older than `LOG_RETENTION_DAYS` (whole hourly segments); returns how many."""
+    cutoff_ms = (time.time() - LOG_RETENTION_DAYS * 86400) * 1000
+    removed = remove_expired(LOG_DIR, cutoff_ms)
+    try:
+        with os.scandir(LOG_DIR) as entries:
+            for entry in entries:
+                key = _file_key(entry.name)
+                if key is not None and key[0] < cutoff_ms:
+                    Path(entry.path).unlink(missing_ok=True)
+                    removed += 1
+    except FileNotFoundError:
+        pass
+    return removed
 
 
 # ───────────────────── Lifecycle ─────────────────────
 @app.on_event("startup")
 async def startup() -> None:
     """
-    Initialize Redis connection and start periodic queue size logging.
+    Initialize Redis connection, the log stream and its consumer group, and
+    start periodic stream lag logging and log file retention.
     """
-    global redis_conn
-    redis_conn = redis.from_url(REDIS_URL)
+    global redis_conn, spill, spill_reason
+    redis_conn = redis.from_url(REDIS_URL, socket_timeout=REDIS_TIMEOUT, socket_connect_timeout=REDIS_TIMEOUT)
+    if SPILL_DIR:
+        spill = SpillLog(Path(SPILL_DIR), SPILL_SEGMENT_BYTES)
+        if spill.pending():
+            spill_reason = "unreplayed spill log from a previous run"
+            logger.warning(f"[Spill] Found {len(spill.segments)} spill segments ({spill.size()} bytes) to replay")
+    try:
+        await _ensure_group()
+        await _drain_legacy_queue()
+    except Exception as e:
+        logger.error(f"[LogCollector] Stream setup failed: {e}")
 
     async def monitor_queue():
         while True:
             try:
-                length = await redis_conn.llen(QUEUE_NAME)
-                if length > 0:
-                    logger.info(f"[LogCollector] {length} logs in queue")
-                await asyncio.sleep(10)
+                stats.stream_length = await redis_conn.xlen(STREAM_NAME)
+                stats.groups = {
+                    _text(g["name"]): {"lag": g.get("lag"), "pending": g["pending"], "consumers": g["consumers"]}
+                    for g in await redis_conn.xinfo_groups(STREAM_NAME)
+                }
+                stats.consumers = {
+                    (group, _text(c["name"])): {"pending": c["pending"], "idle": c["idle"]}
+                    for group in stats.groups
+                    for c in await redis_conn.xinfo_consumers(STREAM_NAME, group)
+                }
+                stats.dead_letters = await redis_conn.xlen(DEAD_LETTER_STREAM)
+                workers = {}
+                async for key in redis_conn.scan_iter(match=WORKER_STATS_PREFIX + "*", count=100):
+                    fields = await redis_conn.hgetall(key)
+                    workers[_text(key)[len(WORKER_STATS_PREFIX):]] = {_text(k): float(v) for k, v in fields.items()}
+                stats.workers = workers
+                for name, info in stats.groups.items():
+                    if info["lag"] or info["pending"]:
+                        logger.info(
+                            f"[LogCollector] Group '{name}': lag={info['lag']} pending={info['pending']} "
+                            f"consumers={info['consumers']} (stream length {stats.stream_length})"
+                        )
             except Exception as e:
                 logger.warning(f"[LogCollector] Queue monitor error: {e}")
+            await asyncio.sleep(10)
+
+    async def enforce_retention():
+        while True:
+            try:
+                removed = await asyncio.to_thread(_apply_retention)
+                stats.expired += removed
+                if removed:
+                    logger.info(f"[LogCollector] Retention removed {removed} logs older than {LOG_RETENTION_DAYS:g} days")
+            except Exception as e:
+                logger.warning(f"[LogCollector] Retention error: {e}")
+            await asyncio.sleep(RETENTION_INTERVAL)
+
+    async def replay_spill():
+        while True:
+            await asyncio.sleep(1)
+            if not spill.pending() or (SPILL_HIGH_WATER and _backlog() >= SPILL_HIGH_WATER // 2):
+                continue
+            try:
+                await _replay_spill()
+            except Exception as e:
+                logger.warning(f"[Spill] Replay paused: {e}")
+                await asyncio.sleep(4)
 
     asyncio.create_task(monitor_queue())
+    if spill is not None:
+        asyncio.create_task(replay_spill())
+    if LOG_RETENTION_DAYS > 0:
+        asyncio.create_task(enforce_retention())
 
 
 # ───────────────────── Routes ─────────────────────
 @app.get("/ping")
 async def ping() -> Dict[str, Any]:
     """
-    Health check endpoint to verify Redis availability.
+    Health check endpoint to verify Redis availability. `spilling` tells why
+    new logs go to the local spill log instead of Redis, if they do.
     """
     try:
         pong = await redis_conn.ping()
-        return {"status": "ok", "redis": pong}
+        return {"status": "ok", "redis": pong, "spilling": spill_reason}
     except Exception as e:
         logger.error(f"[Ping] Redis unavailable: {e}")
-        return {"status": "error", "redis": False}
+        return {"status": "error", "redis": False, "spilling": spill_reason}
 
 
 @app.post("/collect")
 async def collect_logs(request: Request) -> Dict[str, str]:
     """
-    Accepts a JSON log from request body and pushes it into Redis queue.
+    Accepts a JSON log from request body and appends it to the Redis log stream,
+    or to the local spill log while Redis is unavailable, slow or backlogged.
+    The body is validated and queued as received, without re-serializing.
     """
+    body = await request.body()
+    try:
+        _check_object(body)
+    except ValueError as e:
+        logger.error(f"[Collect] Invalid log entry: {e}")
+        stats.record("collect", len(body), 0, 1, 0, 0.0)
+        return {"status": "error"}
+
+    t0 = time.perf_counter()
     try:
-        data = await request.json()
-        await redis_conn.lpush(QUEUE_NAME, json.dumps(data, ensure_ascii=False))
-        return {"status": "queued"}
+        spilled = await _queue([body])
     except Exception as e:
-        logger.error(f"[Collect] Failed to process incoming log: {e}")
+        logger.error(f"[Collect] Failed to queue log: {e}")
+        stats.record("collect", len(body), 0, 0, 1, time.perf_counter() - t0)
         return {"status": "error"}
+    stats.record("collect", len(body), 0 if spilled else 1, 0, 0, time.perf_counter() - t0, spilled=int(spilled))
+    return {"status": "queued"}
+
+
+@app.post("/collect/batch")
+async def collect_batch(request: Request) -> JSONResponse:
+    """
+    Accepts many logs as a JSON array or as NDJSON (one object per line,
+    `Content-Type: application/x-ndjson`) and appends them to the log stream
+    with one pipelined Redis call (or to the spill log), as received.
+
+    Returns a status per item: "queued" or "invalid: <reason>". A body that is
+    not a parseable array gets 400; more than `MAX_BATCH_ITEMS` items get 413;
+    if neither Redis nor the spill log can take them, every valid item is
+    reported as "failed" with status 503.
+    """
+    body = await request.body()
+    statuses: List[str] = []
+    values: List[str | bytes] = []
+
+    if "ndjson" in request.headers.get("content-type", ""):
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                _check_object(line)
+            except ValueError as e:
+                statuses.append(f"invalid: {e}")
+                continue
+            statuses.append("queued")
+            values.append(line)
+    else:
+        try:
+            items = _split_array(body.decode("utf-8"))
+        except (UnicodeDecodeError, ValueError) as e:
+            return JSONResponse({"status": "error", "detail": str(e)}, status_code=400)
+        for raw, value in items:
+            if isinstance(value, dict):
+                statuses.append("queued")
+                values.append(raw)
+            else:
+                statuses.append("invalid: log entry must be a JSON object")
+
+    if len(statuses) > MAX_BATCH_ITEMS:
+        return JSONResponse(
+            {"status": "error", "detail": f"At most {MAX_BATCH_ITEMS} items per batch"}, status_code=413
+        )
+
+    invalid = len(statuses) - len(values)
+    t0 = time.perf_counter()
+    spilled = False
+    if values:
+        try:
+            spilled = await _queue(values)
+        except Exception as e:
+            logger.error(f"[Collect] Failed to queue batch of {len(values)}: {e}")
+            stats.record("batch", len(body), 0, invalid, len(values), time.perf_counter() - t0)
+            statuses = ["failed" if s == "queued" else s for s in statuses]
+            return JSONResponse(
+                {"status": "error", "queued": 0, "invalid": invalid, "items": statuses}, status_code=503
+            )
+    queued, spilled_items = (0, len(values)) if spilled else (len(values), 0)
+    stats.record("batch", len(body), queued, invalid, 0, time.perf_counter() - t0, spilled=spilled_items)
+
+    return JSONResponse({
+        "status": "ok" if not invalid else "partial",
+        "queued": len(values),
+        "invalid": invalid,
+        "items": statuses,
+    })
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics() -> PlainTextResponse:
+    """
+    Ingestion counters and throughput in Prometheus text format.
+    """
+    return PlainTextResponse(stats.render(), media_type="text/plain; version=0.0.4")
 
 
 @app.get("/logs")
-async def get_aggregated_logs() -> JSONResponse:
+async def export_logs(
+    request: Request,
+    cursor: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = Query(1000, ge=1, le=EXPORT_MAX_LIMIT),
+) -> StreamingResponse:
+    """
+    Streams processed logs as NDJSON, oldest first, without deleting them.
+
+    `since` / `until` (ISO 8601 or unix seconds, UTC if no zone) filter by the
+    time the log was processed. At most `limit` logs are sent; the response
+    headers carry `X-Next-Cursor`, to pass as `cursor` for the following page,
+    and `X-Has-More`. Repeating a request with the same cursor returns the same
+    logs, so an interrupted transfer can simply be retried. Compressed with
+    gzip if the client accepts it. Old logs are removed by the retention
+    policy (`LOG_RETENTION_DAYS`), not by reading them.
+    """
+    after = None
+    if cursor:
+        match = CURSOR.match(cursor)
+        if match is None:
+            return JSONResponse({"status": "error", "detail": "Invalid cursor"}, status_code=400)
+        after = (int(match.group(1)), match.group(2))
+
+    until_ms = int(time.time() * 1000) - EXPORT_SETTLE_MS
+    if until is not None:
+        until_ms = min(until_ms, _to_ms(until))
+    since_ms = _to_ms(since) if since is not None else None
+
+    logs = await asyncio.to_thread(_select_logs, after, since_ms, until_ms, limit)
+    has_more = len(logs) > limit
+    logs = logs[:limit]
+    next_cursor = "%d_%s" % logs[-1][0] if logs else (cursor or "")
+    stats.exported += len(logs)
+    logger.info(f"[LogCollector] Exporting {len(logs)} logs after cursor '{cursor or ''}' (more: {has_more})")
+
+    gzip = "gzip" in request.headers.get("accept-encoding", "")
+    headers = {"X-Next-Cursor": next_cursor, "X-Has-More": "true" if has_more else "false"}
+    if gzip:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        _export_chunks([source for _, source in logs], gzip),
+        media_type="application/x-ndjson",
+        headers=headers,
+    )
+
+
+def _query_error(e: Exception) -> JSONResponse:
+    if isinstance(e, QueryError):
+        return JSONResponse({"status": "error", "detail": str(e)}, status_code=400)
+    logger.warning(f"[LogCollector] Metrics store unavailable: {e}")
+    return JSONResponse({"status": "error", "detail": "Metrics store unavailable"}, status_code=503)
+
+
+@app.get("/query/logs")
+async def query_logs(
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    ip: Optional[str] = None,
+    finish_reason: Optional[str] = None,
+    fields: Optional[str] = None,
+    order_by: str = "request_time",
+    order: str = Query("desc", pattern="^(asc|desc)$"),
+    limit: int = Query(100, ge=1, le=QUERY_MAX_LIMIT),
+) -> Any:
     """
-    Aggregates all log_*.json files in the logs folder and deletes them after reading.
+    Processed logs from the metrics store: their numeric fields (timings,
+    stats, metrics), question, request time, IP and finish reason.
+
+    Filters on `since` / `until` (request time, UTC if no zone), `ip` and
+    `finish_reason`. `fields` is a comma-separated column list (all by
+    default). Rows are sorted by `order_by` (rows where it is null are left
+    out), e.g. `order_by=context_precision&order=asc` for the questions with
+    the least precise context.
     """
-    logger.info("[LogCollector] Received aggregation request")
-    logs = []
+    filters = {"since": since, "until": until, "ip": ip, "finish_reason": finish_reason}
+    columns = [name.strip() for name in fields.split(",") if name.strip()] if fields else None
+    try:
+        rows = await asyncio.to_thread(select_rows, METRICS_DB, filters, columns, order_by, order == "desc", limit)
+    except (QueryError, OSError, sqlite3.Error) as e:
+        return _query_error(e)
+    return {"count": len(rows), "rows": rows}
 
+
+@app.get("/query/aggregate")
+async def query_aggregate(
+    field: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    ip: Optional[str] = None,
+    finish_reason: Optional[str] = None,
+    bucket: str = "hour",
+    group_by: Optional[str] = None,
+    percentiles: str = "50,95,99",
+) -> Any:
+    """
+    count, avg, min, max and percentiles of a numeric field per request
+    time `bucket` (`hour`, `day` or `none`), optionally per `group_by`
+    (`ip` or `finish_reason`), with the filters of /query/logs. E.g. hourly
+    p95 TTFB of the last week: `field=ttfb&since=<a week ago>&percentiles=95`.
+    """
+    filters = {"since": since, "until": until, "ip": ip, "finish_reason": finish_reason}
     try:
-        for file in LOG_DIR.glob("log_*.json"):
-            try:
-                with file.open("r", encoding="utf-8") as f:
-                    logs.append(json.load(f))
-                file.unlink()
-            except Exception as e:
-                logger.warning(f"[LogCollector] Error reading {file.name}: {e}")
+        levels = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        return _query_error(QueryError("percentiles must be numbers"))
+    try:
+        buckets = await asyncio.to_thread(aggregate, METRICS_DB, filters, field, bucket, group_by, levels)
+    except (QueryError, OSError, sqlite3.Error) as e:
+        return _query_error(e)
+    return {"field": field, "bucket": bucket, "buckets": buckets}
 
-        logger.info(f"[LogCollector] Successfully aggregated and removed {len(logs)} log files")
-        return JSONResponse(content=logs)
 
-    except Exception as e:
-        logger.error(f"[LogCollector] Aggregation failed: {e}")
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+@app.get("/rollups")
+async def rollups(
+    fields: str,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    step: int = 3600,
+    percentiles: str = "50,95,99",
+) -> Any:
+    """
+    Time series of timing and quality metrics from the per-minute rollups
+    that log_worker maintains, without touching individual logs.
+
+    For each of the comma-separated `fields` (e.g. `ttfb,answer_relevancy`):
+    count, avg, min, max and percentiles (within 1% relative error) per
+    `step` seconds window by request time, aligned to multiples of `step`,
+    or over the whole range with `step=0`. The range defaults to the last
+    24 hours. Times without a zone are UTC. Steps that are whole hours are
+    served from hourly rollups.
+    """
+    until = as_utc(until) if until is not None else datetime.now(timezone.utc)
+    since = as_utc(since) if since is not None else until - timedelta(days=1)
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    try:
+        levels = [float(p) for p in percentiles.split(",") if p.strip()]
+    except ValueError:
+        return _query_error(QueryError("percentiles must be numbers"))
+    if step and (until - since).total_seconds() / step > ROLLUP_MAX_POINTS:
+        return _query_error(QueryError(f"More than {ROLLUP_MAX_POINTS} windows; use a larger step"))
+    try:
+        series = await asyncio.to_thread(rollup_series, METRICS_DB, names, since, until, step, levels)
+    except (QueryError, OSError, sqlite3.Error) as e:
+        return _query_error(e)
+    return {"since": since.isoformat(), "until": until.isoformat(), "step": step, "series": series}
@@ -0,0 +1,128 @@
+import os
+import re
+import json
+import zlib
+import heapq
+import logging
+from collections import OrderedDict
+from datetime import datetime, timezone
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger("log_collector")
+
+# Read side of the processed log segments written by log_worker (format in
+# log_worker/segments.py): per writer and UTC hour, `logs_<YYYYMMDDHH>_<writer>.jsonl.gz`
+# holds gzip members of compact JSON lines, and `logs_<YYYYMMDDHH>_<writer>.idx`
+# one line per member with its offset, length and the (unix ms, hex id) key of each log.
+SEGMENT_NAME = re.compile(r"^logs_(\d{10})_([A-Za-z0-9.-]+)\.jsonl\.gz$")
+HOUR_MS = 3600 * 1000
+
+Key = Tuple[int, str]
+# Where a log is stored: (segment file name, member offset, member length, line in the member)
+Location = Tuple[str, int, int, int]
+
+
+def _hour_start_ms(hour: str) -> int:
+    return int(datetime.strptime(hour, "%Y%m%d%H").replace(tzinfo=timezone.utc).timestamp() * 1000)
+
+
+def _index_path(directory: Path, name: str) -> Path:
+    return directory / (name[: -len(".jsonl.gz")] + ".idx")
+
+
+def list_segments(directory: Path) -> List[Tuple[int, str]]:
+    """(hour start ms, file name) of every segment, oldest hour first."""
+    found = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                match = SEGMENT_NAME.match(entry.name)
+                if match:
+                    found.append((_hour_start_ms(match.group(1)), entry.name))
+    except FileNotFoundError:
+        pass
+    return sorted(found)
+
+
+def read_index(directory: Path, name: str) -> Iterator[Dict[str, Any]]:
+    """Complete index entries of a segment; a line being written (or torn) at the end is left out."""
+    try:
+        raw = _index_path(directory, name).read_bytes()
+    except FileNotFoundError:
+        return
+    for line in raw.split(b"\n")[:-1]:
+        try:
+            yield json.loads(line)
+        except ValueError:
+            logger.warning(f"[Segments] Unreadable index line in {name}")
+            return
+
+
+def select_logs(
+    directory: Path, after: Optional[Key], since_ms: Optional[int], until_ms: int, limit: int
+) -> List[Tuple[Key, Location]]:
+    """
+    Keys and locations of the first `limit` + 1 logs after the cursor key whose
+    time is in [since_ms, until_ms), in key order. Only indexes are read, hour
+    by hour from the first hour that can hold such logs, until more than
+    `limit` are found: later hours only hold later keys.
+    """
+    lower = max(after[0] if after is not None else 0, since_ms or 0)
+    found: List[Tuple[Key, Location]] = []
+    for hour, segments in groupby(list_segments(directory), key=lambda segment: segment[0]):
+        if hour + HOUR_MS <= lower:
+            continue
+        if hour >= until_ms or len(found) > limit:
+            break
+        for _, name in segments:
+            for entry in read_index(directory, name):
+                for line, (ms, hex_id) in enumerate(entry["keys"]):
+                    key = (ms, hex_id)
+                    if ms >= until_ms or (since_ms is not None and ms < since_ms) or (after is not None and key <= after):
+                        continue
+                    found.append((key, (name, entry["offset"], entry["length"], line)))
+    return heapq.nsmallest(limit + 1, found)
+
+
+class MemberReader:
+    """Reads logs by location, keeping the last few decompressed members."""
+
+    def __init__(self, directory: Path, cached: int = 16):
+        self.dir = directory
+        self._cached = cached
+        self._members: "OrderedDict[Tuple[str, int], List[bytes]]" = OrderedDict()
+
+    def line(self, location: Location) -> bytes:
+        """The compact JSON of one log; raises OSError / ValueError if it cannot be read."""
+        name, offset, length, line = location
+        lines = self._members.get((name, offset))
+        if lines is None:
+            with (self.dir / name).open("rb") as f:
+                f.seek(offset)
+                data = f.read(length)
+            if len(data) < length:
+                raise ValueError(f"member at {offset} is truncated")
+            try:
+                lines = zlib.decompress(data, 31).split(b"\n")
+            except zlib.error as e:
+                raise ValueError(f"member at {offset}: {e}") from e
+            self._members[(name, offset)] = lines
+            if len(self._members) > self._cached:
+                self._members.popitem(last=False)
+        else:
+            self._members.move_to_end((name, offset))
+        return lines[line]
+
+
+def remove_expired(directory: Path, cutoff_ms: float) -> int:
+    """Delete segments (and their indexes) of hours that ended before `cutoff_ms`; returns the logs removed."""
+    removed = 0
+    for hour, name in list_segments(directory):
+        if hour + HOUR_MS > cutoff_ms:
+            break
+        removed += sum(len(entry["keys"]) for entry in read_index(directory, name))
+        (directory / name).unlink(missing_ok=True)
+        _index_path(directory, name).unlink(missing_ok=True)
+    return removed
@@ -0,0 +1,191 @@
+import os
+import uuid
+import struct
+import asyncio
+import logging
+from pathlib import Path
+from typing import BinaryIO, List, Optional, Tuple
+
+logger = logging.getLogger("log_collector")
+
+# Record framing: 4-byte big-endian length, then the raw log body
+HEADER = struct.Struct(">I")
+
+
+class SpillLog:
+    """
+    Append-only local log of raw log bodies that could not be sent to Redis.
+
+    Records go to numbered segment files `spill_<seq>.log`; a new segment is
+    started once the current one reaches `segment_bytes`. Sequence numbers
+    only grow, across spill episodes and restarts (the last one is kept in
+    `spill.seq`), so a replay checkpoint never points into a newer segment. `append` returns
+    after the records are fsynced, and appends arriving while an fsync is
+    running share the next one (group commit). Segments are replayed oldest
+    first and deleted once replayed. A record torn by a crash at the end of
+    the last segment is truncated at startup.
+    """
+
+    def __init__(self, directory: Path, segment_bytes: int):
+        self.dir = directory
+        self.segment_bytes = segment_bytes
+        self.dir.mkdir(parents=True, exist_ok=True)
+
+        # Identifies this spill directory in the replay checkpoint kept in Redis
+        id_file = self.dir / "spill.id"
+        if not id_file.exists():
+            id_file.write_text(uuid.uuid4().hex)
+        self.id = id_file.read_text().strip()
+
+        self.segments: List[int] = sorted(int(p.stem.split("_")[1]) for p in self.dir.glob("spill_*.log"))
+        if self.segments:
+            self._repair(self.segments[-1])
+        seq_file = self.dir / "spill.seq"
+        last = int(seq_file.read_text().strip() or 0) if seq_file.exists() else 0
+        self.last_seq = max([last, *self.segments])  # highest segment number ever used
+
+        self.active: Optional[int] = None  # segment being appended to
+        self._file: Optional[BinaryIO] = None
+        self._written = 0  # append calls so far
+        self._synced = 0  # append calls known to be on disk
+        self._sync_task: Optional[asyncio.Task] = None  # fsync, open or close of the active segment
+
+    def pending(self) -> bool:
+        """True while any spilled record has not been replayed."""
+        return bool(self.segments)
+
+    def size(self) -> int:
+        total = 0
+        for seq in self.segments:
+            try:
+                total += self._path(seq).stat().st_size
+            except FileNotFoundError:
+                pass
+        return total
+
+    async def append(self, values: List[str | bytes]) -> None:
+        """Append records in order; returns once they are durable."""
+        while self._file is None or self._file.tell() >= self.segment_bytes:
+            if self._sync_task is not None:  # never close a file that is being fsynced
+                await asyncio.shield(self._sync_task)
+                continue
+            next_step = self._open_next if self._file is None else self._close
+            self._sync_task = asyncio.create_task(next_step())
+
+        self._file.write(b"".join(HEADER.pack(len(data)) + data for data in map(_bytes, values)))
+        self._written += 1
+        target = self._written
+        while self._synced < target:
+            if self._sync_task is None:
+                self._sync_task = asyncio.create_task(self._fsync())
+            await asyncio.shield(self._sync_task)
+
+    async def seal(self) -> None:
+        """Close the active segment so it can be replayed; later appends start a new one."""
+        while self._sync_task is not None:
+            await asyncio.shield(self._sync_task)
+        if self._file is not None:
+            self._sync_task = asyncio.create_task(self._close())
+            await asyncio.shield(self._sync_task)
+        self.active = None
+
+    def advance(self, seq: int) -> None:
+        """Number new segments after `seq` (e.g. the segment of a replay checkpoint)."""
+        self.last_seq = max(self.last_seq, seq)
+
+    def read(self, seq: int, offset: int, max_records: int) -> Tuple[List[bytes], int]:
+        """Up to `max_records` records of a sealed segment from `offset`, and the offset after them."""
+        records: List[bytes] = []
+        with self._path(seq).open("rb") as f:
+            f.seek(offset)
+            while len(records) < max_records:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                (length,) = HEADER.unpack(header)
+                data = f.read(length)
+                if len(data) < length:
+                    break
+                records.append(data)
+                offset += HEADER.size + length
+        return records, offset
+
+    def remove(self, seq: int) -> None:
+        """Delete a fully replayed segment."""
+        self._path(seq).unlink(missing_ok=True)
+        self.segments.remove(seq)
+
+    def _path(self, seq: int) -> Path:
+        return self.dir / f"spill_{seq:012d}.log"
+
+    async def _open_next(self) -> None:
+        try:
+            seq = self.last_seq + 1
+            self._file = await asyncio.to_thread(self._create, seq)
+            self.last_seq = seq
+            self.active = seq
+            self.segments.append(seq)
+        finally:
+            self._sync_task = None
+
+    def _create(self, seq: int) -> BinaryIO:
+        """Record `seq` as the last segment number, then create its segment."""
+        tmp = self.dir / "spill.seq.tmp"
+        with tmp.open("w") as f:
+            f.write(str(seq))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.dir / "spill.seq")
+        file = self._path(seq).open("ab")
+        fd = os.open(self.dir, os.O_RDONLY)
+        try:
+            os.fsync(fd)  # make the new directory entries durable
+        finally:
+            os.close(fd)
+        return file
+
+    async def _close(self) -> None:
+        """fsync and close the active segment off the event loop; appends wait for it."""
+        file, target = self._file, self._written
+        self._file = None
+        try:
+            file.flush()
+            await asyncio.to_thread(os.fsync, file.fileno())
+            self._synced = target
+        finally:
+            file.close()
+            self.active = None
+            self._sync_task = None
+
+    async def _fsync(self) -> None:
+        try:
+            target = self._written
+            self._file.flush()
+            await asyncio.to_thread(os.fsync, self._file.fileno())
+            self._synced = target
+        finally:
+            self._sync_task = None
+
+    def _repair(self, seq: int) -> None:
+        """Cut a record torn by a crash off the end of a segment."""
+        path = self._path(seq)
+        size = path.stat().st_size
+        offset = 0
+        with path.open("rb") as f:
+            while True:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    break
+                (length,) = HEADER.unpack(header)
+                if offset + HEADER.size + length > size:
+                    break
+                f.seek(length, os.SEEK_CUR)
+                offset += HEADER.size + length
+        if offset < size:
+            logger.warning(f"[Spill] Truncating torn record at {path.name}:{offset} ({size - offset} bytes)")
+            with path.open("r+b") as f:
+                f.truncate(offset)
+
+
+def _bytes(value: str | bytes) -> bytes:
+    return value.encode() if isinstance(value, str) else value
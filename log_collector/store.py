@@ -0,0 +1,261 @@
+import math
+import sqlite3
+from collections import Counter
+from datetime import datetime, timezone
+from itertools import groupby
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+# Read side of the metrics store written by log_worker (schema in log_worker/store.py):
+# table `logs`, one row per processed log, text columns plus REAL numeric fields.
+BUCKETS: Dict[str, int] = {"hour": 13, "day": 10, "none": 0}  # prefix length of request_time
+GROUP_COLUMNS = ("ip", "finish_reason")
+HOUR = 3600
+
+
+class QueryError(ValueError):
+    """A query naming an unknown field or option."""
+
+
+def _connect(path: Path) -> sqlite3.Connection:
+    if not path.exists():
+        raise FileNotFoundError(path)
+    conn = sqlite3.connect(path, timeout=5)
+    conn.execute("PRAGMA query_only=ON")
+    return conn
+
+
+def _columns(conn: sqlite3.Connection) -> Dict[str, str]:
+    return {name: type_ for _, name, type_, *_ in conn.execute("PRAGMA table_info(logs)")}
+
+
+def _request_time(value: datetime) -> str:
+    """A datetime in the format of `request_time` (naive ISO 8601 in UTC), so they compare as strings."""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.isoformat()
+
+
+def as_utc(value: datetime) -> datetime:
+    """An aware datetime; naive ones are taken as UTC, like `request_time`."""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+def _where(filters: Dict[str, Any]) -> Tuple[List[str], List[Any]]:
+    clauses: List[str] = []
+    params: List[Any] = []
+    if filters.get("since") is not None:
+        clauses.append("request_time >= ?")
+        params.append(_request_time(filters["since"]))
+    if filters.get("until") is not None:
+        clauses.append("request_time < ?")
+        params.append(_request_time(filters["until"]))
+    for name in GROUP_COLUMNS:
+        if filters.get(name) is not None:
+            clauses.append(f"{name} = ?")
+            params.append(filters[name])
+    return clauses, params
+
+
+def select_rows(
+    path: Path,
+    filters: Dict[str, Any],
+    fields: Optional[Sequence[str]],
+    order_by: str,
+    descending: bool,
+    limit: int,
+) -> List[Dict[str, Any]]:
+    """Rows matching the filters (`since`, `until`, `ip`, `finish_reason`), top `limit` by `order_by`."""
+    conn = _connect(path)
+    try:
+        columns = _columns(conn)
+        fields = list(fields or columns)
+        unknown = [name for name in [*fields, order_by] if name not in columns]
+        if unknown:
+            raise QueryError(f"Unknown fields: {', '.join(unknown)}")
+        clauses, params = _where(filters)
+        clauses.append(f"{order_by} IS NOT NULL")
+        sql = (
+            f"SELECT {', '.join(fields)} FROM logs WHERE {' AND '.join(clauses)} "
+            f"ORDER BY {order_by} {'DESC' if descending else 'ASC'} LIMIT ?"
+        )
+        return [dict(zip(fields, row)) for row in conn.execute(sql, [*params, limit])]
+    finally:
+        conn.close()
+
+
+def aggregate(
+    path: Path,
+    filters: Dict[str, Any],
+    field: str,
+    bucket: str,
+    group_by: Optional[str],
+    percentiles: Sequence[float],
+) -> List[Dict[str, Any]]:
+    """
+    count / avg / min / max and nearest-rank percentiles of a numeric field
+    per `request_time` bucket (hour, day or none) and optionally per
+    `group_by` value, over the rows matching the filters.
+    """
+    if bucket not in BUCKETS:
+        raise QueryError(f"bucket must be one of {', '.join(BUCKETS)}")
+    if group_by is not None and group_by not in GROUP_COLUMNS:
+        raise QueryError(f"group_by must be one of {', '.join(GROUP_COLUMNS)}")
+    if any(not 0 < p <= 100 for p in percentiles):
+        raise QueryError("percentiles must be in (0, 100]")
+    conn = _connect(path)
+    try:
+        if _columns(conn).get(field) != "REAL":
+            raise QueryError(f"Unknown numeric field: {field}")
+        clauses, params = _where(filters)
+        clauses.append(f"{field} IS NOT NULL")
+        bucket_sql = f"substr(request_time, 1, {BUCKETS[bucket]})" if BUCKETS[bucket] else "'all'"
+        sql = (
+            f"SELECT {bucket_sql}, {group_by or 'NULL'}, {field} FROM logs WHERE {' AND '.join(clauses)} "
+            "ORDER BY 1, 2, 3"
+        )
+        result = []
+        for (bucket_value, group), rows in groupby(conn.execute(sql, params), key=lambda row: row[:2]):
+            values = [row[2] for row in rows]
+            n = len(values)
+            item: Dict[str, Any] = {"bucket": bucket_value}
+            if group_by is not None:
+                item[group_by] = group
+            item.update(count=n, avg=sum(values) / n, min=values[0], max=values[-1])
+            for p in percentiles:
+                item[f"p{p:g}"] = values[max(0, math.ceil(p / 100 * n) - 1)]
+            result.append(item)
+        return result
+    finally:
+        conn.close()
+
+
+# ───────────────────── Rollups ─────────────────────
+# Per-minute and per-hour rollups of each field (tables `rollups` and
+# `rollup_buckets`): count, sum, min, max and log-bucket histogram counts,
+# mergeable by addition. See log_worker/store.py.
+class _Window:
+    """Merged rollups of one time window."""
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self.buckets: Counter = Counter()
+
+    def point(self, start: int, percentiles: Sequence[float], gamma: float, offset: int) -> Dict[str, Any]:
+        point: Dict[str, Any] = {
+            "start": datetime.fromtimestamp(start, tz=timezone.utc).isoformat(),
+            "count": self.count,
+            "avg": self.sum / self.count,
+            "min": self.min,
+            "max": self.max,
+        }
+        ordered = sorted(self.buckets.items())
+        for p in percentiles:
+            rank = max(0, math.ceil(p / 100 * self.count) - 1)  # nearest rank, as in aggregate()
+            seen = 0
+            for bucket, n in ordered:
+                seen += n
+                if seen > rank:
+                    break
+            point[f"p{p:g}"] = min(self.max, max(self.min, _bucket_value(bucket, gamma, offset)))
+        return point
+
+
+def _bucket_value(bucket: int, gamma: float, offset: int) -> float:
+    if bucket == 0:
+        return 0.0
+    value = 2 * gamma ** (abs(bucket) - offset) / (gamma + 1)
+    return value if bucket > 0 else -value
+
+
+def _merge(
+    conn: sqlite3.Connection,
+    windows: Dict[int, _Window],
+    field: str,
+    resolution: int,
+    lo: int,
+    hi: int,
+    window_of: Any,
+) -> None:
+    """Add the rollups of `resolution` starting in [lo, hi) to the window each falls in."""
+    if lo >= hi:
+        return
+    args = (field, resolution, lo, hi)
+    for start, count, total, low, high in conn.execute(
+        "SELECT start, count, sum, min, max FROM rollups "
+        "WHERE field = ? AND resolution = ? AND start >= ? AND start < ?",
+        args,
+    ):
+        window = windows.setdefault(window_of(start), _Window())
+        window.count += count
+        window.sum += total
+        window.min = min(window.min, low)
+        window.max = max(window.max, high)
+    for start, bucket, count in conn.execute(
+        "SELECT start, bucket, count FROM rollup_buckets "
+        "WHERE field = ? AND resolution = ? AND start >= ? AND start < ?",
+        args,
+    ):
+        windows[window_of(start)].buckets[bucket] += count
+
+
+def rollup_series(
+    path: Path,
+    fields: Sequence[str],
+    since: datetime,
+    until: datetime,
+    step: int,
+    percentiles: Sequence[float],
+) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Per field, count / avg / min / max and percentiles of every `step`
+    seconds window (aligned to multiples of `step`) in [since, until), or of
+    the whole range if `step` is 0. Windows are merged from hourly rollups
+    where they cover whole hours and from minute rollups otherwise; windows
+    without data are left out.
+    """
+    if step < 0 or step % 60:
+        raise QueryError("step must be a multiple of 60 seconds, or 0")
+    if any(not 0 < p <= 100 for p in percentiles):
+        raise QueryError("percentiles must be in (0, 100]")
+    lo = int(as_utc(since).timestamp()) // 60 * 60
+    hi = -(-int(as_utc(until).timestamp()) // 60) * 60
+    if step:
+        lo = lo // step * step
+    conn = _connect(path)
+    try:
+        numeric = {name for name, type_ in _columns(conn).items() if type_ == "REAL"}
+        unknown = [name for name in fields if name not in numeric]
+        if unknown:
+            raise QueryError(f"Unknown numeric fields: {', '.join(unknown)}")
+        meta = dict(conn.execute("SELECT name, value FROM rollup_meta"))
+        accuracy = meta["relative_accuracy"]
+        gamma, offset = (1 + accuracy) / (1 - accuracy), int(meta["bucket_offset"])
+
+        series: Dict[str, List[Dict[str, Any]]] = {}
+        for field in fields:
+            windows: Dict[int, _Window] = {}
+            if step and step % HOUR == 0:
+                _merge(conn, windows, field, HOUR, lo, hi, lambda t: t // step * step)
+            elif step:
+                _merge(conn, windows, field, 60, lo, hi, lambda t: t // step * step)
+            else:
+                # Whole hours from hourly rollups, the minutes around them from minute rollups
+                first_hour, last_hour = -(-lo // HOUR) * HOUR, hi // HOUR * HOUR
+                if first_hour < last_hour:
+                    _merge(conn, windows, field, HOUR, first_hour, last_hour, lambda t: lo)
+                    _merge(conn, windows, field, 60, lo, first_hour, lambda t: lo)
+                    _merge(conn, windows, field, 60, last_hour, hi, lambda t: lo)
+                else:
+                    _merge(conn, windows, field, 60, lo, hi, lambda t: lo)
+            series[field] = [
+                windows[start].point(start, percentiles, gamma, offset)
+                for start in sorted(windows)
+                if windows[start].count
+            ]
+        return series
+    finally:
+        conn.close()
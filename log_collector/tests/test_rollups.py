@@ -0,0 +1,59 @@
+import sys
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip("httpx")
+from fastapi.testclient import TestClient  # noqa: E402
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "log_collector"))
+
+import main  # noqa: E402
+
+
+def _load(name: str, path: Path):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def _load_worker_store():
+    """log_worker/store.py, bound to log_worker's `segments` only while it is imported."""
+    saved = sys.modules.get("segments")
+    try:
+        sys.modules["segments"] = _load("worker_segments", ROOT / "log_worker" / "segments.py")
+        return _load("worker_store", ROOT / "log_worker" / "store.py")
+    finally:
+        sys.modules["segments"] = saved
+
+
+def test_rollups_accept_times_without_zone(tmp_path, monkeypatch):
+    worker_store = _load_worker_store()
+    db = tmp_path / "metrics.db"
+    store = worker_store.MetricsStore(db)
+    logs = [
+        {"stats": [{"request_time": "2026-10-18T10:15:00"}], "timings": {"ttfb": 0.2}},
+        {"stats": [{"request_time": "2026-10-18T10:45:00"}], "timings": {"ttfb": 0.4}},
+    ]
+    store.insert([(1, "a"), (2, "b")], logs)
+    store.close()
+    monkeypatch.setattr(main, "METRICS_DB", db)
+
+    client = TestClient(main.app)
+    # since without a zone, until defaulting to now (aware)
+    response = client.get("/rollups", params={"fields": "ttfb", "since": "2026-10-18T00:00:00"})
+    assert response.status_code == 200, response.text
+    assert response.json()["since"] == "2026-10-18T00:00:00+00:00"
+
+    response = client.get(
+        "/rollups",
+        params={"fields": "ttfb", "since": "2026-10-18T00:00:00", "until": "2026-10-19T00:00:00"},
+    )
+    assert response.status_code == 200, response.text
+    [point] = response.json()["series"]["ttfb"]
+    assert point["start"] == "2026-10-18T10:00:00+00:00"
+    assert point["count"] == 2
+    assert point["min"] == 0.2 and point["max"] == 0.4
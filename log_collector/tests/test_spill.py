@@ -0,0 +1,39 @@
+import sys
+import json
+import asyncio
+from pathlib import Path
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+import main  # noqa: E402
+from spill import SpillLog  # noqa: E402
+
+
+async def _spill_episode(directory: Path, numbers: range, restart: bool) -> None:
+    """Spill logs while Redis is "down", then replay them as the background task does."""
+    if restart or main.spill is None:
+        main.spill = SpillLog(directory, segment_bytes=64)
+    main.spill_reason = "test"
+    for n in numbers:
+        await main.spill.append([json.dumps({"n": n})])
+    await main._replay_spill()
+
+
+def test_replay_across_episodes_and_restarts(tmp_path):
+    async def run():
+        main.redis_conn = fakeredis.aioredis.FakeRedis()
+        # Two episodes in one process (the checkpoint of the first one stays in Redis),
+        # then one after a restart with an empty spill directory
+        await _spill_episode(tmp_path, range(1, 4), restart=True)
+        await _spill_episode(tmp_path, range(4, 8), restart=False)
+        await _spill_episode(tmp_path, range(8, 11), restart=True)
+        entries = await main.redis_conn.xrange(main.STREAM_NAME)
+        return [json.loads(fields[b"data"])["n"] for _, fields in entries]
+
+    assert asyncio.run(run()) == list(range(1, 11))
+    assert not main.spill.pending()
+    assert main.spill_reason is None
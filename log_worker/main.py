@@ -1,23 +1,61 @@
 import os
 import json
-import uuid
+import hashlib
 import time
+import socket
 import logging
+import random
 import asyncio
-from typing import Any, Dict, List
+from collections import OrderedDict, deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
 
 import httpx
 import redis.asyncio as redis
 import numpy as np
 from pathlib import Path
-from sklearn.metrics.pairwise import cosine_similarity
+
+from segments import SegmentWriter
+from store import MetricsStore
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; embeddings are then fetched as JSON
+    msgpack = None
 
 
 # ───────────────────── Configuration ─────────────────────
 REDIS_URL = os.getenv("REDIS_URL", "redis://redis:6379")
-QUEUE_NAME = os.getenv("QUEUE_NAME", "log_queue")
+STREAM_NAME = os.getenv("LOG_STREAM", "log_stream")
+GROUP_NAME = os.getenv("LOG_GROUP", "log_workers")
+# Must be unique per replica; a restarted worker with the same name resumes its own pending entries.
+# Each of the CONSUMERS concurrent consumers of a replica reads as "<CONSUMER_NAME>-<n>".
+CONSUMER_NAME = os.getenv("CONSUMER_NAME") or f"{socket.gethostname()}-{os.getpid()}"
+CONSUMERS = int(os.getenv("CONSUMERS", "4"))
+ENCODE_CONCURRENCY = int(os.getenv("ENCODE_CONCURRENCY", "2"))  # /encode and /vectors calls in flight
+READ_COUNT = int(os.getenv("READ_COUNT", "32"))  # logs per batch: one /encode call for all of them
+BLOCK_MS = int(os.getenv("BLOCK_MS", "5000"))
+CLAIM_IDLE_MS = int(os.getenv("CLAIM_IDLE_MS", "60000"))  # pending this long = consumer presumed dead
+CLAIM_INTERVAL = float(os.getenv("CLAIM_INTERVAL", "30"))
+MAX_DELIVERIES = int(os.getenv("MAX_DELIVERIES", "5"))
+# Entries that failed MAX_DELIVERIES times (or can never succeed) are moved here
+DEAD_LETTER_STREAM = os.getenv("LOG_DEAD_LETTER_STREAM", "log_dead_letters")
+DEAD_LETTER_MAXLEN = int(os.getenv("DEAD_LETTER_MAXLEN", "10000"))
+CONSUMER_EXPIRE_MS = int(os.getenv("CONSUMER_EXPIRE_MS", "3600000"))  # idle consumers without pending entries
+BACKOFF_BASE = float(os.getenv("BACKOFF_BASE", "0.5"))  # seconds, doubled per consecutive failed batch
+BACKOFF_MAX = float(os.getenv("BACKOFF_MAX", "30"))
+# Worker counters are published to this Redis hash (plus the consumer name) for the collector's /metrics
+STATS_KEY_PREFIX = os.getenv("WORKER_STATS_PREFIX", "log_worker:stats:")
+STATS_INTERVAL = 10.0  # seconds
+THROUGHPUT_WINDOW = 60.0  # seconds
 MODEL_URL = os.getenv("MODEL_URL", "http://retrieval:8004")
+MODEL_TRANSPORT = os.getenv("MODEL_TRANSPORT", "json")  # "json" or "msgpack"
+MODEL_HTTP2 = os.getenv("MODEL_HTTP2", "false").lower() == "true"
 LOG_DIR = Path(os.getenv("LOG_DIR", "logs"))
+# Fetch context chunk vectors from the retrieval index by chunk id instead of re-encoding them
+USE_STORED_VECTORS = os.getenv("USE_STORED_VECTORS", "true").lower() == "true"
+EMBED_CACHE_SIZE = int(os.getenv("EMBED_CACHE_SIZE", "10000"))  # vectors kept in memory; 0 disables
+# SQLite file for the numeric fields of processed logs (see store.py); "off" disables
+METRICS_DB = os.getenv("METRICS_DB", str(LOG_DIR / "metrics.db"))
 
 LOG_DIR.mkdir(parents=True, exist_ok=True)
 
@@ -33,44 +71,146 @@ logger = logging.getLogger("worker")
 
 
 # ───────────────────── Helper Functions ─────────────────────
+_client: Optional[httpx.AsyncClient] = None
+# Shared by all consumers, so a slow retrieval service gets at most ENCODE_CONCURRENCY requests
+encode_slots = asyncio.Semaphore(ENCODE_CONCURRENCY)
+
+
+def get_client() -> httpx.AsyncClient:
+    """
+    Shared keep-alive client for the embedding service. With MODEL_TRANSPORT=msgpack
+    embeddings are requested as a binary float32 matrix instead of JSON floats.
+    """
+    global _client
+    if _client is None:
+        headers = {}
+        if MODEL_TRANSPORT == "msgpack" and msgpack is not None:
+            headers["Accept"] = "application/msgpack, application/json;q=0.9"
+        _client = httpx.AsyncClient(
+            timeout=30,
+            headers=headers,
+            http2=MODEL_HTTP2,
+            limits=httpx.Limits(max_keepalive_connections=max(4, ENCODE_CONCURRENCY), keepalive_expiry=60),
+        )
+    return _client
+
+
+def _embeddings(response: httpx.Response) -> Tuple[Dict[str, Any], List[np.ndarray]]:
+    """Response body and its `embeddings`, from JSON or from a msgpack float32 matrix."""
+    if response.headers.get("content-type", "").startswith("application/msgpack"):
+        body = msgpack.unpackb(response.content)
+        packed = body["embeddings"]
+        matrix = np.frombuffer(packed["data"], dtype=packed["dtype"]).reshape(packed["shape"])
+        return body, list(matrix)
+    body = response.json()
+    return body, [np.array(vec, dtype=np.float32) for vec in body["embeddings"]]
+
+
 async def get_embeddings(texts: List[str]) -> List[np.ndarray]:
     """
     Send texts to the embedding model and receive vector representations.
     """
     payload = {"texts": texts}
-    async with httpx.AsyncClient(timeout=30) as client:
-        response = await client.post(f"{MODEL_URL}/encode", json=payload)
-        response.raise_for_status()
-        embeddings = response.json()["embeddings"]
-        return [np.array(vec, dtype=np.float32) for vec in embeddings]
+    async with encode_slots:
+        response = await get_client().post(f"{MODEL_URL}/encode", json=payload)
+    response.raise_for_status()
+    return _embeddings(response)[1]
 
 
-def pairwise_cos(matrix: np.ndarray) -> np.ndarray:
+async def get_stored_vectors(ids: List[str]) -> Dict[str, np.ndarray]:
     """
-    Compute pairwise cosine similarities (upper triangle, excluding diagonal).
+    Stored index vectors of context chunks by chunk id, without running the
+    model. Ids unknown to the index (e.g. after a rebuild) are left out.
     """
-    sims = cosine_similarity(matrix, matrix)
-    return sims[np.triu_indices_from(sims, k=1)]
+    async with encode_slots:
+        response = await get_client().post(f"{MODEL_URL}/vectors", json={"ids": ids})
+    response.raise_for_status()
+    body, vectors = _embeddings(response)
+    return dict(zip(body["ids"], vectors))
 
 
-async def compute_metrics(
-    question: str,
-    chunks: List[str],
-    answer: str,
-    tau: float = 0.7,
-) -> Dict[str, float]:
+def content_key(text: str) -> str:
+    """Hash of a text; the same function as retrieval's chunk ids."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+class EmbeddingCache:
+    """LRU of embeddings keyed by content hash (or chunk id, which is the hash of the indexed text)."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._items: "OrderedDict[str, np.ndarray]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        vector = self._items.get(key)
+        if vector is not None:
+            self._items.move_to_end(key)
+        return vector
+
+    def put(self, key: str, vector: np.ndarray) -> None:
+        if self.capacity <= 0:
+            return
+        self._items[key] = vector
+        self._items.move_to_end(key)
+        while len(self._items) > self.capacity:
+            self._items.popitem(last=False)
+
+
+embedding_cache = EmbeddingCache(EMBED_CACHE_SIZE)
+
+
+async def embed(texts: Dict[str, str], chunk_keys: List[str]) -> Tuple[Dict[str, np.ndarray], Dict[str, int]]:
+    """
+    Vectors for `texts` ({key: text}), looked up in order: the embedding
+    cache, the retrieval index for `chunk_keys` (keys that are chunk ids),
+    then one /encode call for the rest. Returns the vectors by key and how
+    many came from each source.
+    """
+    vectors: Dict[str, np.ndarray] = {}
+    for key in texts:
+        vector = embedding_cache.get(key)
+        if vector is not None:
+            vectors[key] = vector
+    counts = {"cached": len(vectors), "stored": 0, "encoded": 0}
+
+    wanted = [key for key in chunk_keys if key not in vectors]
+    if USE_STORED_VECTORS and wanted:
+        try:
+            stored = await get_stored_vectors(wanted)
+        except httpx.HTTPError as exc:
+            logger.warning(f"[Worker] Stored vector fetch failed, encoding chunks instead: {exc}")
+            stored = {}
+        vectors.update(stored)
+        counts["stored"] = len(stored)
+
+    missing = [key for key in texts if key not in vectors]
+    if missing:
+        vectors.update(zip(missing, await get_embeddings([texts[key] for key in missing])))
+        counts["encoded"] = len(missing)
+
+    for key in texts:
+        embedding_cache.put(key, vectors[key])
+    return vectors, counts
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
     """
-    Compute quality metrics between question, context and answer.
+    L2-normalize embeddings so dot products are cosine similarities. The
+    model already returns unit vectors; this only guards against drift and
+    leaves zero vectors at zero.
     """
-    t0 = time.time()
-    texts = [question, answer] + chunks
-    embs = await get_embeddings(texts)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
 
-    q_emb, a_emb, c_embs = embs[0], embs[1], embs[2:]
 
-    if not c_embs:
+def log_metrics(sims: np.ndarray, q: int, a: int, c: List[int], tau: float) -> Dict[str, float]:
+    """
+    Quality metrics of one log from the cosine similarity matrix of the batch
+    texts, given the row of its question, its answer and its chunks.
+    """
+    if not c:
         return {
-            "answer_relevancy": float(cosine_similarity([q_emb], [a_emb])[0][0]),
+            "answer_relevancy": float(sims[q, a]),
             "context_relevancy_avg": 0.0,
             "context_precision": 0.0,
             "context_recall": 0.0,
@@ -78,103 +218,494 @@ async def compute_metrics(
             "context_density": 0.0,
             "max_context_overlap": 0.0,
             "context_redundancy": 0.0,
-            "metrics_total_time_ms": (time.time() - t0) * 1000,
         }
 
-    sim_q_a = cosine_similarity([q_emb], [a_emb])[0][0]
-    sim_q_c = cosine_similarity([q_emb], c_embs)[0]
-    sim_a_c = cosine_similarity([a_emb], c_embs)[0]
+    sim_q_c = sims[q, c]
+    sim_a_c = sims[a, c]
+    pairs = sims[np.ix_(c, c)][np.triu_indices(len(c), k=1)]
 
     return {
-        "answer_relevancy": float(sim_q_a),
+        "answer_relevancy": float(sims[q, a]),
         "context_relevancy_avg": float(sim_q_c.mean()),
-        "context_precision": float((sim_q_c > tau).sum() / len(c_embs)),
-        "context_recall": float((sim_a_c > tau).sum() / len(c_embs)),
-        "faithfulness_approx": float((sim_a_c > tau).sum() / len(c_embs)),
+        "context_precision": float((sim_q_c > tau).sum() / len(c)),
+        "context_recall": float((sim_a_c > tau).sum() / len(c)),
+        "faithfulness_approx": float((sim_a_c > tau).sum() / len(c)),
         "context_density": float(sim_a_c.mean()),
         "max_context_overlap": float(sim_q_c.max()),
-        "context_redundancy": float(pairwise_cos(np.vstack(c_embs)).mean()) if len(c_embs) > 1 else 0.0,
-        "metrics_total_time_ms": (time.time() - t0) * 1000,
+        "context_redundancy": float(pairs.mean()) if len(c) > 1 else 0.0,
     }
 
 
-def save_unique_log(log: Dict[str, Any], crushed: bool = False) -> None:
+async def compute_metrics_batch(
+    items: List[Tuple[str, List[str], str, List[Optional[str]]]],
+    tau: float = 0.7,
+) -> List[Dict[str, float]]:
     """
-    Save log to a uniquely named JSON file in LOG_DIR.
+    Compute quality metrics between question, context and answer for a batch
+    of (question, chunks, answer, chunk ids). Texts repeated across the batch
+    are embedded once: chunks with an id use their stored index vector, the
+    rest go through the embedding cache and a single /encode call. Every
+    similarity comes from one Gram matrix of the normalized embeddings.
     """
-    timestamp_ms = int(time.time() * 1000)
-    unique_id = uuid.uuid4().hex
-    filename = f"log_{timestamp_ms}_{unique_id}.json"
-    if crushed:
-        filename = filename.replace("log", "log_crushed", 1)
+    t0 = time.perf_counter()
+    texts: Dict[str, str] = {}
+    chunk_keys: Dict[str, None] = {}
+    rows: List[Tuple[str, str, List[str]]] = []
+    for question, chunks, answer, ids in items:
+        q, a = content_key(question), content_key(answer)
+        texts.setdefault(q, question)
+        texts.setdefault(a, answer)
+        c = []
+        for chunk, cid in zip(chunks, ids):
+            key = cid or content_key(chunk)
+            texts.setdefault(key, chunk)  # encoded from the logged text if the id is unknown
+            if cid:
+                chunk_keys[cid] = None
+            c.append(key)
+        rows.append((q, a, c))
+
+    vectors, counts = await embed(texts, list(chunk_keys))
+    t_encoded = time.perf_counter()
+    position = {key: n for n, key in enumerate(texts)}
+    embs = normalize_rows(np.vstack([vectors[key] for key in texts]).astype(np.float32))
+    sims = embs @ embs.T
+    metrics = [
+        log_metrics(sims, position[q], position[a], [position[key] for key in c], tau) for q, a, c in rows
+    ]
+    t_done = time.perf_counter()
+
+    total_texts = sum(2 + len(chunks) for _, chunks, _, _ in items)
+    logger.info(
+        f"[Worker] Metrics batch: {len(items)} logs, {len(texts)}/{total_texts} unique texts "
+        f"({counts['cached']} cached, {counts['stored']} stored, {counts['encoded']} encoded), "
+        f"embed {(t_encoded - t0) * 1000:.0f} ms, similarities {(t_done - t_encoded) * 1000:.1f} ms, "
+        f"{len(items) / (t_done - t0):.1f} logs/s"
+    )
+    per_log_ms = (t_done - t0) * 1000 / len(items)
+    for m in metrics:
+        m["metrics_total_time_ms"] = per_log_ms  # the batch time, shared evenly
+        m["metrics_batch_size"] = len(items)
+    return metrics
+
+
+# Processed logs go to this worker's hourly segment in LOG_DIR (see segments.py)
+segment_writer = SegmentWriter(LOG_DIR, CONSUMER_NAME)
+metrics_store = MetricsStore(Path(METRICS_DB)) if METRICS_DB != "off" else None
+_segment_lock = asyncio.Lock()
+
+
+def log_id(entry_id: bytes) -> str:
+    """
+    Id of the log of a stream entry: the same on every delivery of the entry,
+    so a log saved before a crash or failed XACK is not stored twice in the
+    metrics store (its UNIQUE log_id) when the entry is processed again.
+    """
+    return hashlib.blake2b(STREAM_NAME.encode() + b"/" + entry_id, digest_size=16).hexdigest()
 
-    filepath = LOG_DIR / filename
 
+def _persist(logs: List[Dict[str, Any]], ids: List[str]) -> None:
+    # Keys sort by the time of processing, which /logs cursors follow; only the id is derived from the entry
+    now_ms = int(time.time() * 1000)
+    keys = segment_writer.append(logs, [(now_ms, id_) for id_ in ids])
+    if metrics_store is None:
+        return
     try:
-        with filepath.open("w", encoding="utf-8") as f:
-            json.dump(log, f, ensure_ascii=False, indent=2)
+        metrics_store.insert(keys, logs)
     except Exception as e:
-        logger.warning(f"[Worker] Failed to write log {filename}: {e}")
+        # The segment already holds the logs; `python store.py backfill` can add the rows later
+        logger.warning(f"[Worker] Failed to insert {len(logs)} logs into the metrics store: {e}")
 
 
-# ───────────────────── Core Logic ─────────────────────
-async def process_log(rds: redis.Redis) -> None:
+async def save_logs(logs: List[Dict[str, Any]], ids: List[str]) -> bool:
+    """
+    Append logs (with their `log_id`s) to the current segment as one
+    compressed member and their numeric fields to the metrics store, off the
+    event loop. Returns True once they are durable in the segment.
+    """
+    try:
+        async with _segment_lock:
+            await asyncio.to_thread(_persist, logs, ids)
+        return True
+    except Exception as e:
+        logger.warning(f"[Worker] Failed to write {len(logs)} logs: {e}")
+        return False
+
+
+# ───────────────────── Worker Metrics ─────────────────────
+class WorkerStats:
     """
-    Main Redis queue processing loop.
+    Log outcomes and batch times of this worker process, and logs/s over the
+    last THROUGHPUT_WINDOW seconds. Published to Redis for the collector's /metrics.
     """
+
+    def __init__(self) -> None:
+        self.logs: Dict[str, int] = {"saved": 0, "skipped": 0, "retried": 0, "dead": 0}
+        self.batches: int = 0
+        self.batch_seconds: float = 0.0
+        self._recent: Deque[Tuple[float, int]] = deque()
+
+    def record(self, outcomes: Dict[str, int], seconds: Optional[float]) -> None:
+        """Count log outcomes; `seconds` is the batch time, None for work that is not a processed batch."""
+        now = time.monotonic()
+        for outcome, n in outcomes.items():
+            self.logs[outcome] += n
+        if seconds is not None:
+            self.batches += 1
+            self.batch_seconds += seconds
+        self._recent.append((now, outcomes.get("saved", 0) + outcomes.get("skipped", 0)))
+        self._trim(now)
+
+    def logs_per_second(self) -> float:
+        self._trim(time.monotonic())
+        return sum(n for _, n in self._recent) / THROUGHPUT_WINDOW
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            **self.logs,
+            "batches": self.batches,
+            "batch_seconds": self.batch_seconds,
+            "logs_per_second": self.logs_per_second(),
+            "consumers": CONSUMERS,
+        }
+
+    def _trim(self, now: float) -> None:
+        while self._recent and self._recent[0][0] < now - THROUGHPUT_WINDOW:
+            self._recent.popleft()
+
+
+stats = WorkerStats()
+
+
+async def publish_stats(rds: redis.Redis) -> None:
+    """Write the worker counters to Redis every STATS_INTERVAL seconds; they expire if the worker stops."""
+    key = STATS_KEY_PREFIX + CONSUMER_NAME
     while True:
-        log: Dict[str, Any] = {}
-        raw = None
+        try:
+            async with rds.pipeline(transaction=True) as pipe:
+                pipe.hset(key, mapping=stats.snapshot())
+                pipe.expire(key, int(STATS_INTERVAL * 3))
+                await pipe.execute()
+        except Exception as exc:
+            logger.warning(f"[Worker] Failed to publish stats: {exc}")
+        await asyncio.sleep(STATS_INTERVAL)
+
 
+# ───────────────────── Core Logic ─────────────────────
+def extract_texts(log: Dict[str, Any]) -> Tuple[str, List[str], str, List[Optional[str]]]:
+    """Question, context chunks, answer and the index chunk id of each chunk (if logged) of a log."""
+    question = ""
+    chunks: List[str] = []
+    ids: List[Optional[str]] = []
+    answer = ""
+
+    for block in log.get("texts", []):
+        if "question" in block:
+            question = block["question"]["text"]
+        elif "context" in block:
+            items = [item for item in block["context"].get("items", []) if "text" in item]
+            chunks = [item["text"] for item in items]
+            ids = [item.get("id") for item in items]
+        elif "answer" in block:
+            answer = block["answer"]["text"]
+
+    return question, chunks, answer, ids
+
+
+async def process_entries(entries: List[Tuple[bytes, bytes]]) -> List[Tuple[str, Optional[str]]]:
+    """
+    Compute metrics for a batch of queued logs, given as (stream entry id,
+    raw log), and save them.
+
+    Returns an (outcome, error) per log: "saved", "skipped" (incomplete
+    data), "retry" (metrics or the segment write failed; worth another
+    delivery) or "dead" (the entry is not a valid log and never will be).
+    """
+    outcomes: List[Tuple[str, Optional[str]]] = [("retry", None)] * len(entries)
+    logs: Dict[int, Dict[str, Any]] = {}
+    texts: Dict[int, Tuple[str, List[str], str, List[Optional[str]]]] = {}
+
+    for i, (_, raw) in enumerate(entries):
         try:
-            _, raw = await rds.blpop(QUEUE_NAME)
             log = json.loads(raw)
+            question, chunks, answer, ids = extract_texts(log)
+        except Exception as exc:
+            logger.warning(f"[Worker] Invalid log entry: {exc}")
+            outcomes[i] = ("dead", f"invalid log: {exc}")
+            continue
+        if not all([question, chunks, answer]):
+            logger.warning("[Worker] Skipped: incomplete data")
+            outcomes[i] = ("skipped", None)
+            continue
+        logs[i] = log
+        texts[i] = (question, chunks, answer, ids)
+
+    if not texts:
+        return outcomes
+    try:
+        for i, metrics in zip(texts, await compute_metrics_batch(list(texts.values()))):
+            logs[i]["metrics"] = metrics
+    except Exception as metric_error:
+        logger.warning(f"[Worker] Metric computation failed for {len(texts)} logs: {metric_error}")
+        if len(texts) == 1 or isinstance(metric_error, httpx.TransportError):
+            for i in texts:
+                outcomes[i] = ("retry", f"metrics failed: {metric_error}")
+            return outcomes
+        # The service answered, so one log may be to blame: compute them one by one
+        for i in list(texts):
+            try:
+                logs[i]["metrics"] = (await compute_metrics_batch([texts[i]]))[0]
+            except Exception as exc:
+                outcomes[i] = ("retry", f"metrics failed: {exc}")
+                del logs[i]
+
+    if logs and await save_logs(list(logs.values()), [log_id(entries[i][0]) for i in logs]):
+        for i, log in logs.items():
+            outcomes[i] = ("saved", None)
+            logger.info(
+                f"[Worker] Processed log — "
+                f"{log.get('stats', [{}])[0].get('request_time', 'N/A')}"
+            )
+    else:
+        for i in logs:
+            outcomes[i] = ("retry", "segment write failed")
+
+    return outcomes
+
+
+async def dead_letter(rds: redis.Redis, consumer: str, dead: List[Tuple[bytes, bytes, str]]) -> None:
+    """Move (entry id, data, error) entries to DEAD_LETTER_STREAM and acknowledge them, atomically."""
+    async with rds.pipeline(transaction=True) as pipe:
+        for entry_id, data, error in dead:
+            pipe.xadd(
+                DEAD_LETTER_STREAM,
+                {"data": data, "entry_id": entry_id, "error": error, "consumer": consumer},
+                maxlen=DEAD_LETTER_MAXLEN,
+                approximate=True,
+            )
+        pipe.xack(STREAM_NAME, GROUP_NAME, *[entry_id for entry_id, _, _ in dead])
+        await pipe.execute()
+    for entry_id, _, error in dead:
+        logger.warning(f"[Worker] Dead-lettered {entry_id!r}: {error}")
 
-            question = ""
-            chunks: List[str] = []
-            answer = ""
 
-            for block in log.get("texts", []):
-                if "question" in block:
-                    question = block["question"]["text"]
-                elif "context" in block:
-                    chunks = [item["text"] for item in block["context"].get("items", []) if "text" in item]
-                elif "answer" in block:
-                    answer = block["answer"]["text"]
+async def delivery_counts(rds: redis.Redis, consumer: str, entries: List[Tuple[bytes, Any]]) -> Dict[bytes, int]:
+    """
+    How many times each of `entries` has been delivered, looked up id by id
+    (one pipelined round trip): a range over the first to last id would also
+    return the consumer's other pending entries in between and, capped at
+    len(entries), miss some of these. Ids no longer pending for `consumer`
+    are left out.
+    """
+    if not entries:
+        return {}
+    async with rds.pipeline(transaction=False) as pipe:
+        for entry_id, _ in entries:
+            pipe.xpending_range(STREAM_NAME, GROUP_NAME, entry_id, entry_id, 1, consumername=consumer)
+        results = await pipe.execute()
+    return {p["message_id"]: p["times_delivered"] for pending in results for p in pending}
+
+
+def known_deliveries(
+    consumer: str, entries: List[Tuple[bytes, Any]], deliveries: Dict[bytes, int]
+) -> List[Tuple[bytes, Any]]:
+    """Entries whose delivery count is known; the rest (acked or claimed meanwhile) are left alone."""
+    known = [(entry_id, fields) for entry_id, fields in entries if entry_id in deliveries]
+    if len(known) < len(entries):
+        logger.warning(f"[Worker] {len(entries) - len(known)} entries no longer pending for {consumer}; skipped")
+    return known
+
+
+async def handle_entries(
+    rds: redis.Redis,
+    consumer: str,
+    entries: List[Tuple[bytes, Optional[Dict[bytes, bytes]]]],
+    deliveries: Optional[Dict[bytes, int]] = None,
+) -> int:
+    """
+    Process stream entries as one batch. Persisted and skipped entries are
+    acknowledged together; failed ones stay pending to be claimed again
+    after CLAIM_IDLE_MS, and go to the dead-letter stream on their
+    MAX_DELIVERIES-th delivery (`deliveries`, by entry id; None for entries
+    read for the first time).
+    Returns the number of entries left for a retry.
+    """
+    if not entries:
+        return 0
+    t0 = time.perf_counter()
+    # Entries trimmed from the stream while pending come back without fields
+    live = [(entry_id, fields) for entry_id, fields in entries if fields is not None]
+    outcomes = await process_entries([(entry_id, fields.get(b"data", b"")) for entry_id, fields in live])
+
+    ack = [entry_id for entry_id, fields in entries if fields is None]
+    dead: List[Tuple[bytes, bytes, str]] = []
+    counts = {"saved": 0, "skipped": 0, "retried": 0, "dead": 0}
+    for (entry_id, fields), (outcome, error) in zip(live, outcomes):
+        delivered = deliveries[entry_id] if deliveries is not None else 1
+        if outcome == "retry" and delivered >= MAX_DELIVERIES:
+            outcome, error = "dead", f"{error} (delivery {delivered})"
+        if outcome == "retry":
+            counts["retried"] += 1
+        elif outcome == "dead":
+            counts["dead"] += 1
+            dead.append((entry_id, fields.get(b"data", b""), error))
+        else:
+            counts[outcome] += 1
+            ack.append(entry_id)
+
+    if dead:
+        await dead_letter(rds, consumer, dead)
+    if ack:
+        await rds.xack(STREAM_NAME, GROUP_NAME, *ack)
+    stats.record(counts, time.perf_counter() - t0)
+    return counts["retried"]
+
+
+async def ensure_group(rds: redis.Redis) -> None:
+    """Create the stream and consumer group if missing (the collector does the same)."""
+    try:
+        await rds.xgroup_create(STREAM_NAME, GROUP_NAME, id="0", mkstream=True)
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
 
-            if not all([question, chunks, answer]):
-                logger.warning("[Worker] Skipped: incomplete data")
+async def reclaim_stale(rds: redis.Redis, consumer: str) -> None:
+    """
+    Take over entries pending for longer than CLAIM_IDLE_MS (left by dead
+    workers, or failed and waiting for a retry) and process them as
+    `consumer`. Entries delivered more than MAX_DELIVERIES times, e.g. one
+    that crashes the worker, are dead-lettered without processing.
+    """
+    start = "0-0"
+    while True:
+        next_id, entries, *_ = await rds.xautoclaim(
+            STREAM_NAME, GROUP_NAME, consumer, CLAIM_IDLE_MS, start_id=start, count=READ_COUNT
+        )
+        deliveries = await delivery_counts(rds, consumer, entries)
+        batch, dead = [], []
+        for entry_id, fields in known_deliveries(consumer, entries, deliveries):
+            delivered = deliveries[entry_id]
+            if fields is not None and delivered > MAX_DELIVERIES:
+                dead.append((entry_id, fields.get(b"data", b""), f"gave up after {delivered - 1} deliveries"))
                 continue
+            logger.info(f"[Worker] Reclaimed stale entry {entry_id!r} (delivery {delivered})")
+            batch.append((entry_id, fields))
+        if dead:
+            await dead_letter(rds, consumer, dead)
+            stats.record({"dead": len(dead)}, None)
+        if batch:
+            await handle_entries(rds, consumer, batch, deliveries)
+        if next_id in (b"0-0", "0-0"):
+            return
+        start = next_id
+
+
+async def remove_idle_consumers(rds: redis.Redis, own: List[str]) -> None:
+    """
+    Delete consumers idle for CONSUMER_EXPIRE_MS with nothing pending, e.g.
+    those of replicas that restarted under a new hostname-pid name.
+    """
+    for info in await rds.xinfo_consumers(STREAM_NAME, GROUP_NAME):
+        name = info["name"].decode() if isinstance(info["name"], bytes) else info["name"]
+        if name not in own and not info["pending"] and info["idle"] >= CONSUMER_EXPIRE_MS:
+            await rds.xgroup_delconsumer(STREAM_NAME, GROUP_NAME, name)
+            logger.info(f"[Worker] Removed idle consumer '{name}'")
 
-            try:
-                log["metrics"] = await compute_metrics(question, chunks, answer)
-            except Exception as metric_error:
-                logger.warning(f"[Worker] Metric computation failed: {metric_error}")
 
-            save_unique_log(log)
+def backoff(failures: int) -> float:
+    """Full-jitter exponential backoff: uniform in [0, min(BACKOFF_MAX, BACKOFF_BASE * 2^(failures-1))]."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** min(failures - 1, 30)))
 
-            logger.info(
-                f"[Worker] Processed log — "
-                f"{log.get('stats', [{}])[0].get('request_time', 'N/A')}"
+
+async def claim_loop(rds: redis.Redis, consumers: List[str]) -> None:
+    """Every CLAIM_INTERVAL seconds, claim stale entries into the first consumer and drop idle consumers."""
+    failures = 0
+    while True:
+        try:
+            await reclaim_stale(rds, consumers[0])
+            await remove_idle_consumers(rds, consumers)
+            failures = 0
+        except Exception as exc:
+            failures += 1
+            logger.exception(f"[Worker] Reclaim error: {exc}")
+        await asyncio.sleep(CLAIM_INTERVAL + (backoff(failures) if failures else 0))
+
+
+async def consume(rds: redis.Redis, consumer: str) -> None:
+    """
+    One consumer of the group: reads up to READ_COUNT entries at a time and
+    processes them as a batch. It first re-reads its own pending entries
+    (left by a previous run under the same name), then new ones.
+
+    After a batch with failures, or an error, the consumer backs off with
+    jittered exponential delays; failed entries do not block it, they stay
+    pending for a later retry or the dead-letter stream.
+    """
+    pending_cursor: Optional[Any] = "0"  # own pending entries first, then new ones (">")
+    failures = 0
+
+    while True:
+        try:
+            response = await rds.xreadgroup(
+                GROUP_NAME,
+                consumer,
+                {STREAM_NAME: pending_cursor or ">"},
+                count=READ_COUNT,
+                block=None if pending_cursor else BLOCK_MS,
             )
+            entries = response[0][1] if response else []
+            if pending_cursor and not entries:
+                pending_cursor = None
+                continue
 
+            deliveries = None
+            if pending_cursor:
+                pending_cursor = entries[-1][0]
+                deliveries = await delivery_counts(rds, consumer, entries)
+                entries = known_deliveries(consumer, entries, deliveries)
+            retried = await handle_entries(rds, consumer, entries, deliveries)
+            failures = failures + 1 if retried else 0
+
+        except redis.ResponseError as exc:
+            if "NOGROUP" in str(exc):
+                logger.warning("[Worker] Stream or group missing — recreating")
+                await ensure_group(rds)
+                continue
+            logger.exception(f"[Worker] Redis error: {exc}")
+            failures += 1
         except Exception as exc:
             logger.exception(f"[Worker] Processing error: {exc}")
-            try:
-                if log:
-                    save_unique_log(log, crushed=True)
-                elif raw:
-                    save_unique_log({"raw": raw.decode("utf-8", errors="replace")}, crushed=True)
-                else:
-                    logger.warning("[Worker] Unable to save failed log: no data")
-            except Exception as write_error:
-                logger.warning(f"[Worker] Failed to write broken log: {write_error}")
+            failures += 1
 
-            await asyncio.sleep(1)
+        if failures:
+            delay = backoff(failures)
+            logger.warning(f"[Worker] {consumer}: {failures} failed batches in a row, backing off {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+
+async def process_log(rds: redis.Redis) -> None:
+    """
+    Main loop: CONSUMERS concurrent consumers of the log stream in the
+    consumer group, sharing one HTTP client and ENCODE_CONCURRENCY slots for
+    embedding calls, plus the stale entry claimer and the stats publisher.
+
+    Entries are acknowledged only after they are persisted, so a crash
+    leaves them pending. Any number of replicas can consume the same group.
+    """
+    await ensure_group(rds)
+    consumers = [f"{CONSUMER_NAME}-{n}" for n in range(max(1, CONSUMERS))]
+    await asyncio.gather(
+        *(consume(rds, consumer) for consumer in consumers),
+        claim_loop(rds, consumers),
+        publish_stats(rds),
+    )
 
 
 async def main() -> None:
-    logger.info("[Worker] Starting log_worker...")
+    logger.info(
+        f"[Worker] Starting log_worker '{CONSUMER_NAME}' with {CONSUMERS} consumers of '{GROUP_NAME}', "
+        f"{ENCODE_CONCURRENCY} encode slots..."
+    )
     redis_client = await redis.from_url(REDIS_URL)
     await process_log(redis_client)
 
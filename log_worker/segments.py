@@ -0,0 +1,234 @@
+"""
+Processed logs as hourly gzip JSONL segments with a sidecar index.
+
+Every writer (worker replica) appends to its own segment per UTC hour,
+`logs_<YYYYMMDDHH>_<writer>.jsonl.gz`: a sequence of gzip members, one per
+batch, each holding one compact JSON log per line. Next to it,
+`logs_<YYYYMMDDHH>_<writer>.idx` has one JSON line per member,
+{"offset", "length", "keys": [[unix ms, hex id], ...]}, with the (time, id)
+key of every log of the member in line order. Readers (the collector's
+/logs) find members through the index alone and seek straight to them;
+data without an index line is not visible.
+
+Run as a script to move legacy `log_<ms>_<id>.json` files into segments:
+    python segments.py migrate [--dir LOG_DIR] [--keep]
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import zlib
+import logging
+import argparse
+from datetime import datetime, timezone
+from itertools import groupby
+from pathlib import Path
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+logger = logging.getLogger("worker")
+
+Key = Tuple[int, str]  # (unix ms, hex id); the same key as the legacy file names
+
+LEGACY_NAME = re.compile(r"^log_(?:crushed_)?(\d+)_([0-9a-f]+)\.json$")
+COMPRESS_LEVEL = 6
+MIGRATE_BATCH = 256  # logs per member when migrating
+
+
+def hour_of(ms: int) -> str:
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y%m%d%H")
+
+
+class SegmentWriter:
+    """
+    Appends batches of logs to this writer's segment of the current hour.
+
+    `append` returns once the member and its index line are fsynced, so a
+    caller may acknowledge the logs afterwards. The first write of a new
+    hour starts a new segment (rotation). When an existing segment is
+    reopened after a crash, an index line torn mid-write and data past
+    the last indexed member are cut off. Not safe for concurrent use: callers
+    serialize appends.
+    """
+
+    def __init__(self, directory: Path, writer: str):
+        self.dir = directory
+        self.writer = re.sub(r"[^A-Za-z0-9.-]", "-", writer)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.hour: Optional[str] = None
+        self._data: Optional[BinaryIO] = None
+        self._index: Optional[BinaryIO] = None
+
+    def append(self, logs: List[Dict[str, Any]], keys: Optional[List[Key]] = None) -> List[Key]:
+        """Write logs (one member per hour they fall in) and return their keys; new keys use the current time."""
+        if keys is None:
+            now_ms = int(time.time() * 1000)
+            keys = [(now_ms, uuid.uuid4().hex) for _ in logs]
+        rows = sorted(zip(keys, logs), key=lambda row: row[0])
+        for hour, group in groupby(rows, key=lambda row: hour_of(row[0][0])):
+            group = list(group)
+            body = b"".join(
+                json.dumps(log, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+                for _, log in group
+            )
+            self._write(hour, zlib.compress(body, COMPRESS_LEVEL, wbits=31), [key for key, _ in group])
+        return keys
+
+    def close(self) -> None:
+        for f in (self._data, self._index):
+            if f is not None:
+                f.close()
+        self._data = self._index = None
+        self.hour = None
+
+    def paths(self, hour: str) -> Tuple[Path, Path]:
+        stem = f"logs_{hour}_{self.writer}"
+        return self.dir / f"{stem}.jsonl.gz", self.dir / f"{stem}.idx"
+
+    def _write(self, hour: str, member: bytes, keys: List[Key]) -> None:
+        if hour != self.hour:
+            self._open(hour)
+        offset = self._data.seek(0, os.SEEK_END)
+        self._data.write(member)
+        self._data.flush()
+        os.fsync(self._data.fileno())
+        entry = {"offset": offset, "length": len(member), "keys": [list(key) for key in keys]}
+        self._index.write(json.dumps(entry, separators=(",", ":")).encode() + b"\n")
+        self._index.flush()
+        os.fsync(self._index.fileno())
+
+    def _open(self, hour: str) -> None:
+        self.close()
+        data_path, index_path = self.paths(hour)
+        created = not data_path.exists()
+        if not created:
+            repair(data_path, index_path)
+        self._data = data_path.open("ab")
+        self._index = index_path.open("ab")
+        self.hour = hour
+        if created:
+            fd = os.open(self.dir, os.O_RDONLY)
+            try:
+                os.fsync(fd)  # make the new files' directory entries durable
+            finally:
+                os.close(fd)
+        logger.info(f"[Segments] Writing to {data_path.name}")
+
+
+def read_index(index_path: Path) -> List[Tuple[Dict[str, Any], int]]:
+    """Complete entries of a segment index, each with the index file offset after its line."""
+    entries: List[Tuple[Dict[str, Any], int]] = []
+    end = 0
+    try:
+        raw = index_path.read_bytes()
+    except FileNotFoundError:
+        return entries
+    for line in raw.split(b"\n")[:-1]:  # the last piece is empty or a torn line
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            break
+        end += len(line) + 1
+        entries.append((entry, end))
+    return entries
+
+
+def read_segment(data_path: Path) -> Iterator[Tuple[Key, Dict[str, Any]]]:
+    """Every indexed log of a segment with its key, member by member."""
+    index_path = data_path.with_name(data_path.name[: -len(".jsonl.gz")] + ".idx")
+    with data_path.open("rb") as f:
+        for entry, _ in read_index(index_path):
+            f.seek(entry["offset"])
+            lines = zlib.decompress(f.read(entry["length"]), 31).split(b"\n")
+            for (ms, hex_id), line in zip(entry["keys"], lines):
+                yield (ms, hex_id), json.loads(line)
+
+
+def repair(data_path: Path, index_path: Path) -> None:
+    """Cut a torn index line, index entries past the data, and data past the last indexed member."""
+    entries = read_index(index_path)
+    size = data_path.stat().st_size
+    while entries and entries[-1][0]["offset"] + entries[-1][0]["length"] > size:
+        entries.pop()
+    index_end = entries[-1][1] if entries else 0
+    data_end = entries[-1][0]["offset"] + entries[-1][0]["length"] if entries else 0
+    if index_path.exists() and index_path.stat().st_size > index_end:
+        logger.warning(f"[Segments] Truncating torn index of {index_path.name} at {index_end}")
+        with index_path.open("r+b") as f:
+            f.truncate(index_end)
+    if size > data_end:
+        logger.warning(
+            f"[Segments] Truncating unindexed data of {data_path.name} at {data_end} ({size - data_end} bytes)"
+        )
+        with data_path.open("r+b") as f:
+            f.truncate(data_end)
+
+
+def migrate(directory: Path, keep: bool = False) -> int:
+    """
+    Move legacy per-request log files into segments of the writer `migrated`,
+    MIGRATE_BATCH logs per member, keeping their keys (so /logs cursors stay
+    valid). Files are deleted once their member is indexed, unless `keep`.
+    Safe to rerun after a crash: logs already in a migrated segment are not
+    written twice. Returns the number of logs migrated.
+    """
+    writer = SegmentWriter(directory, "migrated")
+    done: Set[Key] = set()
+    for index_path in directory.glob(f"logs_*_{writer.writer}.idx"):
+        for entry, _ in read_index(index_path):
+            done.update((ms, hex_id) for ms, hex_id in entry["keys"])
+
+    files: List[Tuple[Key, Path]] = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            match = LEGACY_NAME.match(entry.name)
+            if match:
+                files.append(((int(match.group(1)), match.group(2)), Path(entry.path)))
+    files.sort()
+
+    migrated = 0
+    try:
+        for hour, group in groupby(files, key=lambda item: hour_of(item[0][0])):
+            group = list(group)
+            for start in range(0, len(group), MIGRATE_BATCH):
+                batch = group[start:start + MIGRATE_BATCH]
+                keys: List[Key] = []
+                logs: List[Dict[str, Any]] = []
+                for key, path in batch:
+                    if key in done:
+                        continue
+                    try:
+                        logs.append(json.loads(path.read_bytes()))
+                    except (OSError, ValueError) as e:
+                        logger.warning(f"[Segments] Skipping {path.name}: {e}")
+                        continue
+                    keys.append(key)
+                if logs:
+                    writer.append(logs, keys)
+                    done.update(keys)
+                    migrated += len(logs)
+                if not keep:
+                    for key, path in batch:
+                        if key in done:
+                            path.unlink(missing_ok=True)
+            logger.info(f"[Segments] Migrated hour {hour}: {migrated} logs so far")
+    finally:
+        writer.close()
+    return migrated
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Move legacy log files into compressed segments")
+    parser.add_argument("command", choices=["migrate"])
+    parser.add_argument("--dir", default=os.getenv("LOG_DIR", "logs"))
+    parser.add_argument("--keep", action="store_true", help="do not delete migrated files")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    migrated = migrate(Path(args.dir), keep=args.keep)
+    print(f"Migrated {migrated} logs into segments in {args.dir}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
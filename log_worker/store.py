@@ -0,0 +1,288 @@
+"""
+Flat numeric fields of processed logs (timings, stats, metrics) in an
+embedded SQLite database, so the collector's /query endpoints can filter
+and aggregate them without reading the log segments.
+
+One row per log, keyed by its segment key (unix ms, hex id). Written in
+WAL mode, one transaction per batch; readers are not blocked by the worker
+and several worker processes can share the file (writes take turns).
+
+Every ROLLUP_FIELDS value is also added to per-minute and per-hour rollups
+(by request time): count, sum, min, max and a log-bucket histogram with
+RELATIVE_ACCURACY relative error on quantiles (as in DDSketch). Rollups of
+any time range merge by adding bucket counts, which the upserts do in SQL,
+so concurrent workers need no read-modify-write.
+
+Run as a script to load logs already in segments (idempotent), or to
+recompute the rollups from the stored rows:
+    python store.py backfill|rollups [--dir LOG_DIR] [--db METRICS_DB]
+"""
+
+import os
+import math
+import sqlite3
+import logging
+import argparse
+from collections import Counter
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from segments import Key, read_segment
+
+logger = logging.getLogger("worker")
+
+TIMING_FIELDS = (
+    "faiss_time", "rerank_time", "chunk_gen_time", "ttfb", "model_time", "prompt_ms",
+    "prompt_per_token_ms", "predicted_ms", "predicted_per_token_ms", "all_time",
+)
+STAT_FIELDS = ("generated_tokens", "question_context_tokens", "total_tokens", "compression_ratio")
+METRIC_FIELDS = (
+    "answer_relevancy", "context_relevancy_avg", "context_precision", "context_recall",
+    "faithfulness_approx", "context_density", "max_context_overlap", "context_redundancy",
+    "metrics_total_time_ms", "metrics_batch_size",
+)
+TEXT_FIELDS = ("len_question", "len_context", "len_answer", "chunks")
+NUMERIC_FIELDS = TIMING_FIELDS + STAT_FIELDS + METRIC_FIELDS + TEXT_FIELDS
+COLUMNS = ("log_ms", "log_id", "request_time", "ip", "finish_reason", "degradations", "question") + NUMERIC_FIELDS
+ROLLUP_FIELDS = TIMING_FIELDS + METRIC_FIELDS[:-1] + ("generated_tokens", "total_tokens")
+RESOLUTIONS = (60, 3600)  # seconds: per-minute rollups, and per-hour ones for long ranges
+
+# Histogram buckets: value v > 0 falls in bucket ceil(log_gamma(v)) (+ OFFSET), -v in the
+# mirrored negative bucket, |v| < MIN_VALUE in bucket 0. Bucket order is value order.
+RELATIVE_ACCURACY = 0.01
+GAMMA = (1 + RELATIVE_ACCURACY) / (1 - RELATIVE_ACCURACY)
+MIN_VALUE = 1e-9
+OFFSET = 100000
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS logs (
+    log_ms INTEGER NOT NULL,
+    log_id TEXT NOT NULL,
+    request_time TEXT,  -- ISO 8601, UTC, as logged by rag_app
+    ip TEXT,
+    finish_reason TEXT,
+    degradations TEXT,  -- comma separated
+    question TEXT,
+    {", ".join(f"{name} REAL" for name in NUMERIC_FIELDS)},
+    PRIMARY KEY (log_ms, log_id)
+);
+-- A log processed again after a crash or failed XACK has a new log_ms but the same log_id
+CREATE UNIQUE INDEX IF NOT EXISTS logs_log_id ON logs (log_id);
+CREATE INDEX IF NOT EXISTS logs_request_time ON logs (request_time);
+CREATE INDEX IF NOT EXISTS logs_ip ON logs (ip, request_time);
+CREATE INDEX IF NOT EXISTS logs_finish_reason ON logs (finish_reason, request_time);
+CREATE TABLE IF NOT EXISTS rollups (
+    field TEXT NOT NULL,
+    resolution INTEGER NOT NULL,  -- seconds
+    start INTEGER NOT NULL,  -- unix seconds, a multiple of resolution
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    PRIMARY KEY (field, resolution, start)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_buckets (
+    field TEXT NOT NULL,
+    resolution INTEGER NOT NULL,
+    start INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (field, resolution, start, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_meta (name TEXT PRIMARY KEY, value REAL NOT NULL);
+"""
+
+COLUMN_POSITION = {name: n for n, name in enumerate(COLUMNS)}
+INSERT = f"INSERT OR IGNORE INTO logs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})"
+ADD_ROLLUP = """
+INSERT INTO rollups (field, resolution, start, count, sum, min, max) VALUES (?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (field, resolution, start) DO UPDATE SET
+    count = count + excluded.count, sum = sum + excluded.sum,
+    min = min(min, excluded.min), max = max(max, excluded.max)
+"""
+ADD_BUCKET = """
+INSERT INTO rollup_buckets (field, resolution, start, bucket, count) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (field, resolution, start, bucket) DO UPDATE SET count = count + excluded.count
+"""
+BACKFILL_BATCH = 1000
+
+
+def _number(value: Any) -> Optional[float]:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else None
+
+
+def bucket_of(value: float) -> int:
+    """Histogram bucket of a value; the bucket's value is within RELATIVE_ACCURACY of it."""
+    if abs(value) < MIN_VALUE:
+        return 0
+    index = math.ceil(math.log(abs(value), GAMMA)) + OFFSET
+    return index if value > 0 else -index
+
+
+def _epoch_seconds(row: Tuple[Any, ...]) -> float:
+    """Request time of a row (naive ISO 8601 in UTC), or the time it was saved if missing."""
+    request_time = row[2]
+    if request_time:
+        try:
+            return datetime.fromisoformat(request_time).replace(tzinfo=timezone.utc).timestamp()
+        except ValueError:
+            pass
+    return row[0] / 1000
+
+
+class Rollups:
+    """Rollup increments of a batch of rows, per (field, resolution, start)."""
+
+    def __init__(self) -> None:
+        self.stats: Dict[Tuple[str, int, int], List[float]] = {}  # count, sum, min, max
+        self.buckets: Dict[Tuple[str, int, int], Counter] = {}
+
+    def add(self, row: Tuple[Any, ...]) -> None:
+        at = _epoch_seconds(row)
+        for name in ROLLUP_FIELDS:
+            value = row[COLUMN_POSITION[name]]
+            if value is None or not math.isfinite(value):
+                continue
+            for resolution in RESOLUTIONS:
+                key = (name, resolution, int(at // resolution * resolution))
+                stats = self.stats.get(key)
+                if stats is None:
+                    self.stats[key] = [1, value, value, value]
+                    self.buckets[key] = Counter()
+                else:
+                    stats[0] += 1
+                    stats[1] += value
+                    stats[2] = min(stats[2], value)
+                    stats[3] = max(stats[3], value)
+                self.buckets[key][bucket_of(value)] += 1
+
+    def write(self, conn: sqlite3.Connection) -> None:
+        conn.executemany(ADD_ROLLUP, [(*key, *stats) for key, stats in self.stats.items()])
+        conn.executemany(
+            ADD_BUCKET,
+            [(*key, bucket, n) for key, counts in self.buckets.items() for bucket, n in counts.items()],
+        )
+
+
+def flatten(key: Key, log: Dict[str, Any]) -> Tuple[Any, ...]:
+    """The row of a log, in COLUMNS order; fields missing from the log are NULL."""
+    stats = (log.get("stats") or [{}])[0]
+    timings = log.get("timings") or {}
+    metrics = log.get("metrics") or {}
+    texts: Dict[str, Any] = {}
+    for block in log.get("texts", []):
+        for name, value in block.items():
+            texts[name] = value
+    question = texts.get("question", {})
+    context = texts.get("context", {})
+    values: Dict[str, Any] = {
+        "len_question": question.get("len_question"),
+        "len_context": context.get("len_context"),
+        "len_answer": texts.get("answer", {}).get("len_answer"),
+        "chunks": len(context.get("items", [])) if context else None,
+    }
+    values.update((name, timings.get(name)) for name in TIMING_FIELDS)
+    values.update((name, stats.get(name)) for name in STAT_FIELDS)
+    values.update((name, metrics.get(name)) for name in METRIC_FIELDS)
+    return (
+        key[0],
+        key[1],
+        stats.get("request_time"),
+        stats.get("ip"),
+        stats.get("finish_reason"),
+        ",".join(stats.get("degradations") or []),
+        question.get("text"),
+        *(_number(values[name]) for name in NUMERIC_FIELDS),
+    )
+
+
+class MetricsStore:
+    """Batched writer of log rows. Not safe for concurrent use: callers serialize inserts."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # the segments are the durable copy
+        self._conn.executescript(SCHEMA)
+        with self._conn:
+            # Readers map buckets back to values with these
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO rollup_meta (name, value) VALUES (?, ?)",
+                [("relative_accuracy", RELATIVE_ACCURACY), ("bucket_offset", OFFSET)],
+            )
+
+    def insert(self, keys: List[Key], logs: List[Dict[str, Any]]) -> int:
+        """
+        Insert the rows of a batch and add them to the rollups, in one
+        transaction; logs already stored (same key or log id) are skipped, so
+        neither backfill nor a redelivered entry counts twice. Returns rows added.
+        """
+        rollups = Rollups()
+        added = 0
+        with self._conn:
+            for row in (flatten(key, log) for key, log in zip(keys, logs)):
+                if self._conn.execute(INSERT, row).rowcount:
+                    rollups.add(row)
+                    added += 1
+            rollups.write(self._conn)
+        return added
+
+    def rebuild_rollups(self) -> int:
+        """Recompute all rollups from the stored rows, in one transaction; returns the rows rolled up."""
+        rolled = 0
+        with self._conn:
+            self._conn.execute("DELETE FROM rollups")
+            self._conn.execute("DELETE FROM rollup_buckets")
+            rows = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM logs")
+            while batch := rows.fetchmany(BACKFILL_BATCH):
+                rollups = Rollups()
+                for row in batch:
+                    rollups.add(row)
+                rollups.write(self._conn)
+                rolled += len(batch)
+        return rolled
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def backfill(directory: Path, store: MetricsStore) -> int:
+    """Insert every log of the segments in `directory`; returns rows added."""
+    added = 0
+    for data_path in sorted(directory.glob("logs_*.jsonl.gz")):
+        keys: List[Key] = []
+        logs: List[Dict[str, Any]] = []
+        for key, log in read_segment(data_path):
+            keys.append(key)
+            logs.append(log)
+            if len(logs) >= BACKFILL_BATCH:
+                added += store.insert(keys, logs)
+                keys, logs = [], []
+        if logs:
+            added += store.insert(keys, logs)
+        logger.info(f"[Store] Loaded {data_path.name} ({added} rows added so far)")
+    return added
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Load processed log segments into the metrics store")
+    parser.add_argument("command", choices=["backfill", "rollups"])
+    parser.add_argument("--dir", default=os.getenv("LOG_DIR", "logs"))
+    parser.add_argument("--db", default=os.getenv("METRICS_DB"))
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(name)s: %(message)s")
+    store = MetricsStore(Path(args.db) if args.db else Path(args.dir) / "metrics.db")
+    try:
+        if args.command == "rollups":
+            print(f"Rolled up {store.rebuild_rollups()} rows in {store.path}")
+        else:
+            print(f"Added {backfill(Path(args.dir), store)} rows to {store.path}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,23 @@
 import json
 import logging
+import math
 import time
-from typing import AsyncGenerator
+from typing import Any, AsyncGenerator
 
-from fastapi import APIRouter, Depends, Request, status
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 
+from config import settings
+from deadline import Deadline
+from metrics import METRICS
+from rate_limit import get_rate_limiter, rate_limited_client
+from tracing import Trace
 from rag_service import RAGService, get_rag_service
-from schemas import QueryRequest
+from schemas import EVENT_FINAL, EVENT_TOKEN, BatchQueryRequest, QueryRequest
 from log_stats import (
     extract_timings_and_stats,
     format_log_payload,
-    send_log_to_collector,
+    get_log_shipper,
 )
 
 logger = logging.getLogger(__name__)
@@ -29,12 +35,48 @@ def _real_ip(request: Request) -> str:
     )
 
 
-@router.get("/metrics")
-async def metrics(service: RAGService = Depends(get_rag_service)) -> dict:
+def _record_request(endpoint: str, total_time: float, finish_reason: str) -> None:
+    METRICS.observe("request_seconds", total_time)
+    METRICS.inc("requests_total", endpoint=endpoint, finish_reason=finish_reason)
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics(service: RAGService = Depends(get_rag_service)) -> PlainTextResponse:
+    """
+    Latency summaries (p50/p95/p99), error counters and current load
+    in Prometheus text format.
+    """
+    METRICS.set("active_requests", service.active_requests())
+    for upstream in service.llm_stats():
+        METRICS.set("llm_outstanding", upstream["outstanding"], upstream=upstream["url"])
+        METRICS.set("llm_available", float(upstream["available"]), upstream=upstream["url"])
+    rerank = service.rerank_stats()
+    METRICS.set("rerank_level", rerank["level_index"])
+    for level, count in rerank["decisions"].items():
+        METRICS.set("rerank_decisions_total", count, level=level)
+    METRICS.set("rerank_transitions_total", rerank["degraded"], direction="degrade")
+    METRICS.set("rerank_transitions_total", rerank["restored"], direction="restore")
+    p95_ms = rerank["p95_ms"]
+    METRICS.set("rerank_p95_seconds", p95_ms / 1000 if p95_ms is not None else math.nan)
+    METRICS.set("rerank_inflight", rerank["inflight"])
+    METRICS.set("log_queue_size", get_log_shipper().stats()["queued"])
+
+    return PlainTextResponse(METRICS.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/status")
+async def service_status(service: RAGService = Depends(get_rag_service)) -> dict:
     """
-    Return the current number of active requests in the RAG service.
+    Return the current number of active requests, per-upstream LLM stats,
+    adaptive rerank decisions, rate limiting and log shipping counters.
     """
-    return {"active_requests": service.active_requests()}
+    return {
+        "active_requests": service.active_requests(),
+        "llm_upstreams": service.llm_stats(),
+        "rerank_policy": service.rerank_stats(),
+        "rate_limit": get_rate_limiter().stats(),
+        "log_shipper": get_log_shipper().stats(),
+    }
 
 
 @router.post("/query")
@@ -42,15 +84,20 @@ async def query(
     req: QueryRequest,
     request: Request,
     service: RAGService = Depends(get_rag_service),
+    client: str = Depends(rate_limited_client),
 ):
     """
     Handle a full query-response request with logging.
     """
-    res = await service.generate(req.message)
+    deadline = Deadline.from_headers(request.headers, settings.request_budget)
+    trace = Trace.from_headers(request.headers)
+    res = await service.generate(req.message, deadline, trace, client)
+    await get_rate_limiter().charge_tokens(client, res.usage.get("completion_tokens"))
 
-    timings, stats = extract_timings_and_stats(res.dict(), ip=_real_ip(request))
+    timings, stats = extract_timings_and_stats(res.dict(), ip=_real_ip(request), total_time=trace.elapsed())
+    _record_request("query", timings["all_time"], res.finish_reason)
 
-    await send_log_to_collector(
+    get_log_shipper().enqueue(
         format_log_payload(
             question=res.question,
             context=res.context,
@@ -58,6 +105,8 @@ async def query(
             stats=stats,
             timings=timings,
             scores=res.scores,
+            chunk_ids=res.chunk_ids,
+            trace=trace.export(),
         )
     )
 
@@ -67,40 +116,142 @@ async def query(
             "server_info": {"timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
         },
         status_code=status.HTTP_200_OK,
+        headers=trace.header(),
     )
 
 
+@router.post("/batch_query")
+async def batch_query(
+    req: BatchQueryRequest,
+    request: Request,
+    service: RAGService = Depends(get_rag_service),
+    client: str = Depends(rate_limited_client),
+):
+    """
+    Answer a list of questions, streaming one NDJSON line per answer as it completes.
+
+    Each line carries the question index, answer and per-item timings
+    (retrieval, queue wait, generation). A closing `summary` line reports
+    aggregate throughput.
+    """
+    if len(req.messages) > settings.batch_max_questions:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.batch_max_questions} questions per batch.",
+        )
+    real_ip = _real_ip(request)
+
+    async def _generator() -> AsyncGenerator[str, None]:
+        t_start = time.perf_counter()
+        errors = 0
+        generated_tokens = 0
+        latencies = []
+
+        async for index, res, item_timings in service.generate_batch(req.messages, client):
+            await get_rate_limiter().charge_tokens(client, res.usage.get("completion_tokens"))
+            timings, stats = extract_timings_and_stats(res.dict(), ip=real_ip)
+            get_log_shipper().enqueue(
+                format_log_payload(
+                    question=res.question,
+                    context=res.context,
+                    answer=res.answer,
+                    stats=stats,
+                    timings=timings,
+                    scores=res.scores,
+                    chunk_ids=res.chunk_ids,
+                )
+            )
+
+            elapsed = time.perf_counter() - t_start
+            latencies.append(item_timings["retrieval_time"] + item_timings["queue_wait"] + res.model_time)
+            errors += res.finish_reason == "error"
+            generated_tokens += res.usage.get("completion_tokens") or 0
+
+            yield json.dumps({
+                "index": index,
+                "question": res.question,
+                "answer": res.answer,
+                "finish_reason": res.finish_reason,
+                "usage": res.usage,
+                "timings": {**timings, **item_timings, "completed_at": elapsed},
+            }, ensure_ascii=False) + "\n"
+
+        wall = time.perf_counter() - t_start
+        yield json.dumps({
+            "summary": {
+                "questions": len(latencies),
+                "errors": errors,
+                "wall_time": wall,
+                "questions_per_sec": len(latencies) / wall if wall else 0.0,
+                "generated_tokens_per_sec": generated_tokens / wall if wall else 0.0,
+                "avg_latency": sum(latencies) / len(latencies) if latencies else 0.0,
+                "max_latency": max(latencies, default=0.0),
+            }
+        }) + "\n"
+
+    return StreamingResponse(_generator(), media_type="application/x-ndjson")
+
+
+def _sse(event: str, data: Any) -> str:
+    """
+    Format a single Server-Sent Event with a JSON-encoded payload.
+    """
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+SSE_DONE = "event: done\ndata: [DONE]\n\n"
+
+
 @router.post("/stream")
 async def stream_answer(
     req: QueryRequest,
     request: Request,
     service: RAGService = Depends(get_rag_service),
+    client: str = Depends(rate_limited_client),
 ):
     """
-    Handle streamed generation response with logging.
+    Handle streamed generation as Server-Sent Events with logging.
+
+    Emits `token` events with answer text, an `error` event if generation
+    fails, a `final` event with generation metadata and a closing `done` event.
     """
     real_ip = _real_ip(request)
+    deadline = Deadline.from_headers(request.headers, settings.request_budget)
+    trace = Trace.from_headers(request.headers)
 
     async def _generator() -> AsyncGenerator[str, None]:
-        async for chunk in service.stream(req.message):
-            try:
-                parsed = json.loads(chunk)
-                if "answer" in parsed:
-                    timings, stats = extract_timings_and_stats(parsed, ip=real_ip)
-                    await send_log_to_collector(
-                        format_log_payload(
-                            question=parsed["question"],
-                            context=parsed["context"],
-                            answer=parsed["answer"],
-                            stats=stats,
-                            timings=timings,
-                            scores=parsed.get("scores"),
-                        )
+        async for event in service.stream(req.message, deadline, trace, client):
+            if event.type == EVENT_TOKEN:
+                yield _sse(EVENT_TOKEN, event.data)
+            elif event.type == EVENT_FINAL:
+                res = event.data
+                await get_rate_limiter().charge_tokens(client, res.usage.get("completion_tokens"))
+                timings, stats = extract_timings_and_stats(res.dict(), ip=real_ip, total_time=trace.elapsed())
+                _record_request("stream", timings["all_time"], res.finish_reason)
+                get_log_shipper().enqueue(
+                    format_log_payload(
+                        question=res.question,
+                        context=res.context,
+                        answer=res.answer,
+                        stats=stats,
+                        timings=timings,
+                        scores=res.scores,
+                        chunk_ids=res.chunk_ids,
+                        trace=trace.export(),
                     )
-                    yield ""
-                else:
-                    yield json.dumps(parsed, ensure_ascii=False)
-            except Exception:
-                yield chunk
+                )
+                yield _sse(EVENT_FINAL, {
+                    "finish_reason": res.finish_reason,
+                    "usage": res.usage,
+                    "timings": timings,
+                    "degradations": res.degradations,
+                })
+            else:
+                yield _sse(event.type, event.data)
+        yield SSE_DONE
 
-    return StreamingResponse(_generator(), media_type="text/plain; charset=utf-8")
+    return StreamingResponse(
+        _generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **trace.header()},
+    )
@@ -0,0 +1,80 @@
+import gzip
+from typing import List
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+
+class JSONCompressionMiddleware:
+    """
+    Compresses JSON responses with brotli or gzip, per the client's Accept-Encoding.
+
+    Only `application/json` bodies of at least `minimum_size` bytes are
+    buffered and compressed; everything else, including SSE and NDJSON
+    streams and file responses, is passed through untouched.
+    """
+
+    def __init__(self, app: ASGIApp, minimum_size: int = 1024):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        accept = Headers(scope=scope).get("accept-encoding", "")
+        if brotli is not None and "br" in accept:
+            encoding = "br"
+        elif "gzip" in accept:
+            encoding = "gzip"
+        else:
+            await self.app(scope, receive, send)
+            return
+
+        start: List[Message] = []
+        body: List[bytes] = []
+        passthrough = False
+
+        async def _send(message: Message) -> None:
+            nonlocal passthrough
+            if message["type"] == "http.response.start":
+                headers = Headers(raw=message["headers"])
+                if (
+                    headers.get("content-type", "").startswith("application/json")
+                    and "content-encoding" not in headers
+                ):
+                    start.append(message)
+                else:
+                    passthrough = True
+                    await send(message)
+                return
+
+            if passthrough or message["type"] != "http.response.body":
+                await send(message)
+                return
+
+            body.append(message.get("body", b""))
+            if message.get("more_body", False):
+                return
+
+            payload = b"".join(body)
+            response_start = start[0]
+            if len(payload) >= self.minimum_size:
+                payload = (
+                    brotli.compress(payload, quality=4) if encoding == "br"
+                    else gzip.compress(payload, compresslevel=6)
+                )
+                headers = MutableHeaders(raw=response_start["headers"])
+                headers["Content-Encoding"] = encoding
+                headers["Content-Length"] = str(len(payload))
+                headers.add_vary_header("Accept-Encoding")
+            await send(response_start)
+            await send({"type": "http.response.body", "body": payload})
+
+        await self.app(scope, receive, _send)
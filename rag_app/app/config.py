@@ -1,8 +1,7 @@
 import os
-import json
 from functools import lru_cache
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List
 
 from pydantic import Field
 from pydantic_settings import BaseSettings
@@ -24,25 +23,90 @@ class Settings(BaseSettings):
         )
     )
 
+    documents_refresh_interval: float = 5.0
+
+    # Document serving -----------------------------------------------
+    files_base_url: str = ""  # public URL of /files; default http://local_ip:port/files
+    files_max_age: int = 3600
+    files_accel_redirect: str = ""  # nginx internal location, e.g. "/_documents/"
+    compress_min_size: int = 1024
+
     # Network --------------------------------------------------------
     port: int = 8001
     local_ip: str = "local_ip"
 
     # Service URLs ---------------------------------------------------
     retriever_url: str = "http://retrieval:8004/get_chunks"
+    retriever_batch_url: str = "http://retrieval:8004/get_chunks_batch"
+    retrieval_mode: str = "http"  # "http" or "local" (EmbeddingBackend inside rag_app)
+    retrieval_transport: str = "json"  # "json" or "msgpack" responses
+    retrieval_http2: bool = False  # needs httpx[http2] and an HTTP/2 (TLS) endpoint
+    retrieval_max_connections: int = 20
+    retrieval_keepalive_expiry: float = 30.0
+    retrieval_app_dir: Path = Path(__file__).resolve().parents[2] / "retrieval" / "app"
     llm_url: str = "http://llm_server/v1/chat/completions"
+    llm_urls: List[str] = Field(default_factory=list)
     log_collector_url: str = "http://log_collector:8003/collect"
+    log_collector_batch_url: str = "http://log_collector:8003/collect/batch"  # "" = one request per entry
 
     # LLM ------------------------------------------------------------
     model_name: str = "qwen2.5-14b-instruct"
     temperature: float = 0.3
     max_generated_tokens: int = 1536
+    min_n_predict: int = 64
+
+    # Request deadline -----------------------------------------------
+    request_budget: float = 100.0  # seconds, end-to-end
+    est_ms_per_token: float = 50.0  # initial LLM speed estimates,
+    est_prompt_seconds: float = 2.0  # refined from response timings
+
+    # LLM upstream pool ----------------------------------------------
+    llm_slots_per_upstream: int = 2
+    llm_health_interval: float = 5.0
+    llm_max_failures: int = 3
+    llm_eject_seconds: float = 30.0
+    llm_first_byte_timeout: float = 30.0
 
     # RAG ------------------------------------------------------------
     default_k: int = 50
     default_top_n: int = 5
     use_reranker: bool = True
 
+    # Adaptive rerank ------------------------------------------------
+    adaptive_rerank: bool = True
+    rerank_slo_ms: float = 1000.0  # p95 retrieval latency target
+    rerank_recover_ratio: float = 0.5
+    rerank_max_inflight: int = 8
+    rerank_window: int = 50
+    rerank_min_samples: int = 10
+    rerank_cooldown: float = 10.0
+
+    # Rate limiting --------------------------------------------------
+    rate_limit_enabled: bool = False
+    rate_limit_by: str = "ip"  # "ip" or "api_key" (X-API-Key / bearer token, else IP)
+    rate_limit_backend: str = "memory"  # "memory" or "redis" (shared by replicas)
+    rate_limit_redis_url: str = "redis://redis:6379"
+    rate_limit_requests_burst: int = 10  # 0 disables the request limit
+    rate_limit_requests_per_minute: float = 30.0
+    rate_limit_tokens_burst: int = 20000  # 0 disables the generated tokens limit
+    rate_limit_tokens_per_minute: float = 10000.0
+
+    # Batch queries --------------------------------------------------
+    batch_max_questions: int = 5000
+    batch_retrieval_size: int = 64
+    batch_concurrency: int = 0  # 0 = all LLM slots
+
+    # Log shipping ---------------------------------------------------
+    log_queue_size: int = 1000
+    log_batch_size: int = 50
+    log_flush_interval: float = 1.0
+    log_overflow: str = "spill"  # "spill" to log_dir or "drop"
+    log_spill_max_bytes: int = 50 * 1024 * 1024
+    log_shutdown_timeout: float = 5.0
+
+    # Metrics --------------------------------------------------------
+    metrics_window: int = 1024  # samples per rolling summary
+
     # Miscellaneous --------------------------------------------------
     api_key: str = "api_key"
     debug: bool = False
@@ -54,11 +118,15 @@ class Settings(BaseSettings):
             Path(__file__).resolve().parent / "prompts" / "system_prompt.txt"
         ).read_text(encoding="utf-8")
     )
-    system_hints: List[Dict[str, Any]] = Field(
-        default_factory=lambda: json.loads(
-            (Path(__file__).resolve().parent / "prompts" / "system_hints.json").read_text(encoding="utf-8")
-        )
-    )
+    system_hints_path: Path = Path(__file__).resolve().parent / "prompts" / "system_hints.json"
+    hints_word_boundary: bool = False
+    hints_normalize: bool = True
+    hints_reload_interval: float = 5.0
+
+    @property
+    def llm_upstreams(self) -> List[str]:
+        """LLM chat completion URLs; falls back to the single `llm_url`."""
+        return self.llm_urls or [self.llm_url]
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,46 @@
+import time
+from typing import Dict
+
+# Remaining time budget (milliseconds) granted to the receiving service
+BUDGET_HEADER = "X-Request-Budget-Ms"
+
+
+class Deadline:
+    """
+    End-to-end time budget of a single request.
+
+    Created when the request enters rag_app and passed down to the
+    retriever and LLM clients, which derive their timeouts from it and
+    forward the remaining budget to the retrieval service as a header.
+    """
+
+    def __init__(self, budget: float):
+        self._expires_at = time.monotonic() + budget
+
+    @classmethod
+    def from_headers(cls, headers, default_budget: float) -> "Deadline":
+        """Use the caller's budget header if it is tighter than `default_budget` (seconds)."""
+        budget = default_budget
+        raw = headers.get(BUDGET_HEADER)
+        if raw:
+            try:
+                budget = min(budget, max(0.0, float(raw) / 1000))
+            except ValueError:
+                pass
+        return cls(budget)
+
+    def remaining(self) -> float:
+        """Seconds left, never negative."""
+        return max(0.0, self._expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0.0
+
+    def timeout(self, cap: float, reserve: float = 0.0) -> float:
+        """Timeout for a downstream call: the remaining budget minus `reserve`, at most `cap`."""
+        return max(0.001, min(cap, self.remaining() - reserve))
+
+    def header(self, reserve: float = 0.0) -> Dict[str, str]:
+        """Budget header for a downstream call, keeping `reserve` seconds for later stages."""
+        return {BUDGET_HEADER: str(int(max(0.0, self.remaining() - reserve) * 1000))}
+
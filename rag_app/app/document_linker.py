@@ -1,60 +1,95 @@
+import logging
 import os
-import re
+import time
 import unicodedata
-from typing import List
+from typing import Dict, List, Optional
+from urllib.parse import quote
 
 from config import settings
 
-DOCUMENTS = [
-    f for f in os.listdir(settings.documents_dir)
-    if f.endswith(".pdf") and not f.startswith(("~", "."))
-]
+logger = logging.getLogger(__name__)
 
-# Normalize file names and create mapping: {normalized_name: original_name}
-DOC_MAP = {
-    unicodedata.normalize("NFKD", os.path.splitext(f)[0].lower().replace("\xa0", " ").strip()): f
-    for f in DOCUMENTS
-}
 
-# Pattern: "Document: <name>.pdf contains"
-LINK_PATTERN = re.compile(
-    r"Document (?P<name>[^:\n]+\.pdf) contains:",
-    flags=re.IGNORECASE
-)
+def _normalize(name: str) -> str:
+    """Normalize a document name for matching: no extension, lowercase, NFKD."""
+    return unicodedata.normalize(
+        "NFKD", os.path.splitext(name)[0].lower().replace("\xa0", " ").strip()
+    )
 
 
-def fast_link_injection(text: str, prefix_limit: int = 300) -> str:
+class DocumentIndex:
     """
-    Inserts a markdown link into the beginning of text if a document pattern is found.
-    Only the first `prefix_limit` characters are processed.
+    Map of document ids (source file names recorded at index build time)
+    to files served under `/files`.
+
+    The map is rebuilt when the mtime of `documents_dir` changes; the
+    directory is checked at most once per `refresh_interval` seconds.
     """
-    prefix = text[:prefix_limit]
-    suffix = text[prefix_limit:]
 
-    def repl(m):
-        raw = m.group("name").strip()
-        normalized = unicodedata.normalize(
-            "NFKD", os.path.splitext(raw)[0].lower().replace("\xa0", " ").strip()
-        )
-        matched = DOC_MAP.get(normalized)
-        if matched:
-            return (
-                f"В документе: [{raw}](http://{settings.local_ip}:{settings.port}/files/{matched}) содержится информация"
-            )
-        return m.group(0)
+    def __init__(self, documents_dir: str, refresh_interval: float):
+        self._dir = documents_dir
+        self._refresh_interval = refresh_interval
+        self._checked_at: float = 0.0
+        self._mtime_ns: Optional[int] = None
+        self._by_name: Dict[str, str] = {}
+        self._by_normalized: Dict[str, str] = {}
+
+    def resolve(self, doc_id: Optional[str]) -> Optional[str]:
+        """Return the served file name for a document id, or None."""
+        if not doc_id:
+            return None
+        self._maybe_refresh()
+        return self._by_name.get(doc_id) or self._by_normalized.get(_normalize(doc_id))
+
+    def _maybe_refresh(self) -> None:
+        now = time.monotonic()
+        if now - self._checked_at < self._refresh_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtime_ns = os.stat(self._dir).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns == self._mtime_ns:
+            return
+        self._mtime_ns = mtime_ns
+
+        documents = [
+            f for f in (os.listdir(self._dir) if mtime_ns is not None else [])
+            if f.endswith(".pdf") and not f.startswith(("~", "."))
+        ]
+        self._by_name = {f: f for f in documents}
+        self._by_normalized = {_normalize(f): f for f in documents}
+        logger.info("[Linker] Indexed %d documents in %s", len(documents), self._dir)
 
-    return LINK_PATTERN.sub(repl, prefix) + suffix
 
+DOCUMENT_INDEX = DocumentIndex(str(settings.documents_dir), settings.documents_refresh_interval)
 
-def inject_links_into_chunks(chunks: List[str], prefix_window: int = 300) -> List[str]:
+
+def link_chunk(text: str, source: Optional[str]) -> str:
     """
-    Injects document links into each chunk (only scanning first `prefix_window` characters).
+    Replaces the "Document <name> contains:" header of a chunk with a markdown
+    link to its source document. Chunks without a known source are returned unchanged.
     """
-    updated_chunks = []
+    matched = DOCUMENT_INDEX.resolve(source)
+    if not matched:
+        return text
+
+    base = settings.files_base_url or f"http://{settings.local_ip}:{settings.port}/files"
+    link = f"В документе: [{source}]({base.rstrip('/')}/{quote(matched)}) содержится информация"
+    header = f"Document {source} contains:"
+    if text.startswith(header):
+        return link + text[len(header):]
+    return f"{link}:\n{text}"
 
-    for text in chunks:
-        prefix = text[:prefix_window]
-        replaced = fast_link_injection(prefix)
-        updated_chunks.append(replaced + text[prefix_window:])
 
-    return updated_chunks
+def inject_links_into_chunks(chunks: List[str], sources: List[Optional[str]]) -> List[str]:
+    """
+    Injects document links into each chunk using the source document ids
+    returned by the retrieval service.
+    """
+    return [
+        link_chunk(text, sources[i] if i < len(sources) else None)
+        for i, text in enumerate(chunks)
+    ]
@@ -0,0 +1,95 @@
+import asyncio
+import hashlib
+import mimetypes
+import os
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Dict, Tuple
+from urllib.parse import quote
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from config import settings
+
+router = APIRouter()
+
+# path -> (mtime_ns, size, strong ETag of the content)
+_etags: Dict[str, Tuple[int, int, str]] = {}
+
+
+def _resolve(name: str) -> str:
+    """Absolute path of a served document; 404 for anything outside `documents_dir`."""
+    if not name or name != os.path.basename(name) or name.startswith((".", "~")):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = os.path.join(settings.documents_dir, name)
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="Not found")
+    return path
+
+
+def _hash_file(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f'"{digest.hexdigest()[:32]}"'
+
+
+async def _etag(path: str, stat: os.stat_result) -> str:
+    """Content hash ETag, computed off the event loop once per file version."""
+    cached = _etags.get(path)
+    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+        return cached[2]
+    etag = await asyncio.to_thread(_hash_file, path)
+    _etags[path] = (stat.st_mtime_ns, stat.st_size, etag)
+    return etag
+
+
+def _not_modified(request: Request, etag: str, mtime: float) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [t.strip().removeprefix("W/") for t in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+@router.api_route("/files/{name}", methods=["GET", "HEAD"])
+async def get_file(name: str, request: Request) -> Response:
+    """
+    Serve a source document with validators and caching headers.
+
+    Conditional requests (If-None-Match / If-Modified-Since) get 304 and
+    Range requests get 206. With `files_accel_redirect` set, only headers
+    are produced here and nginx sends the bytes from its internal location.
+    """
+    path = _resolve(name)
+    stat = os.stat(path)
+    etag = await _etag(path, stat)
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={settings.files_max_age}",
+    }
+
+    if _not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=headers)
+
+    if settings.files_accel_redirect:
+        headers["X-Accel-Redirect"] = settings.files_accel_redirect.rstrip("/") + "/" + quote(name)
+        headers["Content-Disposition"] = f"inline; filename*=utf-8''{quote(name)}"
+        return Response(headers=headers, media_type=mimetypes.guess_type(name)[0] or "application/octet-stream")
+
+    return FileResponse(
+        path,
+        headers=headers,
+        stat_result=stat,
+        filename=name,
+        content_disposition_type="inline",
+    )
+
@@ -0,0 +1,158 @@
+import json
+import logging
+import os
+import time
+import unicodedata
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and casefold text; 'ё' is folded to 'е' and whitespace collapsed."""
+    text = unicodedata.normalize("NFKC", text).casefold().replace("ё", "е")
+    return " ".join(text.split())
+
+
+def _is_word_char(ch: str) -> bool:
+    return ch.isalnum() or ch == "_"
+
+
+class _Automaton:
+    """
+    Aho–Corasick automaton over keywords.
+
+    Every output is (keyword length, rule index, word boundary required).
+    Outputs of suffix states are merged at build time, so matching is a
+    single pass over the text without walking dictionary links.
+    """
+
+    def __init__(self, keywords: List[Tuple[str, int, bool]]):
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.out: List[List[Tuple[int, int, bool]]] = [[]]
+
+        for keyword, rule, boundary in keywords:
+            state = 0
+            for ch in keyword:
+                nxt = self.goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self.goto)
+                    self.goto[state][ch] = nxt
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append([])
+                state = nxt
+            self.out[state].append((len(keyword), rule, boundary))
+
+        queue = list(self.goto[0].values())
+        for state in queue:
+            for ch, nxt in self.goto[state].items():
+                queue.append(nxt)
+                f = self.fail[state]
+                while f and ch not in self.goto[f]:
+                    f = self.fail[f]
+                target = self.goto[f].get(ch, 0)
+                self.fail[nxt] = target if target != nxt else 0
+                self.out[nxt] = self.out[nxt] + self.out[self.fail[nxt]]
+
+    def search(self, text: str, n_rules: int) -> List[int]:
+        """Indices of rules with at least one keyword in `text`, in rule order."""
+        goto, fail, out = self.goto, self.fail, self.out
+        matched = set()
+        state = 0
+        for pos, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if not out[state]:
+                continue
+            for length, rule, boundary in out[state]:
+                if rule in matched:
+                    continue
+                if boundary:
+                    start = pos - length + 1
+                    if start > 0 and _is_word_char(text[start - 1]):
+                        continue
+                    if pos + 1 < len(text) and _is_word_char(text[pos + 1]):
+                        continue
+                matched.add(rule)
+            if len(matched) == n_rules:
+                break
+        return sorted(matched)
+
+
+class HintMatcher:
+    """
+    Matches questions against keyword rules from `system_hints.json`.
+
+    Rules look like {"keywords": [...], "message": "..."} and may override
+    the global `word_boundary` flag per rule. The file is compiled once into
+    an Aho–Corasick automaton and recompiled when its mtime changes
+    (checked at most every `reload_interval` seconds).
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        *,
+        word_boundary: bool = False,
+        normalize: bool = True,
+        reload_interval: float = 5.0,
+    ):
+        self._path = Path(path)
+        self._word_boundary = word_boundary
+        self._normalize = normalize
+        self._reload_interval = reload_interval
+
+        self._checked_at: float = 0.0
+        self._mtime_ns: Optional[int] = None
+        self._messages: List[str] = []
+        self._automaton = _Automaton([])
+
+        self._maybe_reload(force=True)
+
+    def match(self, question: str) -> List[str]:
+        """Messages of all rules matched by the question, in file order."""
+        self._maybe_reload()
+        if not self._messages:
+            return []
+        text = normalize_text(question) if self._normalize else question.lower()
+        return [self._messages[i] for i in self._automaton.search(text, len(self._messages))]
+
+    def compile(self, rules: List[Dict[str, Any]]) -> None:
+        """Build the automaton from a list of rules."""
+        keywords: List[Tuple[str, int, bool]] = []
+        for idx, rule in enumerate(rules):
+            boundary = bool(rule.get("word_boundary", self._word_boundary))
+            for keyword in rule.get("keywords", []):
+                keyword = normalize_text(keyword) if self._normalize else keyword.lower()
+                if keyword:
+                    keywords.append((keyword, idx, boundary))
+
+        self._automaton = _Automaton(keywords)
+        self._messages = [rule["message"] for rule in rules]
+
+    def _maybe_reload(self, force: bool = False) -> None:
+        now = time.monotonic()
+        if not force and now - self._checked_at < self._reload_interval:
+            return
+        self._checked_at = now
+
+        try:
+            mtime_ns = os.stat(self._path).st_mtime_ns
+        except OSError:
+            logger.warning("[Hints] Rules file not found: %s", self._path)
+            return
+        if mtime_ns == self._mtime_ns:
+            return
+
+        try:
+            rules = json.loads(self._path.read_text(encoding="utf-8"))
+            self.compile(rules)
+        except Exception as exc:
+            logger.error("[Hints] Failed to load %s, keeping previous rules: %s", self._path, exc)
+            return
+        self._mtime_ns = mtime_ns
+        logger.info("[Hints] Compiled %d rules from %s", len(self._messages), self._path)
@@ -1,75 +1,439 @@
+import asyncio
 import json
 import logging
-from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+import time
+from contextlib import AsyncExitStack, aclosing, nullcontext
+from typing import Any, AsyncGenerator, Dict, List, NamedTuple, Optional, Set, Tuple
 
 import httpx
 
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; retrieval responses are then JSON
+    msgpack = None
+
 from config import Settings
+from deadline import Deadline
+from metrics import METRICS, error_kind
+from tracing import Trace
 
 logger = logging.getLogger(__name__)
 
+MSGPACK = "application/msgpack"
+
+
+class Retrieved(NamedTuple):
+    """Retrieval service answer for one question; also the prepared LLM context (see `RAGService._prepare_context`)."""
+
+    chunks: List[str]
+    faiss_time: float
+    rerank_time: float
+    scores: List[Optional[float]]
+    sources: List[Optional[str]]
+    degradations: List[str]
+    compression_ratio: Optional[float] = None
+    chunk_ids: Optional[List[Optional[str]]] = None
+
+    @classmethod
+    def empty(cls) -> "Retrieved":
+        return cls([], 0.0, 0.0, [], [], [])
+
+    @classmethod
+    def from_response(cls, data: Dict[str, Any], top_n: int) -> "Retrieved":
+        return cls(
+            data.get("chunks", []),
+            float(data.get("faiss_time", 0.0)),
+            float(data.get("rerank_time", 0.0)),
+            data.get("scores", [None] * top_n),
+            data.get("sources", []),
+            data.get("degradations", []),
+            data.get("compression_ratio"),
+            data.get("chunk_ids"),
+        )
+
+
+def _timeout(deadline: Optional[Deadline], cap: float):
+    """Per-request httpx timeout derived from the deadline, or the client default."""
+    return deadline.timeout(cap) if deadline is not None else httpx.USE_CLIENT_DEFAULT
+
+
+class _Upstream:
+    """Runtime state and counters of a single LLM inference server."""
+
+    def __init__(self, url: str):
+        self.url: str = url
+        self.health_url: str = str(httpx.URL(url).join("/health"))
+        self.outstanding: int = 0
+        self.healthy: bool = True
+        self.ejected_until: float = 0.0
+        self.consecutive_failures: int = 0
+
+        self.requests: int = 0
+        self.errors: int = 0
+        self.retries: int = 0
+        self.latency_total: float = 0.0
+        self.latency_ewma: float = 0.0
+        self.ttfb_ewma: float = 0.0
+        self.last_error: Optional[str] = None
+
+    def available(self) -> bool:
+        return self.healthy and time.monotonic() >= self.ejected_until
+
+    def record_success(self, latency: float, ttfb: Optional[float] = None) -> None:
+        self.requests += 1
+        self.consecutive_failures = 0
+        self.latency_total += latency
+        self.latency_ewma = _ewma(self.latency_ewma, latency)
+        if ttfb is not None:
+            self.ttfb_ewma = _ewma(self.ttfb_ewma, ttfb)
+
+    def record_failure(self, error: str, max_failures: int, eject_seconds: float) -> None:
+        self.requests += 1
+        self.errors += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.consecutive_failures >= max_failures:
+            self.eject(eject_seconds)
+
+    def eject(self, seconds: float) -> None:
+        if self.available():
+            logger.warning("[LLM] Ejecting upstream %s for %.0f sec", self.url, seconds)
+        self.ejected_until = time.monotonic() + seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        succeeded = self.requests - self.errors
+        return {
+            "url": self.url,
+            "available": self.available(),
+            "healthy": self.healthy,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "retries": self.retries,
+            "latency_avg_ms": self.latency_total / succeeded * 1000 if succeeded else 0.0,
+            "latency_ewma_ms": self.latency_ewma * 1000,
+            "ttfb_ewma_ms": self.ttfb_ewma * 1000,
+            "last_error": self.last_error,
+        }
+
+
+def _ewma(current: float, sample: float, alpha: float = 0.2) -> float:
+    return sample if current == 0.0 else (1 - alpha) * current + alpha * sample
+
+
+class _RetryableStreamError(Exception):
+    """Stream failed before the first byte was forwarded; another upstream may be tried."""
+
 
 class LLMClient:
-    """Client for sending requests to the LLM inference server."""
+    """
+    Client for sending requests to a pool of LLM inference servers.
+
+    Requests are routed to the healthy upstream with the fewest outstanding
+    requests. Upstreams that keep failing (requests or health probes) are
+    ejected for `llm_eject_seconds`. When all slots are busy, freed slots go
+    to the waiting client with the fewest requests in generation.
+    """
 
     def __init__(self, settings: Settings):
-        self._url: str = settings.llm_url
         self._timeout: int = settings.timeout_clients
+        self._slots: int = max(1, settings.llm_slots_per_upstream)
+        self._health_interval: float = settings.llm_health_interval
+        self._max_failures: int = max(1, settings.llm_max_failures)
+        self._eject_seconds: float = settings.llm_eject_seconds
+        self._first_byte_timeout: float = settings.llm_first_byte_timeout
+
+        self._upstreams: List[_Upstream] = [_Upstream(url) for url in settings.llm_upstreams]
+        self._slot_freed = asyncio.Condition()
+        # Requests waiting for a slot as (arrival, client, excluded upstreams)
+        self._waiters: List[Tuple[int, str, Set[_Upstream]]] = []
+        self._arrivals: int = 0
+        self._client_slots: Dict[str, int] = {}
+        self._health_task: Optional[asyncio.Task] = None
         self._client = httpx.AsyncClient(
             timeout=self._timeout,
             headers={"Authorization": f"Bearer {settings.api_key}"},
         )
 
-    async def chat(self, payload: Dict[str, Any]) -> Tuple[Optional[dict], Optional[str]]:
-        """Send a standard chat completion request."""
-        try:
-            resp = await self._client.post(self._url, json=payload)
-            resp.raise_for_status()
-            return resp.json(), None
-        except httpx.TimeoutException:
-            logger.error("[LLM] Request timeout.")
-            return None, "timeout"
-        except httpx.RequestError as exc:
-            logger.error("[LLM] Network error: %s", exc)
-            return None, "request_error"
-        except httpx.HTTPStatusError as exc:
-            logger.error("[LLM] HTTP error: %s", exc.response.status_code)
-            return None, f"http_{exc.response.status_code}"
-        except Exception as exc:
-            logger.exception("[LLM] Unexpected error: %s", exc)
-            return None, str(exc)
+    def start(self) -> None:
+        """Start background health probes (no-op for a single upstream)."""
+        if self._health_task is None and len(self._upstreams) > 1:
+            self._health_task = asyncio.create_task(self._probe_loop())
+
+    @property
+    def capacity(self) -> int:
+        """Total number of generation slots across all upstreams."""
+        return self._slots * len(self._upstreams)
+
+    def stats(self) -> List[Dict[str, Any]]:
+        """Per-upstream routing, latency and error counters."""
+        return [u.snapshot() for u in self._upstreams]
+
+    async def chat(
+        self, payload: Dict[str, Any], deadline: Optional[Deadline] = None, client: str = ""
+    ) -> Tuple[Optional[dict], Optional[str]]:
+        """
+        Send a standard chat completion request, bounded by the request deadline.
+        `client` identifies the caller for fair slot scheduling.
+        """
+        tried: Set[_Upstream] = set()
+        error: Optional[str] = "no_upstream"
+
+        while True:
+            upstream = await self._acquire(tried, client)
+            if upstream is None:
+                return None, error
+            tried.add(upstream)
+            t0 = time.perf_counter()
+            try:
+                resp = await self._client.post(
+                    upstream.url, json=payload, timeout=_timeout(deadline, self._timeout)
+                )
+                resp.raise_for_status()
+                upstream.record_success(time.perf_counter() - t0)
+                return resp.json(), None
+            except httpx.ConnectError as exc:
+                # Nothing reached the server, so the request is safe to replay elsewhere.
+                logger.error("[LLM] Connection to %s failed: %s", upstream.url, exc)
+                error = "request_error"
+                self._fail(upstream, error)
+                upstream.retries += 1
+                continue
+            except httpx.TimeoutException:
+                logger.error("[LLM] Request timeout.")
+                error = "timeout"
+            except httpx.RequestError as exc:
+                logger.error("[LLM] Network error: %s", exc)
+                error = "request_error"
+            except httpx.HTTPStatusError as exc:
+                logger.error("[LLM] HTTP error: %s", exc.response.status_code)
+                error = f"http_{exc.response.status_code}"
+            except Exception as exc:
+                logger.exception("[LLM] Unexpected error: %s", exc)
+                error = str(exc)
+            finally:
+                await self._release(upstream, client)
+
+            self._fail(upstream, error)
+            return None, error
+
+    async def stream_chat(
+        self, payload: Dict[str, Any], deadline: Optional[Deadline] = None, client: str = ""
+    ) -> AsyncGenerator[str, None]:
+        """
+        Send a streaming chat request (SSE / chunked), bounded by the request deadline.
+
+        If an upstream fails or produces no data within `llm_first_byte_timeout`,
+        the request is retried on another upstream. Once data has been forwarded
+        to the caller, errors are reported in-stream instead.
+        """
+        tried: Set[_Upstream] = set()
+        last_error: Dict[str, Any] = {"error": "no_upstream"}
+
+        while True:
+            upstream = await self._acquire(tried, client)
+            if upstream is None:
+                yield json.dumps(last_error)
+                return
+            tried.add(upstream)
+            try:
+                async with aclosing(self._stream_from(upstream, payload, deadline, client)) as lines:
+                    async for line in lines:
+                        yield line
+                return
+            except _RetryableStreamError as exc:
+                last_error = exc.args[0]
+                upstream.retries += 1
+                logger.warning("[LLM] Stream from %s failed before first byte: %s", upstream.url, last_error)
 
-    async def stream_chat(self, payload: Dict[str, Any]) -> AsyncGenerator[str, None]:
-        """Send a streaming chat request (SSE / chunked)."""
+    async def _stream_from(
+        self, upstream: _Upstream, payload: Dict[str, Any], deadline: Optional[Deadline], client: str
+    ) -> AsyncGenerator[str, None]:
+        t0 = time.perf_counter()
+        first_byte_timeout = self._first_byte_timeout
+        if deadline is not None:
+            first_byte_timeout = deadline.timeout(first_byte_timeout)
         try:
-            async with self._client.stream("POST", self._url, json=payload) as resp:
-                if resp.status_code != 200:
-                    body = await resp.aread()
-                    yield json.dumps({
-                        "error": f"http_{resp.status_code}",
-                        "details": body.decode(errors="replace"),
-                    })
+            async with AsyncExitStack() as stack:
+                error: Optional[Dict[str, Any]] = None
+                try:
+                    async with asyncio.timeout(first_byte_timeout):
+                        resp = await stack.enter_async_context(
+                            self._client.stream(
+                                "POST", upstream.url, json=payload,
+                                timeout=_timeout(deadline, self._timeout),
+                            )
+                        )
+                        if resp.status_code == 200:
+                            lines = resp.aiter_lines()
+                            first = await anext(lines, None)
+                        else:
+                            body = await resp.aread()
+                            error = {
+                                "error": f"http_{resp.status_code}",
+                                "details": body.decode(errors="replace"),
+                            }
+                except TimeoutError:
+                    self._fail(upstream, "first_byte_timeout")
+                    raise _RetryableStreamError({"error": "timeout"})
+                except httpx.RequestError as exc:
+                    self._fail(upstream, "request_error")
+                    raise _RetryableStreamError({"error": str(exc)})
+
+                if error is not None:
+                    self._fail(upstream, error["error"])
+                    if resp.status_code >= 500:
+                        raise _RetryableStreamError(error)
+                    yield json.dumps(error)
                     return
-                async for line in resp.aiter_lines():
+
+                ttfb = time.perf_counter() - t0
+                if first is not None and first.startswith("data: "):
+                    yield first.removeprefix("data: ").strip()
+                async for line in lines:
                     if line.startswith("data: "):
                         yield line.removeprefix("data: ").strip()
+            upstream.record_success(time.perf_counter() - t0, ttfb)
+        except _RetryableStreamError:
+            raise
         except httpx.TimeoutException:
+            self._fail(upstream, "timeout")
             yield json.dumps({"error": "timeout"})
         except Exception as exc:
+            self._fail(upstream, str(exc))
             yield json.dumps({"error": str(exc)})
+        finally:
+            await self._release(upstream, client)
+
+    async def _acquire(self, exclude: Set[_Upstream], client: str = "") -> Optional[_Upstream]:
+        """
+        Reserve a slot on the least loaded upstream, waiting while all are busy.
+        Ejected upstreams are used only when nothing else is left.
+
+        Waiting requests are served in fair order (see `_grant`), so a client
+        flooding the service cannot hold every slot while others queue.
+        """
+        t0 = time.perf_counter()
+        async with self._slot_freed:
+            self._arrivals += 1
+            waiter = (self._arrivals, client, exclude)
+            self._waiters.append(waiter)
+            granted = False
+            try:
+                while True:
+                    if all(u in exclude for u in self._upstreams):
+                        return None
+                    best = self._grant(waiter)
+                    if best is not None:
+                        best.outstanding += 1
+                        self._client_slots[client] = self._client_slots.get(client, 0) + 1
+                        granted = True
+                        METRICS.observe("llm_queue_wait_seconds", time.perf_counter() - t0)
+                        return best
+                    await self._slot_freed.wait()
+            finally:
+                self._waiters.remove(waiter)
+                if not granted:
+                    # A slot this waiter was next in line for may now go to someone else
+                    self._slot_freed.notify_all()
+
+    def _grant(self, waiter: Tuple[int, str, Set[_Upstream]]) -> Optional[_Upstream]:
+        """
+        Upstream for `waiter` if it gets a free slot this round, else None.
+
+        Free slots are handed to waiters ordered by the number of slots their
+        client already holds, then by arrival; each takes the least loaded
+        upstream it may use.
+        """
+        free = {u: self._slots - u.outstanding for u in self._upstreams}
+        for w in sorted(self._waiters, key=lambda w: (self._client_slots.get(w[1], 0), w[0])):
+            candidates = [u for u in self._upstreams if u not in w[2]]
+            pool = [u for u in candidates if u.available()] or candidates
+            if not pool:
+                continue
+            best = max(pool, key=lambda u: free[u])
+            if free[best] <= 0:
+                continue
+            if w is waiter:
+                return best
+            free[best] -= 1
+        return None
+
+    async def _release(self, upstream: _Upstream, client: str = "") -> None:
+        async with self._slot_freed:
+            upstream.outstanding = max(0, upstream.outstanding - 1)
+            held = self._client_slots.get(client, 0) - 1
+            if held > 0:
+                self._client_slots[client] = held
+            else:
+                self._client_slots.pop(client, None)
+            self._slot_freed.notify_all()
+
+    def _fail(self, upstream: _Upstream, error: str) -> None:
+        METRICS.inc("errors_total", kind=error_kind(error))
+        upstream.record_failure(error, self._max_failures, self._eject_seconds)
+
+    async def _probe_loop(self) -> None:
+        while True:
+            await asyncio.gather(*(self._probe(u) for u in self._upstreams))
+            await asyncio.sleep(self._health_interval)
+
+    async def _probe(self, upstream: _Upstream) -> None:
+        try:
+            resp = await self._client.get(upstream.health_url, timeout=self._health_interval)
+            healthy = resp.status_code == 200
+        except httpx.HTTPError:
+            healthy = False
+
+        if healthy and not upstream.healthy:
+            logger.info("[LLM] Upstream %s is healthy again", upstream.url)
+            upstream.consecutive_failures = 0
+            upstream.ejected_until = 0.0
+        elif not healthy and upstream.healthy:
+            logger.warning("[LLM] Health probe failed for %s", upstream.url)
+        upstream.healthy = healthy
 
     async def aclose(self) -> None:
-        """Close the HTTP client session."""
+        """Stop health probes and close the HTTP client session."""
+        if self._health_task is not None:
+            self._health_task.cancel()
+            await asyncio.gather(self._health_task, return_exceptions=True)
+            self._health_task = None
         await self._client.aclose()
 
 
 class RetrieverClient:
-    """Client for sending semantic search queries to the retrieval service."""
+    """
+    Client for sending semantic search queries to the retrieval service.
+
+    With `retrieval_transport="msgpack"` responses are requested as msgpack
+    via the Accept header; the decoder follows the response content type,
+    so a service without msgpack support still answers in JSON.
+    """
 
     def __init__(self, settings: Settings):
         self._url: str = settings.retriever_url
+        self._batch_url: str = settings.retriever_batch_url
         self._timeout: int = settings.timeout_clients
-        self._client = httpx.AsyncClient(timeout=self._timeout)
+        headers = {}
+        if settings.retrieval_transport == "msgpack" and msgpack is not None:
+            headers["Accept"] = f"{MSGPACK}, application/json;q=0.9"
+        self._client = httpx.AsyncClient(
+            timeout=self._timeout,
+            headers=headers,
+            http2=settings.retrieval_http2,
+            limits=httpx.Limits(
+                max_connections=settings.retrieval_max_connections,
+                max_keepalive_connections=settings.retrieval_max_connections,
+                keepalive_expiry=settings.retrieval_keepalive_expiry,
+            ),
+        )
+
+    @staticmethod
+    def _decode(resp: httpx.Response) -> Any:
+        if resp.headers.get("content-type", "").startswith(MSGPACK):
+            return msgpack.unpackb(resp.content)
+        return resp.json()
 
     async def get_chunks(
         self,
@@ -78,10 +442,18 @@ class RetrieverClient:
         k: int,
         top_n: int,
         use_reranker: bool,
-    ) -> Tuple[List[str], float, float, List[Optional[float]]]:
+        deadline: Optional[Deadline] = None,
+        reserve: float = 0.0,
+        trace: Optional[Trace] = None,
+    ) -> Retrieved:
         """
         Sends a retrieval request and returns relevant context chunks,
-        along with faiss and reranking times and scores.
+        along with faiss and reranking times, scores and source document names.
+
+        With a deadline, the retrieval service is told how much of the budget it
+        may spend (the remaining time minus `reserve` seconds kept for generation).
+        With a trace, the call is recorded as the `retrieval_http` span and the
+        encode/faiss/rerank spans reported by the retrieval service are merged in.
         """
         payload = {
             "question": question,
@@ -89,21 +461,60 @@ class RetrieverClient:
             "top_n": top_n,
             "use_reranker": use_reranker,
         }
+        headers: Dict[str, str] = {}
+        if deadline is not None:
+            headers.update(deadline.header(reserve))
+        if trace is not None:
+            headers.update(trace.header())
         try:
-            resp = await self._client.post(self._url, json=payload)
-            resp.raise_for_status()
-            data: Dict[str, Any] = resp.json()
-            return (
-                data.get("chunks", []),
-                float(data.get("faiss_time", 0.0)),
-                float(data.get("rerank_time", 0.0)),
-                data.get("scores", [None] * top_n),
-            )
+            with trace.span("retrieval_http") if trace is not None else nullcontext() as start_ms:
+                resp = await self._client.post(
+                    self._url,
+                    json=payload,
+                    headers=headers,
+                    timeout=_timeout(deadline, self._timeout),
+                )
+                resp.raise_for_status()
+                data = self._decode(resp)
+            if trace is not None:
+                for name, span in data.get("spans", {}).items():
+                    trace.add(f"retrieval.{name}", start_ms + span["start_ms"], span["duration_ms"], "retrieval")
+            return Retrieved.from_response(data, top_n)
         except httpx.TimeoutException:
             logger.error("[Retriever] Request timeout.")
+            METRICS.inc("errors_total", kind="retrieval_timeout")
         except Exception as exc:
             logger.error("[Retriever] Connection error: %s", exc)
-        return [], 0.0, 0.0, []
+            METRICS.inc("errors_total", kind="retrieval_error")
+        return Retrieved.empty()
+
+    async def get_chunks_batch(
+        self,
+        *,
+        questions: List[str],
+        k: int,
+        top_n: int,
+        use_reranker: bool,
+    ) -> List[Retrieved]:
+        """
+        Retrieves context for several questions in one batched request.
+        Results are in question order; on failure every question gets an empty result.
+        """
+        payload = {
+            "questions": questions,
+            "k": k,
+            "top_n": top_n,
+            "use_reranker": use_reranker,
+        }
+        try:
+            resp = await self._client.post(self._batch_url, json=payload)
+            resp.raise_for_status()
+            return [Retrieved.from_response(data, top_n) for data in self._decode(resp)["results"]]
+        except httpx.TimeoutException:
+            logger.error("[Retriever] Batch request timeout.")
+        except Exception as exc:
+            logger.error("[Retriever] Batch connection error: %s", exc)
+        return [Retrieved.empty() for _ in questions]
 
     async def aclose(self) -> None:
         """Close the HTTP client session."""
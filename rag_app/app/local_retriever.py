@@ -0,0 +1,170 @@
+import asyncio
+import importlib.util
+import logging
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import ModuleType
+from typing import Any, List, Optional
+
+from config import Settings
+from deadline import Deadline
+from llm_client import Retrieved
+from metrics import METRICS
+from tracing import Trace
+
+logger = logging.getLogger(__name__)
+
+# Imported by the retrieval service's model_wrapper; not in rag_app's requirements
+BACKEND_PACKAGES = ("faiss", "numpy", "torch", "FlagEmbedding")
+
+
+def _load_module(name: str, path: Path) -> ModuleType:
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def check_local_retrieval(app_dir: Path) -> None:
+    """
+    Fail at startup, with what is missing, if `retrieval_mode=local` cannot
+    work here: the rag_app image ships neither the retrieval code nor its
+    model dependencies.
+    """
+    problems = []
+    if not (app_dir / "model_wrapper.py").is_file():
+        problems.append(f"retrieval_app_dir {app_dir} has no model_wrapper.py")
+    missing = [name for name in BACKEND_PACKAGES if importlib.util.find_spec(name) is None]
+    if missing:
+        problems.append(f"packages not installed: {', '.join(missing)} (see retrieval/requirements.txt)")
+    if problems:
+        raise RuntimeError("retrieval_mode=local is not usable: " + "; ".join(problems))
+
+
+def load_retrieval_backend(app_dir: Path) -> ModuleType:
+    """
+    Import the retrieval service's `model_wrapper` from `app_dir`.
+
+    Both services have a top-level `config` module, so retrieval's config is
+    loaded under its own name and bound as `config` only while
+    `model_wrapper` is imported; rag_app's `config` is restored afterwards.
+    """
+    saved = sys.modules.get("config")
+    try:
+        sys.modules["config"] = _load_module("retrieval_config", app_dir / "config.py")
+        return _load_module("retrieval_model_wrapper", app_dir / "model_wrapper.py")
+    finally:
+        if saved is not None:
+            sys.modules["config"] = saved
+        else:
+            sys.modules.pop("config", None)
+
+
+class LocalRetrieverClient:
+    """
+    Runs the retrieval `EmbeddingBackend` inside rag_app, behind the
+    `RetrieverClient` interface.
+
+    Inference runs on a single worker thread: it stays off the event loop
+    and calls into the model are serialized, as they are in the retrieval
+    service. The model is loaded in the background at construction.
+    """
+
+    def __init__(self, settings: Settings):
+        self._timeout: int = settings.timeout_clients
+        check_local_retrieval(Path(settings.retrieval_app_dir))
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval")
+        self._module = load_retrieval_backend(Path(settings.retrieval_app_dir))
+        self._executor.submit(self._module.get_backend)
+
+    async def get_chunks(
+        self,
+        *,
+        question: str,
+        k: int,
+        top_n: int,
+        use_reranker: bool,
+        deadline: Optional[Deadline] = None,
+        reserve: float = 0.0,
+        trace: Optional[Trace] = None,
+    ) -> Retrieved:
+        """Same contract as `RetrieverClient.get_chunks`, without the HTTP round trip."""
+        budget_ms = max(0.0, deadline.remaining() - reserve) * 1000 if deadline is not None else None
+        start_ms = trace.now_ms() if trace is not None else 0.0
+        try:
+            result = await self._run(
+                deadline,
+                question=question,
+                k=k,
+                top_n=top_n,
+                use_reranker=use_reranker,
+                budget_ms=budget_ms,
+                batch=False,
+            )
+        except asyncio.TimeoutError:
+            logger.error("[Retriever] Local retrieval timeout.")
+            METRICS.inc("errors_total", kind="retrieval_timeout")
+            return Retrieved.empty()
+        except Exception as exc:
+            logger.exception("[Retriever] Local retrieval failed: %s", exc)
+            METRICS.inc("errors_total", kind="retrieval_error")
+            return Retrieved.empty()
+
+        if trace is not None:
+            trace.add("retrieval_local", start_ms, trace.now_ms() - start_ms)
+            for name, span in result.spans.items():
+                trace.add(f"retrieval.{name}", start_ms + span["start_ms"], span["duration_ms"], "retrieval")
+        return self._convert(result)
+
+    async def get_chunks_batch(
+        self,
+        *,
+        questions: List[str],
+        k: int,
+        top_n: int,
+        use_reranker: bool,
+    ) -> List[Retrieved]:
+        """Same contract as `RetrieverClient.get_chunks_batch`."""
+        try:
+            results = await self._run(
+                None,
+                questions=questions,
+                k=k,
+                top_n=top_n,
+                use_reranker=use_reranker,
+                batch=True,
+            )
+            return [self._convert(r) for r in results]
+        except Exception as exc:
+            logger.exception("[Retriever] Local batch retrieval failed: %s", exc)
+            METRICS.inc("errors_total", kind="retrieval_error")
+            return [Retrieved.empty() for _ in questions]
+
+    async def aclose(self) -> None:
+        """Drop queued calls and wait, off the event loop, for the running one (if any) to complete."""
+        await asyncio.to_thread(self._executor.shutdown, wait=True, cancel_futures=True)
+
+    async def _run(self, deadline: Optional[Deadline], *, batch: bool, **kwargs: Any) -> Any:
+        def _call() -> Any:
+            backend = self._module.get_backend()
+            if batch:
+                return backend.get_top_chunks_batch(**kwargs)
+            return backend.get_top_chunks(**kwargs)
+
+        future = asyncio.get_running_loop().run_in_executor(self._executor, _call)
+        timeout = deadline.timeout(self._timeout) if deadline is not None else self._timeout
+        return await asyncio.wait_for(future, timeout)
+
+    @staticmethod
+    def _convert(result: Any) -> Retrieved:
+        return Retrieved(
+            result.chunks,
+            result.faiss_time,
+            result.rerank_time,
+            result.scores,
+            result.sources,
+            list(result.degradations),
+            result.compression_ratio,
+            result.chunk_ids,
+        )
@@ -1,30 +1,277 @@
+import asyncio
 import json
 import logging
 from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
 from typing import Any, Dict, List, Optional, Tuple
 
 import httpx
 
-from config import settings
+from config import Settings, settings
 
 logger = logging.getLogger(__name__)
 
 
-async def send_log_to_collector(data: dict) -> None:
+class LogShipper:
     """
-    Sends a log entry to the log_collector service via HTTP POST.
+    Ships log entries to the log_collector from a background task.
+
+    The request path only calls `enqueue`, which never blocks. Entries are
+    batched by count (`log_batch_size`) and time (`log_flush_interval`) and
+    sent over one pooled connection, as one NDJSON request to
+    `log_collector_batch_url` (or one request per entry to `log_collector_url`
+    if that is empty). When the queue is full or the collector
+    is unreachable, entries are spilled to `log_dir` (or dropped) and
+    replayed once the queue drains.
     """
-    try:
-        async with httpx.AsyncClient(timeout=3) as client:
-            response = await client.post(settings.log_collector_url, json=data)
+
+    def __init__(self, st: Settings):
+        self._url: str = st.log_collector_url
+        self._batch_url: str = st.log_collector_batch_url
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, st.log_queue_size))
+        self._batch_size: int = max(1, st.log_batch_size)
+        self._flush_interval: float = st.log_flush_interval
+        self._spill_enabled: bool = st.log_overflow == "spill"
+        self._spill_path: Path = Path(st.log_dir) / "log_spill.jsonl"
+        self._spill_max_bytes: int = st.log_spill_max_bytes
+        self._shutdown_timeout: float = st.log_shutdown_timeout
+
+        self._pending_spill: List[Dict[str, Any]] = []
+        self._batch: List[Dict[str, Any]] = []  # taken from the queue, not yet delivered
+        self._client: Optional[httpx.AsyncClient] = None
+        self._task: Optional[asyncio.Task] = None
+        self._spill_io: Optional[asyncio.Task] = None  # spill file read or write in progress
+
+        self.sent: int = 0
+        self.failed: int = 0
+        self.spilled: int = 0
+        self.dropped: int = 0
+
+    def start(self) -> None:
+        """Open the pooled connection and start the shipping loop."""
+        if self._task is not None:
+            return
+        self._client = httpx.AsyncClient(
+            timeout=3,
+            limits=httpx.Limits(max_connections=1, max_keepalive_connections=1),
+        )
+        self._task = asyncio.create_task(self._run())
+
+    def enqueue(self, entry: Dict[str, Any]) -> None:
+        """Queue a log entry without blocking the caller."""
+        try:
+            self._queue.put_nowait(entry)
+        except asyncio.QueueFull:
+            self._overflow([entry])
+
+    def stats(self) -> Dict[str, int]:
+        """Shipping counters and current queue depth."""
+        return {
+            "queued": self._queue.qsize(),
+            "sent": self.sent,
+            "failed": self.failed,
+            "spilled": self.spilled,
+            "dropped": self.dropped,
+        }
+
+    async def stop(self) -> None:
+        """Flush queued entries (bounded by `log_shutdown_timeout`) and close the connection."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        if self._spill_io is not None:  # let a cancelled spill read/write finish
+            await asyncio.gather(self._spill_io, return_exceptions=True)
+
+        try:
+            async with asyncio.timeout(self._shutdown_timeout):
+                if self._batch:
+                    batch, self._batch = self._batch, []
+                    await self._send(batch)
+                while not self._queue.empty():
+                    await self._send(self._take_batch())
+        except TimeoutError:
+            logger.warning("[LogStats] Shutdown flush timed out, %d entries left", self._queue.qsize())
+
+        self._overflow([self._queue.get_nowait() for _ in range(self._queue.qsize())])
+        await self._flush_spill()
+        await self._client.aclose()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        await self._replay_spill()
+        while True:
+            self._batch = batch = [await self._queue.get()]
+            deadline = loop.time() + self._flush_interval
+            while len(batch) < self._batch_size:
+                batch.extend(self._take_batch(self._batch_size - len(batch)))
+                timeout = deadline - loop.time()
+                if len(batch) >= self._batch_size or timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except TimeoutError:
+                    break
+
+            delivered = await self._send(batch)
+            self._batch = []
+            await self._flush_spill()
+            if delivered and self._queue.empty():
+                await self._replay_spill()
+
+    def _take_batch(self, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        size = min(limit or self._batch_size, self._queue.qsize())
+        return [self._queue.get_nowait() for _ in range(size)]
+
+    async def _send(self, batch: List[Dict[str, Any]]) -> bool:
+        """Post a batch; failed entries go to overflow. Returns True if all were delivered."""
+        failed = await self._post_batch(batch) if self._batch_url else await self._post_each(batch)
+
+        if failed:
+            self.failed += len(failed)
+            if self._spill_enabled:
+                self._pending_spill.extend(failed)
+            else:
+                self.dropped += len(failed)
+        logger.debug("[LogStats] Shipped %d/%d log entries", len(batch) - len(failed), len(batch))
+        return not failed
+
+    async def _post_batch(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        One NDJSON request for the whole batch. Entries the collector rejects
+        as invalid are dropped, since resending cannot fix them.
+        """
+        body = "".join(json.dumps(entry, ensure_ascii=False) + "\n" for entry in batch)
+        try:
+            response = await self._client.post(
+                self._batch_url,
+                content=body.encode("utf-8"),
+                headers={"Content-Type": "application/x-ndjson"},
+            )
             response.raise_for_status()
-            logger.info("[LogStats] Log sent successfully (%s)", response.status_code)
-    except httpx.RequestError as exc:
-        logger.warning("[LogStats] Network error: %s", exc)
-    except httpx.HTTPStatusError as exc:
-        logger.warning("[LogStats] HTTP error %s – %s", exc.response.status_code, exc.response.text)
-    except Exception as exc:
-        logger.exception("[LogStats] Unexpected error: %s", exc)
+            statuses = response.json()["items"]
+        except httpx.RequestError as exc:
+            logger.warning("[LogStats] Network error: %s", exc)
+            return batch
+        except httpx.HTTPStatusError as exc:
+            logger.warning("[LogStats] HTTP error %s – %s", exc.response.status_code, exc.response.text[:200])
+            return batch
+        except Exception as exc:
+            logger.exception("[LogStats] Unexpected error: %s", exc)
+            return batch
+
+        invalid = [s for s in statuses if s != "queued"]
+        if invalid:
+            logger.warning("[LogStats] Collector rejected %d entries: %s", len(invalid), invalid[0])
+            self.dropped += len(invalid)
+        self.sent += len(batch) - len(invalid)
+        return []
+
+    async def _post_each(self, batch: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        failed: List[Dict[str, Any]] = []
+        for entry in batch:
+            try:
+                response = await self._client.post(self._url, json=entry)
+                response.raise_for_status()
+                self.sent += 1
+            except httpx.RequestError as exc:
+                logger.warning("[LogStats] Network error: %s", exc)
+                failed.append(entry)
+            except httpx.HTTPStatusError as exc:
+                logger.warning("[LogStats] HTTP error %s – %s", exc.response.status_code, exc.response.text)
+                failed.append(entry)
+            except Exception as exc:
+                logger.exception("[LogStats] Unexpected error: %s", exc)
+                failed.append(entry)
+        return failed
+
+    def _overflow(self, entries: List[Dict[str, Any]]) -> None:
+        """Park entries for the next spill flush; drop them if spilling is off or backlogged."""
+        if not entries:
+            return
+        if self._spill_enabled and len(self._pending_spill) < self._queue.maxsize:
+            self._pending_spill.extend(entries)
+        else:
+            self.dropped += len(entries)
+            logger.warning("[LogStats] Log queue is full — dropped %d entries", len(entries))
+
+    async def _shielded(self, coro: Any) -> None:
+        """
+        Run spill file I/O as its own task, shielded from cancellation of the
+        shipping loop, so entries taken out of memory or out of the file always
+        land somewhere; `stop` waits for it.
+        """
+        self._spill_io = asyncio.create_task(coro)
+        await asyncio.shield(self._spill_io)
+
+    async def _flush_spill(self) -> None:
+        if not self._pending_spill:
+            return
+        entries, self._pending_spill = self._pending_spill, []
+        await self._shielded(self._write_spill(entries))
+
+    async def _write_spill(self, entries: List[Dict[str, Any]]) -> None:
+        written = await asyncio.to_thread(self._append_spill, entries)
+        self.spilled += written
+        self.dropped += len(entries) - written
+
+    def _append_spill(self, entries: List[Dict[str, Any]]) -> int:
+        size = self._spill_path.stat().st_size if self._spill_path.exists() else 0
+        written = 0
+        with self._spill_path.open("a", encoding="utf-8") as f:
+            for entry in entries:
+                line = json.dumps(entry, ensure_ascii=False) + "\n"
+                size += len(line.encode("utf-8"))
+                if size > self._spill_max_bytes:
+                    logger.warning("[LogStats] Spill file is full — dropping entries")
+                    break
+                f.write(line)
+                written += 1
+        return written
+
+    async def _replay_spill(self) -> None:
+        if not self._spill_path.exists():
+            return
+        free = self._queue.maxsize - self._queue.qsize()
+        await self._shielded(self._load_spill(free))
+
+    async def _load_spill(self, limit: int) -> None:
+        entries = await asyncio.to_thread(self._pop_spill, limit)
+        for n, entry in enumerate(entries):
+            try:
+                self._queue.put_nowait(entry)
+            except asyncio.QueueFull:  # filled up by enqueue meanwhile: back to the next spill flush
+                self._pending_spill.extend(entries[n:])
+                break
+        if entries:
+            logger.info("[LogStats] Replaying %d spilled log entries", len(entries))
+
+    def _pop_spill(self, limit: int) -> List[Dict[str, Any]]:
+        """Take up to `limit` entries from the spill file, rewriting the remainder."""
+        lines = self._spill_path.read_text(encoding="utf-8").splitlines()
+        head, rest = lines[:limit], lines[limit:]
+        if rest:
+            tmp = self._spill_path.with_suffix(".tmp")
+            tmp.write_text("\n".join(rest) + "\n", encoding="utf-8")
+            tmp.replace(self._spill_path)
+        else:
+            self._spill_path.unlink()
+
+        entries = []
+        for line in head:
+            try:
+                entries.append(json.loads(line))
+            except json.JSONDecodeError:
+                logger.warning("[LogStats] Skipping corrupt spilled entry")
+        return entries
+
+
+@lru_cache(maxsize=1)
+def get_log_shipper() -> LogShipper:
+    """Returns singleton instance of LogShipper."""
+    return LogShipper(settings)
 
 
 def format_log_payload(
@@ -33,7 +280,9 @@ def format_log_payload(
     answer: str,
     stats: Dict[str, Any],
     timings: Dict[str, float],
-    scores: Optional[List[Optional[float]]] = None
+    scores: Optional[List[Optional[float]]] = None,
+    trace: Optional[Dict[str, Any]] = None,
+    chunk_ids: Optional[List[Optional[str]]] = None,
 ) -> Dict[str, Any]:
     """
     Formats a full log payload for storage or transmission.
@@ -45,6 +294,9 @@ def format_log_payload(
         stats: Stats such as IP, token counts, request time.
         timings: Time-based performance metrics.
         scores: Reranker scores for each context chunk (if available).
+        trace: Exported request trace with per-stage spans (if available).
+        chunk_ids: Retrieval index id of each context chunk, None where the
+            chunk text is not the indexed text (if available).
 
     Returns:
         A dict formatted for RAGAS-style logging.
@@ -57,11 +309,12 @@ def format_log_payload(
         {
             "text": chunk,
             "score": scores[i] if scores and i < len(scores) else None,
+            "id": chunk_ids[i] if chunk_ids and i < len(chunk_ids) else None,
         }
         for i, chunk in enumerate(context)
     ]
 
-    return {
+    payload: Dict[str, Any] = {
         "stats": [stats],
         "timings": timings,
         "texts": [
@@ -75,11 +328,15 @@ def format_log_payload(
             {"answer": {"text": answer, "len_answer": len(answer)}}
         ],
     }
+    if trace is not None:
+        payload["trace"] = trace
+    return payload
 
 
 def extract_timings_and_stats(
     data: dict,
-    ip: str
+    ip: str,
+    total_time: Optional[float] = None,
 ) -> Tuple[Dict[str, float], Dict[str, Any]]:
     """
     Extracts execution timing metrics and user statistics from a generation result.
@@ -87,6 +344,7 @@ def extract_timings_and_stats(
     Args:
         data: The model's full response including timings, usage, etc.
         ip: Request origin IP address.
+        total_time: Measured end-to-end request time; defaults to retrieval + generation time.
 
     Returns:
         Tuple of timing metrics and stats.
@@ -101,7 +359,10 @@ def extract_timings_and_stats(
         "prompt_per_token_ms": data.get("timings", {}).get("prompt_per_token_ms", 0.0),
         "predicted_ms": data.get("timings", {}).get("predicted_ms", 0.0),
         "predicted_per_token_ms": data.get("timings", {}).get("predicted_per_token_ms", 0.0),
-        "all_time": data.get("faiss_time", 0.0) + data.get("model_time", 0.0),
+        "all_time": (
+            total_time if total_time is not None
+            else data.get("chunk_gen_time", 0.0) + data.get("model_time", 0.0)
+        ),
     }
 
     stats: Dict[str, Any] = {
@@ -111,6 +372,8 @@ def extract_timings_and_stats(
         "question_context_tokens": data.get("usage", {}).get("prompt_tokens"),
         "total_tokens": data.get("usage", {}).get("total_tokens"),
         "finish_reason": data.get("finish_reason", "unknown"),
+        "degradations": data.get("degradations", []),
+        "compression_ratio": data.get("compression_ratio"),
     }
 
     return timings, stats
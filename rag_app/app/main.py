@@ -1,10 +1,14 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.staticfiles import StaticFiles
 
 from api import router as api_router
+from compression import JSONCompressionMiddleware
+from files import router as files_router
 from logger import setup_logger
 from config import settings
+from rag_service import get_rag_service
+from rate_limit import get_rate_limiter
+from log_stats import get_log_shipper
 
 import logging
 
@@ -18,7 +22,8 @@ app = FastAPI(
 )
 
 app.include_router(api_router, prefix="/api")
-app.mount("/files", StaticFiles(directory=settings.documents_dir), name="documents")
+app.include_router(files_router)
+app.add_middleware(JSONCompressionMiddleware, minimum_size=settings.compress_min_size)
 
 # Enable CORS (for development use only, restrict in production)
 app.add_middleware(
@@ -33,14 +38,19 @@ app.add_middleware(
 @app.on_event("startup")
 async def startup_event() -> None:
     """
-    Log service startup.
+    Start background tasks and log service startup.
     """
+    get_rag_service().start()
+    get_log_shipper().start()
     logger.info("🚀 RAG Agent started")
 
 
 @app.on_event("shutdown")
 async def shutdown_event() -> None:
     """
-    Log service shutdown.
+    Flush pending logs, close client sessions and log service shutdown.
     """
+    await get_rag_service().aclose()
+    await get_rate_limiter().aclose()
+    await get_log_shipper().stop()
     logger.info("🛑 RAG Agent stopped")
@@ -0,0 +1,144 @@
+import math
+from collections import deque
+from typing import Deque, Dict, List, Tuple
+
+from config import settings
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class RollingSummary:
+    """
+    Quantiles over the last `window` observations plus lifetime count and sum.
+
+    Observing is an O(1) append to a bounded deque; the samples are sorted
+    only when the metrics are scraped.
+    """
+
+    def __init__(self, window: int):
+        self._samples: Deque[float] = deque(maxlen=max(1, window))
+        self.count: int = 0
+        self.sum: float = 0.0
+
+    def observe(self, value: float) -> None:
+        self._samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantiles(self) -> List[Tuple[float, float]]:
+        if not self._samples:
+            return [(q, math.nan) for q in QUANTILES]
+        ordered = sorted(self._samples)
+        last = len(ordered) - 1
+        return [(q, ordered[min(last, int(q * len(ordered)))]) for q in QUANTILES]
+
+
+class Metrics:
+    """
+    In-process metrics registry rendered in Prometheus text format.
+
+    All updates happen on the event loop thread, so no locks are taken:
+    counters are plain numbers and summaries append to a bounded deque.
+    """
+
+    def __init__(self, window: int, prefix: str = "rag"):
+        self._window = window
+        self._prefix = prefix
+        self._help: Dict[str, Tuple[str, str]] = {}
+        self._summaries: Dict[str, RollingSummary] = {}
+        self._counters: Dict[str, Dict[_LabelKey, float]] = {}
+        self._gauges: Dict[str, Dict[_LabelKey, float]] = {}
+
+    def summary(self, name: str, help_text: str) -> None:
+        self._help[name] = ("summary", help_text)
+        self._summaries[name] = RollingSummary(self._window)
+
+    def counter(self, name: str, help_text: str) -> None:
+        self._help[name] = ("counter", help_text)
+        self._counters[name] = {}
+
+    def gauge(self, name: str, help_text: str) -> None:
+        self._help[name] = ("gauge", help_text)
+        self._gauges[name] = {}
+
+    def observe(self, name: str, value: float) -> None:
+        self._summaries[name].observe(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels: str) -> None:
+        series = self._counters[name]
+        key = tuple(sorted(labels.items()))
+        series[key] = series.get(key, 0.0) + value
+
+    def set(self, name: str, value: float, **labels: str) -> None:
+        """Set a gauge, or a counter whose total is kept elsewhere and copied at scrape time."""
+        series = self._gauges[name] if name in self._gauges else self._counters[name]
+        series[tuple(sorted(labels.items()))] = value
+
+    def render(self) -> str:
+        """All metrics in Prometheus text exposition format (0.0.4)."""
+        lines: List[str] = []
+        for name, (kind, help_text) in self._help.items():
+            full = f"{self._prefix}_{name}"
+            lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            if kind == "summary":
+                s = self._summaries[name]
+                for q, value in s.quantiles():
+                    lines.append(f'{full}{{quantile="{q}"}} {_fmt(value)}')
+                lines.append(f"{full}_sum {_fmt(s.sum)}")
+                lines.append(f"{full}_count {s.count}")
+            else:
+                series = self._counters.get(name) if kind == "counter" else self._gauges.get(name)
+                for key, value in series.items():
+                    lines.append(f"{full}{_labels(key)} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(key: _LabelKey) -> str:
+    if not key:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in key) + "}"
+
+
+def _fmt(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    return repr(float(value))
+
+
+def error_kind(error: str) -> str:
+    """Collapse an LLM client error string into a metrics label (`http_503` -> `http_5xx`)."""
+    if error.startswith("http_") and len(error) == 8:
+        return f"http_{error[5]}xx"
+    if error in ("timeout", "first_byte_timeout", "request_error", "no_upstream"):
+        return error
+    return "other"
+
+
+METRICS = Metrics(settings.metrics_window)
+METRICS.summary("retrieval_seconds", "Retrieval service request latency")
+METRICS.summary("llm_queue_wait_seconds", "Time spent waiting for a free LLM slot")
+METRICS.summary("ttfb_seconds", "Time to first streamed token")
+METRICS.summary("generation_seconds", "LLM generation time")
+METRICS.summary("tokens_per_second", "Generation speed reported by llama.cpp (predicted_per_token_ms)")
+METRICS.summary("prompt_tokens", "Prompt size in tokens")
+METRICS.summary("context_compression_ratio", "Returned / original characters of compressed retrieval chunks")
+METRICS.summary("request_seconds", "End-to-end /query and /stream latency")
+METRICS.counter("requests_total", "Finished requests by endpoint and finish reason")
+METRICS.counter("errors_total", "Errors by kind")
+METRICS.gauge("active_requests", "Requests in progress")
+METRICS.gauge("llm_outstanding", "In-flight requests per LLM upstream")
+METRICS.gauge("llm_available", "Whether an LLM upstream is routable")
+METRICS.gauge("rerank_level", "Adaptive rerank level (0 = full quality)")
+METRICS.counter("rerank_decisions_total", "Retrievals by adaptive rerank level")
+METRICS.counter("rerank_transitions_total", "Adaptive rerank level changes, by direction (degrade / restore)")
+METRICS.gauge("rerank_p95_seconds", "p95 retrieval latency the adaptive rerank policy judges the current level on")
+METRICS.gauge("rerank_inflight", "Retrievals in progress, as seen by the adaptive rerank policy")
+METRICS.gauge("log_queue_size", "Log entries waiting to be shipped")
+METRICS.counter("throttled_total", "Requests refused by the per-client rate limits, by limit")
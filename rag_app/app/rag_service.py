@@ -2,14 +2,20 @@ import asyncio
 import json
 import logging
 import time
-from contextlib import asynccontextmanager
+from contextlib import aclosing, asynccontextmanager
 from functools import lru_cache
 from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
 
 from config import Settings, get_settings
+from deadline import Deadline
 from document_linker import inject_links_into_chunks
-from schemas import GenerationResult
-from llm_client import LLMClient, RetrieverClient
+from hint_matcher import HintMatcher
+from metrics import METRICS
+from schemas import EVENT_ERROR, EVENT_FINAL, EVENT_TOKEN, GenerationResult, StreamEvent
+from llm_client import LLMClient, RetrieverClient, Retrieved
+from local_retriever import LocalRetrieverClient
+from rerank_policy import AdaptiveRerankPolicy
+from tracing import Trace
 
 logger = logging.getLogger(__name__)
 settings = get_settings()
@@ -38,10 +44,24 @@ class RAGService:
 
     def __init__(self, st: Settings):
         self._settings = st
-        self._retriever = RetrieverClient(st)
+        if st.retrieval_mode == "local":
+            self._retriever = LocalRetrieverClient(st)
+        else:
+            self._retriever = RetrieverClient(st)
         self._llm = LLMClient(st)
+        self._rerank_policy = AdaptiveRerankPolicy(st)
+        self._hints = HintMatcher(
+            st.system_hints_path,
+            word_boundary=st.hints_word_boundary,
+            normalize=st.hints_normalize,
+            reload_interval=st.hints_reload_interval,
+        )
         self._logger = logging.getLogger(self.__class__.__name__)
 
+        # Running estimates of LLM speed used to fit generation into the deadline
+        self._ms_per_token: float = st.est_ms_per_token
+        self._prompt_s: float = st.est_prompt_seconds
+
     @asynccontextmanager
     async def _req_scope(self):
         await self._inc()
@@ -50,100 +70,254 @@ class RAGService:
         finally:
             await self._dec()
 
-    async def generate(self, question: str) -> GenerationResult:
-        """Generates a full answer (non-streaming)."""
+    async def generate(
+        self,
+        question: str,
+        deadline: Optional[Deadline] = None,
+        trace: Optional[Trace] = None,
+        client: str = "",
+    ) -> GenerationResult:
+        """
+        Generates a full answer (non-streaming) within the optional request deadline.
+        `client` identifies the caller for fair scheduling of LLM slots.
+        """
+        trace = trace or Trace()
         async with self._req_scope():
-            chunks, faiss_t, rerank_t, scores = await self._gather_context(question)
-
-            payload = self._build_payload(question, chunks, stream=False)
-            t0 = time.perf_counter()
-            response_json, error = await self._llm.chat(payload)
-            model_time = time.perf_counter() - t0
+            context = await self._gather_context(question, deadline, trace)
+            return await self._complete(question, context, trace, deadline, client)
+
+    async def generate_batch(
+        self, questions: List[str], client: str = ""
+    ) -> AsyncGenerator[Tuple[int, GenerationResult, Dict[str, float]], None]:
+        """
+        Answers many questions, yielding (index, result, item timings) as each completes.
+
+        Retrieval runs in batches of `batch_retrieval_size` questions; generations
+        start as soon as their context is ready and run with at most
+        `batch_concurrency` in flight (default: all LLM slots).
+        Batches always use full retrieval quality, bypassing the adaptive rerank policy.
+        All generations count as `client` in LLM slot scheduling, so other
+        clients' requests are not starved by a running batch.
+        """
+        size = max(1, self._settings.batch_retrieval_size)
+        concurrency = self._settings.batch_concurrency or self._llm.capacity
+        slots = asyncio.Semaphore(concurrency)
+        done: asyncio.Queue = asyncio.Queue()
+        tasks: List[asyncio.Task] = []
+
+        async def _answer(index: int, question: str, retrieved: Retrieved, retrieval_time: float) -> None:
+            t_wait = time.perf_counter()
+            async with slots:
+                queue_wait = time.perf_counter() - t_wait
+                trace = Trace()
+                async with self._req_scope():
+                    # Every index must put a result on `done`, or the consumer below waits forever
+                    context = retrieved._replace(
+                        degradations=list(retrieved.degradations), chunk_ids=list(retrieved.chunk_ids or [])
+                    )
+                    try:
+                        context = self._prepare_context(question, retrieved, trace)
+                        result = await self._complete(question, context, trace, client=client)
+                    except Exception as exc:
+                        self._logger.exception("[RAG] Batch item %d failed: %s", index, exc)
+                        result = self._result(
+                            question, context, answer=f"Error: {exc}", model_time=0.0, finish_reason="error"
+                        )
+            await done.put((index, result, {
+                "retrieval_time": retrieval_time,
+                "queue_wait": queue_wait,
+                "model_time": result.model_time,
+            }))
+
+        async def _produce() -> None:
+            try:
+                for start in range(0, len(questions), size):
+                    part = questions[start:start + size]
+                    t0 = time.perf_counter()
+                    retrieved = await self._retriever.get_chunks_batch(
+                        questions=part,
+                        k=self._settings.default_k,
+                        top_n=self._settings.default_top_n,
+                        use_reranker=self._settings.use_reranker,
+                    )
+                    retrieval_time = (time.perf_counter() - t0) / len(part)
+                    for offset, (question, item) in enumerate(zip(part, retrieved)):
+                        tasks.append(asyncio.create_task(_answer(start + offset, question, item, retrieval_time)))
+            except Exception as exc:
+                await done.put(exc)
+
+        producer = asyncio.create_task(_produce())
+        try:
+            for _ in range(len(questions)):
+                item = await done.get()
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            for task in (producer, *tasks):
+                task.cancel()
+            await asyncio.gather(producer, *tasks, return_exceptions=True)
+
+    async def _complete(
+        self,
+        question: str,
+        context: Retrieved,
+        trace: Trace,
+        deadline: Optional[Deadline] = None,
+        client: str = "",
+    ) -> GenerationResult:
+        n_predict = self._plan_generation(deadline, context.degradations)
+        with trace.span("prompt_build"):
+            payload = self._build_payload(question, context.chunks, n_predict=n_predict, stream=False)
+        t0 = time.perf_counter()
+        with trace.span("generation"):
+            response_json, error = await self._llm.chat(payload, deadline, client)
+        model_time = time.perf_counter() - t0
+
+        if error or response_json is None:
+            answer = f"LLM error: {error}"
+            finish_reason = "error"
+            usage: Dict[str, Any] = {}
+            timings: Dict[str, Any] = {}
+        else:
+            answer = response_json["choices"][0]["message"]["content"]
+            finish_reason = response_json["choices"][0].get("finish_reason", "stop")
+            usage = response_json.get("usage", {})
+            timings = response_json.get("timings", {})
+            self._trace_llm(trace, timings, end_ms=trace.now_ms())
+
+        self._observe_generation(model_time, timings, usage)
+        self._logger.info("✅ Answer generated in %.2f sec", model_time)
+
+        return self._result(
+            question,
+            context,
+            answer=answer,
+            model_time=model_time,
+            timings=timings,
+            usage=usage,
+            finish_reason=finish_reason,
+        )
 
-            if error or response_json is None:
-                answer = f"LLM error: {error}"
-                finish_reason = "error"
-                usage: Dict[str, Any] = {}
-                timings: Dict[str, Any] = {}
-            else:
-                answer = response_json["choices"][0]["message"]["content"]
-                finish_reason = response_json["choices"][0].get("finish_reason", "stop")
-                usage = response_json.get("usage", {})
-                timings = response_json.get("timings", {})
-
-            self._logger.info("✅ Answer generated in %.2f sec", model_time)
-
-            return GenerationResult(
-                question=question,
-                answer=answer,
-                context=chunks,
-                scores=scores,
-                faiss_time=faiss_t,
-                rerank_time=rerank_t,
-                chunk_gen_time=faiss_t + rerank_t,
-                model_time=model_time,
-                timings=timings,
-                usage=usage,
-                finish_reason=finish_reason,
-            )
+    @staticmethod
+    def _result(question: str, context: Retrieved, **fields: Any) -> GenerationResult:
+        """`GenerationResult` of an answer generated from `context`."""
+        return GenerationResult(
+            question=question,
+            context=context.chunks,
+            scores=context.scores,
+            faiss_time=context.faiss_time,
+            rerank_time=context.rerank_time,
+            chunk_gen_time=context.faiss_time + context.rerank_time,
+            degradations=context.degradations,
+            compression_ratio=context.compression_ratio,
+            chunk_ids=context.chunk_ids,
+            **fields,
+        )
 
-    async def stream(self, question: str) -> AsyncGenerator[str, None]:
-        """Line-by-line generation (SSE / chunked)."""
+    async def stream(
+        self,
+        question: str,
+        deadline: Optional[Deadline] = None,
+        trace: Optional[Trace] = None,
+        client: str = "",
+    ) -> AsyncGenerator[StreamEvent, None]:
+        """
+        Streamed generation as typed events: one `token` event per content delta,
+        an `error` event if the LLM fails, and a closing `final` event carrying
+        the full `GenerationResult`.
+        """
+        trace = trace or Trace()
         async with self._req_scope():
-            chunks, faiss_t, rerank_t, scores = await self._gather_context(question)
-            payload = self._build_payload(question, chunks, stream=True)
+            context = await self._gather_context(question, deadline, trace)
+            n_predict = self._plan_generation(deadline, context.degradations)
+            with trace.span("prompt_build"):
+                payload = self._build_payload(question, context.chunks, n_predict=n_predict, stream=True)
 
             t_start = time.perf_counter()
+            llm_start_ms = trace.now_ms()
+            first_token_ms: Optional[float] = None
             first_chunk = False
             ttfb: float = 0.0
 
-            buf = ""
+            parts: List[str] = []
             usage: Dict[str, Any] = {}
             timings: Dict[str, Any] = {}
             finish_reason: Optional[str] = None
-
-            async for line in self._llm.stream_chat(payload):
-                if line == "[DONE]":
-                    break
-                try:
-                    jd = json.loads(line)
-                except json.JSONDecodeError:
-                    self._logger.warning("[STREAM] Non‑JSON response: %.200s", line)
-                    continue
-
-                delta = jd["choices"][0].get("delta", {})
-                content = delta.get("content")
-                if content:
-                    if not first_chunk:
-                        ttfb = time.perf_counter() - t_start
-                        timings["ttfb"] = ttfb
-                        first_chunk = True
-                        self._logger.info("⏱️ TTFB: %.2f sec", ttfb)
-                    buf += content
-                    yield content
-
-                finish_reason = jd["choices"][0].get("finish_reason", finish_reason)
-                usage.update(jd.get("usage", {}))
-                timings.update(jd.get("timings", {}))
+            error: Optional[str] = None
+
+            async with aclosing(self._llm.stream_chat(payload, deadline, client)) as lines:
+                async for line in lines:
+                    if line == "[DONE]":
+                        break
+                    try:
+                        jd = json.loads(line)
+                    except json.JSONDecodeError:
+                        self._logger.warning("[STREAM] Non‑JSON response: %.200s", line)
+                        continue
+
+                    if "error" in jd:
+                        error = str(jd["error"])
+                        finish_reason = "error"
+                        self._logger.error("[STREAM] LLM error: %s", error)
+                        yield StreamEvent(EVENT_ERROR, jd)
+                        break
+
+                    choice = jd["choices"][0]
+                    content = choice.get("delta", {}).get("content")
+                    if content:
+                        if not first_chunk:
+                            ttfb = time.perf_counter() - t_start
+                            timings["ttfb"] = ttfb
+                            first_chunk = True
+                            first_token_ms = trace.now_ms()
+                            trace.add("ttfb", llm_start_ms, first_token_ms - llm_start_ms)
+                            METRICS.observe("ttfb_seconds", ttfb)
+                            self._logger.info("⏱️ TTFB: %.2f sec", ttfb)
+                        parts.append(content)
+                        yield StreamEvent(EVENT_TOKEN, content)
+
+                    finish_reason = choice.get("finish_reason") or finish_reason
+                    if jd.get("usage"):
+                        usage.update(jd["usage"])
+                    if jd.get("timings"):
+                        timings.update(jd["timings"])
 
             model_time = time.perf_counter() - t_start
+            self._observe_generation(model_time, timings, usage)
+            end_ms = trace.now_ms()
+            if first_token_ms is not None:
+                trace.add("generation", first_token_ms, end_ms - first_token_ms)
+            self._trace_llm(trace, timings, end_ms=end_ms, first_token_ms=first_token_ms)
+            answer = "".join(parts)
+            if error and not answer:
+                answer = f"LLM error: {error}"
 
-            yield json.dumps(
-                GenerationResult(
-                    question=question,
-                    answer=buf,
-                    context=chunks,
-                    scores=scores,
-                    faiss_time=faiss_t,
-                    rerank_time=rerank_t,
-                    chunk_gen_time=faiss_t + rerank_t,
+            yield StreamEvent(
+                EVENT_FINAL,
+                self._result(
+                    question,
+                    context,
+                    answer=answer,
                     model_time=model_time,
                     timings=timings,
                     usage=usage,
                     finish_reason=finish_reason or "stop",
-                ).dict()
+                ),
             )
 
+    def start(self) -> None:
+        """Start background tasks of the underlying clients."""
+        self._llm.start()
+
+    def llm_stats(self) -> List[Dict[str, Any]]:
+        """Per-upstream LLM routing statistics."""
+        return self._llm.stats()
+
+    def rerank_stats(self) -> Dict[str, Any]:
+        """State and decision counters of the adaptive rerank policy."""
+        return self._rerank_policy.stats()
+
     async def aclose(self) -> None:
         await asyncio.gather(
             self._retriever.aclose(),
@@ -151,31 +325,126 @@ class RAGService:
             return_exceptions=True,
         )
 
-    async def _gather_context(
-        self, question: str
-    ) -> Tuple[List[str], float, float, List[Optional[float]]]:
-        chunks_raw, faiss_t, rerank_t, scores = await self._retriever.get_chunks(
-            question=question,
-            k=self._settings.default_k,
-            top_n=self._settings.default_top_n,
-            use_reranker=self._settings.use_reranker,
-        )
-        if len(chunks_raw) >= 1:
-            chunks = inject_links_into_chunks(chunks_raw)
+    async def _gather_context(self, question: str, deadline: Optional[Deadline], trace: Trace) -> Retrieved:
+        """Retrieve at the level chosen by the adaptive rerank policy, then `_prepare_context`."""
+        level = self._rerank_policy.acquire()
+        t0 = time.perf_counter()
+        try:
+            retrieved = await self._retriever.get_chunks(
+                question=question,
+                k=level.k,
+                top_n=self._settings.default_top_n,
+                use_reranker=level.use_reranker,
+                deadline=deadline,
+                reserve=self._generation_reserve(),
+                trace=trace,
+            )
+        finally:
+            retrieval_time = time.perf_counter() - t0
+            self._rerank_policy.release(retrieval_time)
+            METRICS.observe("retrieval_seconds", retrieval_time)
+
+        context = self._prepare_context(question, retrieved, trace)
+        if level.name != "full":
+            context.degradations.append(f"rerank_policy:{level.name}")
+        return context
+
+    def _prepare_context(self, question: str, retrieved: Retrieved, trace: Trace) -> Retrieved:
+        """
+        The context as sent to the LLM: chunks with document links, best chunk
+        last, then the matching system hints. `chunk_ids` and `sources` are
+        aligned with the chunks (None for the fallback message and hints), and
+        `degradations` is a fresh list the caller may append to.
+        """
+        if retrieved.compression_ratio is not None:
+            METRICS.observe("context_compression_ratio", retrieved.compression_ratio)
+        if len(retrieved.chunks) >= 1:
+            with trace.span("link_injection"):
+                chunks = inject_links_into_chunks(retrieved.chunks, retrieved.sources)
+            chunk_ids = list(retrieved.chunk_ids or [])[:len(chunks)]
+            chunk_ids += [None] * (len(chunks) - len(chunk_ids))
+            sources = list(retrieved.sources)[:len(chunks)]
+            sources += [None] * (len(chunks) - len(sources))
         else:
             self._logger.warning("[RAG] No chunks retrieved — fallback message injected.")
+            METRICS.inc("errors_total", kind="retrieval_fallback")
             chunks = [
                 "[System message] Retrieval service is unavailable. Please contact support.\n"
                 "LLM MUST PASS THIS TO THE USER!",
             ]
+            chunk_ids = [None]
+            sources = [None]
 
         chunks = chunks[::-1]
-        chunks.extend(self._silly_handler(question))
+        chunk_ids = chunk_ids[::-1]
+        sources = sources[::-1]
+        with trace.span("hints"):
+            chunks.extend(self._silly_handler(question))
+        chunk_ids += [None] * (len(chunks) - len(chunk_ids))
+        sources += [None] * (len(chunks) - len(sources))
+
+        return retrieved._replace(
+            chunks=chunks,
+            sources=sources,
+            degradations=list(retrieved.degradations),
+            chunk_ids=chunk_ids,
+        )
 
-        return chunks, faiss_t, rerank_t, scores
+    def _generation_reserve(self) -> float:
+        """Seconds kept for the LLM while retrieval runs: prompt processing plus `min_n_predict` tokens."""
+        return self._prompt_s + self._settings.min_n_predict * self._ms_per_token / 1000
+
+    def _plan_generation(self, deadline: Optional[Deadline], degradations: List[str]) -> int:
+        """
+        Number of tokens to request from the LLM. Capped so that generation
+        at the estimated speed ends within the deadline, but never below
+        `min_n_predict`; a cap is recorded in `degradations`.
+        """
+        n_predict = self._settings.max_generated_tokens
+        if deadline is None:
+            return n_predict
+
+        available_ms = (deadline.remaining() - self._prompt_s) * 1000
+        affordable = int(available_ms / self._ms_per_token)
+        if affordable < n_predict:
+            n_predict = max(self._settings.min_n_predict, affordable)
+            degradations.append(f"n_predict_capped:{n_predict}")
+        return n_predict
+
+    def _observe_generation(self, model_time: float, timings: Dict[str, Any], usage: Dict[str, Any]) -> None:
+        """Record generation metrics and update LLM speed estimates from llama.cpp response timings."""
+        METRICS.observe("generation_seconds", model_time)
+        if usage.get("prompt_tokens") is not None:
+            METRICS.observe("prompt_tokens", float(usage["prompt_tokens"]))
+
+        per_token = timings.get("predicted_per_token_ms")
+        if per_token:
+            METRICS.observe("tokens_per_second", 1000 / float(per_token))
+            self._ms_per_token = 0.8 * self._ms_per_token + 0.2 * float(per_token)
+        prompt_ms = timings.get("prompt_ms")
+        if prompt_ms:
+            self._prompt_s = 0.8 * self._prompt_s + 0.2 * float(prompt_ms) / 1000
+
+    @staticmethod
+    def _trace_llm(
+        trace: Trace, timings: Dict[str, Any], *, end_ms: float, first_token_ms: Optional[float] = None
+    ) -> None:
+        """
+        Add llama.cpp prompt processing and token prediction spans from response
+        timings. Prediction starts at the first streamed token when known,
+        otherwise it is placed to end with the response.
+        """
+        prompt_ms = timings.get("prompt_ms")
+        predicted_ms = timings.get("predicted_ms")
+        if predicted_ms is None:
+            return
+        predict_start = first_token_ms if first_token_ms is not None else end_ms - predicted_ms
+        trace.add("llm.predict", predict_start, predicted_ms, "llama.cpp")
+        if prompt_ms is not None:
+            trace.add("llm.prompt", predict_start - prompt_ms, prompt_ms, "llama.cpp")
 
     def _build_payload(
-        self, question: str, context_chunks: List[str], *, stream: bool
+        self, question: str, context_chunks: List[str], *, n_predict: int, stream: bool
     ) -> Dict[str, Any]:
         context_block = "\n".join(context_chunks)
 
@@ -190,19 +459,12 @@ class RAGService:
                 {"role": "user", "content": user_prompt},
             ],
             "temperature": self._settings.temperature,
-            "n_predict": self._settings.max_generated_tokens,
+            "n_predict": n_predict,
             "stop": ["<|im_end|>"],
         }
 
     def _silly_handler(self, question: str) -> List[str]:
-        question = question.lower()
-        system_chunks = []
-
-        for rule in self._settings.system_hints:
-            if any(keyword in question for keyword in rule["keywords"]):
-                system_chunks.append(rule["message"])
-
-        return system_chunks
+        return self._hints.match(question)
 
 
 @lru_cache(maxsize=1)
@@ -0,0 +1,218 @@
+import hashlib
+import logging
+import math
+import time
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import HTTPException, Request, status
+
+try:
+    import redis.asyncio as redis
+except ImportError:  # redis is only needed for rate_limit_backend="redis"
+    redis = None
+
+from config import Settings, get_settings
+from metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# Refill, then take `cost` if the bucket holds it (always when forced).
+# Returns the seconds until `cost` would be available, "0" when taken.
+_TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now_parts = redis.call("TIME")
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local state = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if ARGV[4] == "1" or tokens >= cost then
+    tokens = tokens - cost
+else
+    wait = (cost - tokens) / rate
+end
+redis.call("HSET", KEYS[1], "tokens", tostring(tokens), "ts", tostring(now))
+redis.call("PEXPIRE", KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return tostring(wait)
+"""
+
+
+class MemoryBuckets:
+    """
+    Token buckets of one limit, kept in this process.
+
+    Buckets that have refilled completely are indistinguishable from new
+    ones and are dropped once more than `max_clients` are tracked.
+    """
+
+    def __init__(self, capacity: float, rate: float, max_clients: int = 10000):
+        self.capacity = capacity
+        self.rate = rate
+        self._max_clients = max_clients
+        self._state: Dict[str, Tuple[float, float]] = {}  # client -> (tokens, updated)
+
+    async def take(self, client: str, cost: float, force: bool = False) -> float:
+        now = time.monotonic()
+        tokens = self._level(client, now)
+        wait = 0.0
+        if force or tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / self.rate
+        self._state[client] = (tokens, now)
+        if len(self._state) > self._max_clients:
+            self._evict_full(now)
+        return wait
+
+    def tracked(self) -> int:
+        return len(self._state)
+
+    def _level(self, client: str, now: float) -> float:
+        tokens, updated = self._state.get(client, (self.capacity, now))
+        return min(self.capacity, tokens + (now - updated) * self.rate)
+
+    def _evict_full(self, now: float) -> None:
+        for client in [c for c in self._state if self._level(c, now) >= self.capacity]:
+            del self._state[client]
+
+
+class RedisBuckets:
+    """Token buckets of one limit in Redis, shared by all rag_app replicas."""
+
+    def __init__(self, conn: Any, name: str, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self._prefix = f"rate_limit:{name}:"
+        self._script = conn.register_script(_TAKE_SCRIPT)
+
+    async def take(self, client: str, cost: float, force: bool = False) -> float:
+        wait = await self._script(
+            keys=[self._prefix + client],
+            args=[self.capacity, self.rate, cost, "1" if force else "0"],
+        )
+        return float(wait)
+
+    def tracked(self) -> Optional[int]:
+        return None
+
+
+class RateLimiter:
+    """
+    Per-client token bucket limits on requests and generated tokens.
+
+    Clients are identified by IP or, with `rate_limit_by="api_key"`, by the
+    `X-API-Key` / bearer token they send (hashed, falling back to the IP).
+    Every request takes one token from the client's request bucket. Generated
+    tokens are only known after the answer, so they are charged afterwards and
+    may drive the token bucket negative; new requests are refused until it
+    has refilled above zero. A limit with burst 0 is disabled.
+
+    If Redis is unreachable, requests are let through rather than failed.
+    """
+
+    def __init__(self, st: Settings):
+        self.enabled: bool = st.rate_limit_enabled
+        self._by: str = st.rate_limit_by
+        self.throttled: Dict[str, int] = {"requests": 0, "tokens": 0}
+
+        conn = None
+        if self.enabled and st.rate_limit_backend == "redis":
+            if redis is None:
+                raise RuntimeError("rate_limit_backend=redis needs the redis package")
+            conn = redis.from_url(st.rate_limit_redis_url)
+        self._conn = conn
+
+        self._buckets: Dict[str, Any] = {}
+        for name, burst, per_minute in (
+            ("requests", st.rate_limit_requests_burst, st.rate_limit_requests_per_minute),
+            ("tokens", st.rate_limit_tokens_burst, st.rate_limit_tokens_per_minute),
+        ):
+            if burst <= 0 or per_minute <= 0:
+                continue
+            rate = per_minute / 60
+            self._buckets[name] = (
+                RedisBuckets(conn, name, burst, rate) if conn is not None else MemoryBuckets(burst, rate)
+            )
+
+    def client_key(self, request: Request) -> str:
+        """Stable identity of the requesting client."""
+        if self._by == "api_key":
+            auth = request.headers.get("authorization", "")
+            key = request.headers.get("x-api-key") or (auth[7:] if auth.lower().startswith("bearer ") else "")
+            if key:
+                return "key:" + hashlib.sha256(key.encode()).hexdigest()[:16]
+        # Only what the front proxy set can be trusted: nginx puts $remote_addr in
+        # X-Real-IP and appends it to X-Forwarded-For, whose earlier entries come
+        # from the client and can be anything.
+        forwarded = request.headers.get("x-forwarded-for", "").split(",")[-1].strip()
+        return "ip:" + (request.headers.get("x-real-ip", "").strip() or forwarded or request.client.host)
+
+    async def check(self, client: str) -> None:
+        """
+        Take one request token; 429 with Retry-After if a limit is exhausted.
+        The token bucket is checked first, so a refused request costs nothing.
+        """
+        if not self.enabled:
+            return
+        for name, cost in (("tokens", 0), ("requests", 1)):
+            buckets = self._buckets.get(name)
+            if buckets is None:
+                continue
+            wait = await self._take(buckets, client, cost)
+            if wait > 0:
+                self.throttled[name] += 1
+                METRICS.inc("throttled_total", limit=name)
+                logger.warning("[RateLimit] %s throttled on %s for %.1fs", client, name, wait)
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail=f"Rate limit exceeded ({name}). Retry later.",
+                    headers={"Retry-After": str(max(1, math.ceil(wait)))},
+                )
+
+    async def charge_tokens(self, client: str, tokens: Optional[int]) -> None:
+        """Charge the generated tokens of an answer to the client's token bucket."""
+        buckets = self._buckets.get("tokens")
+        if self.enabled and buckets is not None and tokens:
+            await self._take(buckets, client, tokens, force=True)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "backend": "redis" if self._conn is not None else "memory",
+            "throttled": dict(self.throttled),
+            "tracked_clients": {name: b.tracked() for name, b in self._buckets.items()},
+        }
+
+    async def aclose(self) -> None:
+        if self._conn is not None:
+            await self._conn.aclose()
+
+    @staticmethod
+    async def _take(buckets: Any, client: str, cost: float, force: bool = False) -> float:
+        try:
+            return await buckets.take(client, cost, force)
+        except Exception as exc:
+            logger.warning("[RateLimit] Bucket backend error, allowing request: %s", exc)
+            METRICS.inc("errors_total", kind="rate_limit_backend")
+            return 0.0
+
+
+@lru_cache(maxsize=1)
+def get_rate_limiter() -> RateLimiter:
+    """Returns singleton instance of RateLimiter."""
+    return RateLimiter(get_settings())
+
+
+async def rate_limited_client(request: Request) -> str:
+    """
+    FastAPI dependency: the client key of the request, after taking a
+    request token from its bucket (429 when over the limit).
+    """
+    limiter = get_rate_limiter()
+    client = limiter.client_key(request)
+    await limiter.check(client)
+    return client
@@ -0,0 +1,130 @@
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional
+
+from config import Settings
+
+logger = logging.getLogger(__name__)
+
+
+class RerankLevel(NamedTuple):
+    """Retrieval quality level: FAISS depth (= rerank candidates) and whether to rerank."""
+
+    name: str
+    k: int
+    use_reranker: bool
+
+
+class AdaptiveRerankPolicy:
+    """
+    Load-adaptive choice of retrieval depth and reranking.
+
+    Levels go from full quality to cheapest: full `default_k` with rerank,
+    half the candidates, a fifth of the candidates, and no rerank at all.
+    The policy steps one level down when the p95 retrieval latency over the
+    last `rerank_window` requests exceeds `rerank_slo_ms` or more than
+    `rerank_max_inflight` retrievals are running, and one level up when p95
+    is below `rerank_slo_ms * rerank_recover_ratio` with the queue drained.
+    Level changes are at least `rerank_cooldown` seconds apart and reset the
+    latency window, so every level is judged on its own samples.
+    """
+
+    def __init__(self, st: Settings):
+        k, top_n = st.default_k, st.default_top_n
+        self._levels: List[RerankLevel] = [RerankLevel("full", k, st.use_reranker)]
+        if st.adaptive_rerank and st.use_reranker:
+            self._levels += [
+                RerankLevel("reduced_k", max(top_n, k // 2), True),
+                RerankLevel("small_candidates", max(top_n, k // 5), True),
+                RerankLevel("skip_rerank", top_n, False),
+            ]
+
+        self._slo: float = st.rerank_slo_ms / 1000
+        self._recover: float = st.rerank_slo_ms * st.rerank_recover_ratio / 1000
+        self._max_inflight: int = max(1, st.rerank_max_inflight)
+        self._min_samples: int = max(1, st.rerank_min_samples)
+        self._cooldown: float = st.rerank_cooldown
+
+        self._level: int = 0
+        self._inflight: int = 0
+        self._latencies: Deque[float] = deque(maxlen=max(1, st.rerank_window))
+        self._changed_at: float = float("-inf")
+
+        self._decisions: Dict[str, int] = {lvl.name: 0 for lvl in self._levels}
+        self._degraded: int = 0
+        self._restored: int = 0
+        self._last_reason: Optional[str] = None
+
+    @property
+    def level(self) -> RerankLevel:
+        return self._levels[self._level]
+
+    def acquire(self) -> RerankLevel:
+        """Register a retrieval about to start and return the level it should use."""
+        self._inflight += 1
+        self._maybe_adjust()
+        level = self.level
+        self._decisions[level.name] += 1
+        return level
+
+    def release(self, latency: float) -> None:
+        """Register a finished retrieval and its latency in seconds."""
+        self._inflight = max(0, self._inflight - 1)
+        self._latencies.append(latency)
+        self._maybe_adjust()
+
+    def p95(self) -> Optional[float]:
+        if len(self._latencies) < self._min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def stats(self) -> Dict[str, Any]:
+        """Current level, load signals and decision counters."""
+        p95 = self.p95()
+        return {
+            "level": self.level.name,
+            "level_index": self._level,
+            "k": self.level.k,
+            "use_reranker": self.level.use_reranker,
+            "inflight": self._inflight,
+            "p95_ms": p95 * 1000 if p95 is not None else None,
+            "slo_ms": self._slo * 1000,
+            "decisions": dict(self._decisions),
+            "degraded": self._degraded,
+            "restored": self._restored,
+            "last_reason": self._last_reason,
+        }
+
+    def _maybe_adjust(self) -> None:
+        if len(self._levels) == 1:
+            return
+        now = time.monotonic()
+        if now - self._changed_at < self._cooldown:
+            return
+
+        p95 = self.p95()
+        if self._inflight > self._max_inflight and self._level < len(self._levels) - 1:
+            self._shift(+1, now, f"inflight {self._inflight} > {self._max_inflight}")
+        elif p95 is not None and p95 > self._slo and self._level < len(self._levels) - 1:
+            self._shift(+1, now, f"p95 {p95 * 1000:.0f} ms > SLO {self._slo * 1000:.0f} ms")
+        elif (
+            p95 is not None
+            and p95 < self._recover
+            and self._inflight <= self._max_inflight // 2
+            and self._level > 0
+        ):
+            self._shift(-1, now, f"p95 {p95 * 1000:.0f} ms < {self._recover * 1000:.0f} ms")
+
+    def _shift(self, step: int, now: float, reason: str) -> None:
+        previous = self.level.name
+        self._level += step
+        self._changed_at = now
+        self._latencies.clear()
+        self._last_reason = reason
+        if step > 0:
+            self._degraded += 1
+        else:
+            self._restored += 1
+        logger.warning("[Rerank] %s -> %s (%s)", previous, self.level.name, reason)
@@ -1,4 +1,4 @@
-from typing import Any, Dict, List, Optional
+from typing import Any, Dict, List, NamedTuple, Optional
 from pydantic import BaseModel, Field, validator
 
 
@@ -17,6 +17,21 @@ class QueryRequest(BaseModel):
         return v
 
 
+class BatchQueryRequest(BaseModel):
+    """
+    List of user queries for an offline batch (evaluation) run.
+    """
+
+    messages: List[str] = Field(..., min_length=1, example=["What are the occupational safety requirements?"])
+
+    @validator("messages", each_item=True)
+    def strip_and_validate(cls, v: str) -> str:
+        v = v.strip()
+        if not v:
+            raise ValueError("Query messages must not be empty.")
+        return v
+
+
 class Chunk(BaseModel):
     """
     A single chunk of context retrieved by the retriever.
@@ -45,3 +60,24 @@ class GenerationResult(BaseModel):
     timings: Dict[str, Any] = Field(default_factory=dict)
     usage: Dict[str, Any] = Field(default_factory=dict)
     finish_reason: str
+    degradations: List[str] = Field(default_factory=list)
+    compression_ratio: Optional[float] = None
+    # Index chunk id of each context chunk; None for compressed chunks, hints and fallbacks
+    chunk_ids: List[Optional[str]] = Field(default_factory=list)
+
+
+EVENT_TOKEN = "token"
+EVENT_FINAL = "final"
+EVENT_ERROR = "error"
+
+
+class StreamEvent(NamedTuple):
+    """
+    Item yielded by `RAGService.stream`.
+
+    `data` is the token text for `token` events, a `GenerationResult`
+    for the `final` event and the error dict for `error` events.
+    """
+
+    type: str
+    data: Any
@@ -0,0 +1,70 @@
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, Optional
+
+# Trace id shared by rag_app, the retrieval service and the shipped log entry
+TRACE_HEADER = "X-Trace-Id"
+
+_TRACE_ID_PATTERN = re.compile(r"^[0-9A-Za-z_-]{8,64}$")
+
+
+class Trace:
+    """
+    Spans of a single request, keyed by name.
+
+    Every span records its start (ms since the trace started), duration and
+    the service it ran in. Spans measured by other services are merged with
+    `add`; `export` returns the dict shipped with the request's log entry.
+    """
+
+    def __init__(self, trace_id: Optional[str] = None):
+        self.trace_id: str = trace_id or uuid.uuid4().hex
+        self.started_at: str = datetime.utcnow().isoformat()
+        self._t0: float = time.perf_counter()
+        self._spans: Dict[str, Dict[str, Any]] = {}
+
+    @classmethod
+    def from_headers(cls, headers) -> "Trace":
+        """Continue the caller's trace if it sent a well-formed id, otherwise start a new one."""
+        trace_id = headers.get(TRACE_HEADER)
+        if trace_id and _TRACE_ID_PATTERN.match(trace_id):
+            return cls(trace_id)
+        return cls()
+
+    def now_ms(self) -> float:
+        """Milliseconds since the trace started."""
+        return (time.perf_counter() - self._t0) * 1000
+
+    def elapsed(self) -> float:
+        """Seconds since the trace started."""
+        return time.perf_counter() - self._t0
+
+    def add(self, name: str, start_ms: float, duration_ms: float, service: str = "rag_app") -> None:
+        self._spans[name] = {
+            "service": service,
+            "start_ms": round(start_ms, 3),
+            "duration_ms": round(max(0.0, duration_ms), 3),
+        }
+
+    @contextmanager
+    def span(self, name: str, service: str = "rag_app") -> Iterator[float]:
+        """Time the enclosed block as span `name`; yields the span start (ms)."""
+        start = self.now_ms()
+        try:
+            yield start
+        finally:
+            self.add(name, start, self.now_ms() - start, service)
+
+    def header(self) -> Dict[str, str]:
+        return {TRACE_HEADER: self.trace_id}
+
+    def export(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "duration_ms": round(self.now_ms(), 3),
+            "spans": dict(self._spans),
+        }
@@ -1,13 +1,20 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Request
 
 from schemas import (
+    BatchRerankRequest,
+    BatchRerankResponse,
     RerankRequest,
     RerankResponse,
     EncodeRequest,
     EncodeResponse,
+    VectorsRequest,
+    VectorsResponse,
 )
 from model_wrapper import get_backend, EmbeddingBackend
+from codec import msgpack_response, pack_matrix, wants_msgpack
 from config import settings
 
 logger = logging.getLogger(__name__)
@@ -30,43 +37,137 @@ def health_check(backend: EmbeddingBackend = Depends(get_backend)) -> dict:
 @router.post("/get_chunks", response_model=RerankResponse)
 async def get_chunks(
     request: RerankRequest,
+    http_request: Request,
     backend: EmbeddingBackend = Depends(get_backend),
+    x_request_budget_ms: Optional[float] = Header(None),
+    x_trace_id: Optional[str] = Header(None),
 ) -> RerankResponse:
     """
-    Returns top-k relevant document chunks with optional reranking.
+    Returns top-k relevant document chunks with optional reranking
+    and the source document of each chunk.
+
+    The optional `X-Request-Budget-Ms` header is the time the caller can
+    still spend on retrieval; reranking is shrunk or skipped to fit it.
+    Responds with msgpack if the client sends `Accept: application/msgpack`.
     """
     try:
-        chunks, scores, faiss_time, rerank_time = backend.get_top_chunks(
+        result = backend.get_top_chunks(
             question=request.question,
             k=request.k,
             top_n=request.top_n,
             use_reranker=request.use_reranker,
+            budget_ms=x_request_budget_ms,
         )
-        return RerankResponse(
-            chunks=chunks,
-            scores=scores,
-            faiss_time=faiss_time,
-            rerank_time=rerank_time,
+        logger.info(
+            "[API] trace=%s spans=%s degradations=%s compression=%s",
+            x_trace_id or "-", {name: round(s["duration_ms"], 1) for name, s in result.spans.items()},
+            result.degradations,
+            f"{result.compression_ratio:.2f}" if result.compression_ratio is not None else "-",
+        )
+        response = RerankResponse(
+            chunks=result.chunks,
+            scores=result.scores,
+            sources=result.sources,
+            faiss_time=result.faiss_time,
+            rerank_time=result.rerank_time,
+            degradations=result.degradations,
+            spans=result.spans,
+            compression_ratio=result.compression_ratio,
+            chunk_ids=result.chunk_ids,
         )
     except Exception as e:
         logger.exception("[API] Failed to retrieve chunks: %s", e)
         raise HTTPException(status_code=500, detail="Internal error in get_chunks")
 
+    if wants_msgpack(http_request):
+        return msgpack_response(response.model_dump())
+    return response
+
+
+@router.post("/get_chunks_batch", response_model=BatchRerankResponse)
+async def get_chunks_batch(
+    request: BatchRerankRequest,
+    http_request: Request,
+    backend: EmbeddingBackend = Depends(get_backend),
+    x_request_budget_ms: Optional[float] = Header(None),
+) -> BatchRerankResponse:
+    """
+    Returns top-k relevant document chunks for several questions in one batched pass.
+    """
+    try:
+        results = backend.get_top_chunks_batch(
+            questions=request.questions,
+            k=request.k,
+            top_n=request.top_n,
+            use_reranker=request.use_reranker,
+            budget_ms=x_request_budget_ms,
+        )
+        response = BatchRerankResponse(
+            results=[
+                RerankResponse(
+                    chunks=r.chunks,
+                    scores=r.scores,
+                    sources=r.sources,
+                    faiss_time=r.faiss_time,
+                    rerank_time=r.rerank_time,
+                    degradations=r.degradations,
+                    compression_ratio=r.compression_ratio,
+                    chunk_ids=r.chunk_ids,
+                )
+                for r in results
+            ]
+        )
+    except Exception as e:
+        logger.exception("[API] Failed to retrieve chunk batch: %s", e)
+        raise HTTPException(status_code=500, detail="Internal error in get_chunks_batch")
+
+    if wants_msgpack(http_request):
+        return msgpack_response(response.model_dump())
+    return response
+
 
 @router.post("/encode", response_model=EncodeResponse)
 async def encode(
     request: EncodeRequest,
+    http_request: Request,
     backend: EmbeddingBackend = Depends(get_backend),
 ) -> EncodeResponse:
     """
     Encodes input texts into dense vector embeddings.
+
+    With `Accept: application/msgpack` the embeddings are returned as one
+    binary float32 matrix: {"embeddings": {"dtype", "shape", "data"}}.
     """
     if not request.texts:
         raise HTTPException(status_code=400, detail="Text list must not be empty.")
 
     try:
-        embeddings = backend.encode(request.texts).tolist()
-        return EncodeResponse(embeddings=embeddings)
+        embeddings = backend.encode(request.texts)
+        if wants_msgpack(http_request):
+            return msgpack_response({"embeddings": pack_matrix(embeddings)})
+        return EncodeResponse(embeddings=embeddings.tolist())
     except Exception as e:
         logger.exception("[API] Failed to encode texts: %s", e)
         raise HTTPException(status_code=500, detail="Internal error in encode")
+
+
+@router.post("/vectors", response_model=VectorsResponse)
+async def vectors(
+    request: VectorsRequest,
+    http_request: Request,
+    backend: EmbeddingBackend = Depends(get_backend),
+) -> VectorsResponse:
+    """
+    Returns the stored dense vectors of chunks by id, read from the FAISS
+    index without running the model. Ids not in the index are listed in
+    `missing`. Supports msgpack like `/encode`.
+    """
+    try:
+        found, matrix = backend.get_vectors(request.ids)
+        missing = sorted(set(request.ids) - set(found))
+        if wants_msgpack(http_request):
+            return msgpack_response({"ids": found, "embeddings": pack_matrix(matrix), "missing": missing})
+        return VectorsResponse(ids=found, embeddings=matrix.tolist(), missing=missing)
+    except Exception as e:
+        logger.exception("[API] Failed to fetch vectors: %s", e)
+        raise HTTPException(status_code=500, detail="Internal error in vectors")
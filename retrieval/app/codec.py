@@ -0,0 +1,29 @@
+from typing import Any
+
+import numpy as np
+from fastapi import Request, Response
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; responses fall back to JSON
+    msgpack = None
+
+MSGPACK = "application/msgpack"
+
+
+def wants_msgpack(request: Request) -> bool:
+    """True if the client accepts msgpack and it is available here."""
+    return msgpack is not None and MSGPACK in request.headers.get("accept", "")
+
+
+def msgpack_response(content: Any) -> Response:
+    return Response(msgpack.packb(content, use_bin_type=True), media_type=MSGPACK)
+
+
+def pack_matrix(matrix: np.ndarray) -> dict:
+    """
+    Binary form of a float matrix for msgpack: raw little-endian float32 bytes
+    plus the shape, instead of one msgpack float per element.
+    """
+    matrix = np.ascontiguousarray(matrix, dtype="<f4")
+    return {"dtype": "<f4", "shape": list(matrix.shape), "data": matrix.tobytes()}
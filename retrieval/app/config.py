@@ -22,6 +22,14 @@ class Settings:
     model_name: str = os.getenv("MODEL_NAME", "BAAI/bge-m3")
     device: str = os.getenv("DEVICE", "cuda")
     disable_colbert: bool = os.getenv("DISABLE_COLBERT", "false").lower() == "true"
+    # Rerank is shrunk or skipped when the caller's remaining budget cannot cover it
+    rerank_ms_per_candidate: float = float(os.getenv("RERANK_MS_PER_CANDIDATE", "5"))
+    min_rerank_budget_ms: float = float(os.getenv("MIN_RERANK_BUDGET_MS", "50"))
+    # Extractive compression of reranked chunks: keep sentences whose ColBERT
+    # MaxSim against the question reaches the threshold, within a per-chunk token budget (0 = no limit)
+    compress_context: bool = os.getenv("COMPRESS_CONTEXT", "false").lower() == "true"
+    compress_threshold: float = float(os.getenv("COMPRESS_THRESHOLD", "0.4"))
+    compress_token_budget: int = int(os.getenv("COMPRESS_TOKEN_BUDGET", "0"))
     debug: bool = os.getenv("DEBUG", "false").lower() == "true"
     service_name: str = os.getenv("SERVICE_NAME", "Retrieval service")
 
@@ -1,8 +1,11 @@
+import hashlib
 import pickle
+import re
 import time
+from dataclasses import dataclass, field
 from functools import lru_cache
 from pathlib import Path
-from typing import List, Tuple, Optional
+from typing import Any, Dict, List, Tuple, Optional
 
 import faiss
 import numpy as np
@@ -14,6 +17,29 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Header written by older index builds in front of every PDF chunk
+LEGACY_SOURCE_PATTERN = re.compile(r"^Document (?P<name>[^:\n]+\.pdf) contains:", flags=re.IGNORECASE)
+# Sentence ends for context compression: terminal punctuation followed by whitespace, or line breaks
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?…;])\s+|\n+")
+
+
+@dataclass
+class RetrievalResult:
+    """Top chunks for a question with their scores, source documents and timings."""
+
+    chunks: List[str]
+    scores: List[Optional[float]]
+    sources: List[Optional[str]]
+    faiss_time: float
+    rerank_time: float
+    degradations: List[str] = field(default_factory=list)
+    # {"encode" | "faiss" | "rerank" | "compress": {"start_ms", "duration_ms"}}, relative to the start of retrieval
+    spans: Dict[str, Dict[str, float]] = field(default_factory=dict)
+    # Characters returned / characters of the original chunks, if compression ran
+    compression_ratio: Optional[float] = None
+    # Stable id of each chunk (see `chunk_id`); None for chunks changed by compression
+    chunk_ids: List[Optional[str]] = field(default_factory=list)
+
 
 class EmbeddingBackend:
     """Wrapper around the embedding model and FAISS index."""
@@ -33,6 +59,18 @@ class EmbeddingBackend:
 
         self.faiss_index = self._load_faiss(Path(settings.faiss_index_path))
         self.metadata = self._load_metadata(Path(settings.metadata_path))
+        self.chunk_ids = [chunk_id(item["text"]) for item in self.metadata]
+        # Chunk id -> index position; identical chunks share the first position
+        self._positions: Dict[str, int] = {}
+        for position, cid in enumerate(self.chunk_ids[:self.faiss_index.ntotal]):
+            self._positions.setdefault(cid, position)
+        if self.faiss_index.ntotal != len(self.metadata):
+            logger.warning(
+                "FAISS index has %d vectors but metadata %d chunks", self.faiss_index.ntotal, len(self.metadata)
+            )
+
+        # Observed ColBERT cost, used to fit reranking into request budgets
+        self._rerank_ms_per_candidate: float = settings.rerank_ms_per_candidate
 
         logger.info("Loaded %d vectors into FAISS", self.faiss_index.ntotal)
 
@@ -84,6 +122,18 @@ class EmbeddingBackend:
         else:
             raise ValueError("Unsupported encode mode: must be 'dense' or 'colbert'")
 
+    def get_vectors(self, ids: List[str]) -> Tuple[List[str], np.ndarray]:
+        """
+        Stored dense vectors of chunks by id, reconstructed from the FAISS index
+        instead of re-encoding the chunk texts. Returns the ids found, in
+        request order, and their vectors; unknown ids are left out.
+        """
+        found = [cid for cid in ids if cid in self._positions]
+        vectors = np.empty((len(found), self.faiss_index.d), dtype=np.float32)
+        for row, cid in enumerate(found):
+            vectors[row] = self.faiss_index.reconstruct(self._positions[cid])
+        return found, vectors
+
     def get_top_chunks(
         self,
         *,
@@ -91,52 +141,233 @@ class EmbeddingBackend:
         k: int,
         top_n: int,
         use_reranker: bool,
-    ) -> Tuple[List[str], List[Optional[float]], float, float]:
+        budget_ms: Optional[float] = None,
+    ) -> RetrievalResult:
         """
-        Returns: (top chunks, their scores, faiss time, rerank time)
+        Returns top chunks with their scores and source document names,
+        plus faiss and rerank times.
+        """
+        return self.get_top_chunks_batch(
+            questions=[question],
+            k=k,
+            top_n=top_n,
+            use_reranker=use_reranker,
+            budget_ms=budget_ms,
+        )[0]
+
+    def get_top_chunks_batch(
+        self,
+        *,
+        questions: List[str],
+        k: int,
+        top_n: int,
+        use_reranker: bool,
+        budget_ms: Optional[float] = None,
+    ) -> List[RetrievalResult]:
+        """
+        Batched retrieval: one dense encode and one FAISS search for all questions,
+        one ColBERT encode for the union of their candidates.
+        Reported faiss/rerank times are the batch totals divided by the number of questions;
+        spans are measured for the whole batch.
+
+        `budget_ms` is the caller's remaining time budget; reranking is shrunk
+        to fewer candidates or skipped when it would not fit, and the
+        applied degradations are reported in every result.
+
+        With `compress_context`, reranked chunks are reduced to their sentences
+        relevant to the question (see `_compress`).
         """
         assert top_n <= k, "top_n cannot be greater than k"
 
         t0 = time.perf_counter()
-        q_vec = self.encode([question], mode="dense", is_query=True)[0]
-        _, idx = self.faiss_index.search(np.asarray([q_vec]), k)
-        faiss_t = time.perf_counter() - t0
+        q_vecs = self.encode(questions, mode="dense", is_query=True)
+        t_encoded = time.perf_counter()
+        _, idx = self.faiss_index.search(np.asarray(q_vecs), k)
+        t_searched = time.perf_counter()
+        faiss_t = (t_searched - t0) / len(questions)
+        spans = {
+            "encode": _span(t0, t0, t_encoded),
+            "faiss": _span(t0, t_encoded, t_searched),
+        }
 
-        candidates = [self.metadata[i] for i in idx[0]]
+        candidate_ids = [[int(i) for i in row if i >= 0] for row in idx]
+
+        degradations: List[str] = []
+        if use_reranker and not settings.disable_colbert and budget_ms is not None:
+            remaining_ms = budget_ms - (time.perf_counter() - t0) * 1000
+            n_candidates = self._plan_rerank(remaining_ms, k, top_n, len(questions))
+            if n_candidates == 0:
+                use_reranker = False
+                degradations.append("rerank_skipped")
+            elif n_candidates < k:
+                candidate_ids = [ids[:n_candidates] for ids in candidate_ids]
+                degradations.append(f"rerank_candidates:{n_candidates}")
 
         rerank_t = 0.0
+        compressed: Optional[List[List[str]]] = None
         if use_reranker and not settings.disable_colbert:
             try:
                 t1 = time.perf_counter()
-                chunks, scores = self._rerank(question, candidates, top_n)
-                rerank_t = time.perf_counter() - t1
+                q_cols, p_by_id = self._colbert_vectors(questions, candidate_ids)
+                ranked = self._rerank(q_cols, p_by_id, candidate_ids, top_n)
+                elapsed = time.perf_counter() - t1
+                rerank_t = elapsed / len(questions)
+                spans["rerank"] = _span(t0, t1, t1 + elapsed)
+                self._observe_rerank(elapsed, sum(len(ids) for ids in candidate_ids))
             except Exception:
                 logger.exception("❌ ColBERT rerank failed. Returning top_n without rerank.")
-                chunks = candidates[:top_n]
-                scores = [None] * len(chunks)
+                ranked = [(ids[:top_n], [None] * len(ids[:top_n])) for ids in candidate_ids]
+            else:
+                # Compression is optional: if it fails, keep the reranked chunks whole
+                if settings.compress_context:
+                    try:
+                        t2 = time.perf_counter()
+                        compressed = [
+                            [self._compress(q_col, self.metadata[i]["text"], p_by_id[i]) for i in ids]
+                            for q_col, (ids, _) in zip(q_cols, ranked)
+                        ]
+                        spans["compress"] = _span(t0, t2, time.perf_counter())
+                    except Exception:
+                        logger.exception("❌ Context compression failed. Returning uncompressed reranked chunks.")
+                        degradations.append("compress_skipped")
+        elif degradations:
+            logger.warning("⚠️ Budget of %.0f ms too small — skipping rerank.", budget_ms)
+            ranked = [(ids[:top_n], [None] * len(ids[:top_n])) for ids in candidate_ids]
         else:
             logger.warning("⚠️ ColBERT is disabled or not used — skipping rerank.")
-            chunks = candidates[:top_n]
-            scores = [None] * len(chunks)
+            ranked = [(ids[:top_n], [None] * len(ids[:top_n])) for ids in candidate_ids]
 
-        return chunks, scores, faiss_t, rerank_t
+        results = []
+        for n, (ids, scores) in enumerate(ranked):
+            chunks = [self.metadata[i]["text"] for i in ids]
+            chunk_ids: List[Optional[str]] = [self.chunk_ids[i] for i in ids]
+            ratio = None
+            if compressed is not None and chunks:
+                ratio = sum(map(len, compressed[n])) / max(1, sum(map(len, chunks)))
+                chunk_ids = [cid if new == old else None for cid, new, old in zip(chunk_ids, compressed[n], chunks)]
+                chunks = compressed[n]
+            results.append(
+                RetrievalResult(
+                    chunks=chunks,
+                    scores=scores,
+                    sources=[self.metadata[i]["source"] for i in ids],
+                    faiss_time=faiss_t,
+                    rerank_time=rerank_t,
+                    degradations=list(degradations),
+                    spans=spans,
+                    compression_ratio=ratio,
+                    chunk_ids=chunk_ids,
+                )
+            )
+        return results
 
-    def _rerank(self, question: str, chunks: List[str], top_n: int) -> Tuple[List[str], List[float]]:
-        """ColBERT MaxSim rerank."""
-        q_col = self.encode([question], mode="colbert", is_query=True)[0]
-        p_cols = self.encode(chunks, mode="colbert", is_query=False)
+    def _plan_rerank(self, remaining_ms: float, k: int, top_n: int, n_questions: int) -> int:
+        """
+        Number of FAISS candidates per question that can be reranked within
+        `remaining_ms` at the observed ColBERT cost: `k` if everything fits,
+        0 if fewer than `top_n` fit or the budget is below `min_rerank_budget_ms`.
+        """
+        if remaining_ms < settings.min_rerank_budget_ms:
+            return 0
+        affordable = int(remaining_ms / (self._rerank_ms_per_candidate * n_questions))
+        if affordable < top_n:
+            return 0
+        return min(k, affordable)
+
+    def _observe_rerank(self, elapsed: float, n_candidates: int) -> None:
+        if n_candidates:
+            sample = elapsed * 1000 / n_candidates
+            self._rerank_ms_per_candidate = 0.8 * self._rerank_ms_per_candidate + 0.2 * sample
+
+    def _colbert_vectors(
+        self,
+        questions: List[str],
+        candidate_ids: List[List[int]],
+    ) -> Tuple[List[np.ndarray], Dict[int, np.ndarray]]:
+        """ColBERT token vectors of the questions and of the union of their candidate chunks (by chunk id)."""
+        q_cols = self.encode(questions, mode="colbert", is_query=True)
+        unique_ids = sorted({i for ids in candidate_ids for i in ids})
+        if not unique_ids:
+            return q_cols, {}
+        p_cols = self.encode([self.metadata[i]["text"] for i in unique_ids], mode="colbert", is_query=False)
+        return q_cols, dict(zip(unique_ids, p_cols))
+
+    def _rerank(
+        self,
+        q_cols: List[np.ndarray],
+        p_by_id: Dict[int, np.ndarray],
+        candidate_ids: List[List[int]],
+        top_n: int,
+    ) -> List[Tuple[List[int], List[Optional[float]]]]:
+        """
+        ColBERT MaxSim rerank of each question's candidates.
+        Returns (top chunk ids, scores) per question.
+        """
+        ranked = []
+        for q_col, ids in zip(q_cols, candidate_ids):
+            scored = [(i, float(self.model.colbert_score(q_col, p_by_id[i]))) for i in ids]
+            scored.sort(key=lambda x: x[1], reverse=True)
+            top = scored[:top_n]
+            ranked.append(([i for i, _ in top], [sc for _, sc in top]))
+        return ranked
+
+    def _compress(self, q_col: np.ndarray, text: str, p_col: np.ndarray) -> str:
+        """
+        Extractive compression of a chunk for one question.
+
+        Every sentence is scored by ColBERT MaxSim against the question, using
+        the chunk's token vectors from reranking mapped to sentences through the
+        tokenizer offsets. Sentences scoring at least `compress_threshold` are
+        kept (the best one always), best first while they fit into
+        `compress_token_budget`. Kept sentences stay in document order, cut
+        text is marked with "…", and the "Document <name> contains:" header is
+        preserved. The chunk is returned unchanged if tokens and vectors do not line up.
+        """
+        header = LEGACY_SOURCE_PATTERN.match(text)
+        sentences = _split_sentences(text, header.end() if header else 0)
+        if len(sentences) < 2:
+            return text
+
+        # ColBERT vectors start after the leading special token
+        offsets = np.asarray(self.model.tokenizer(text, return_offsets_mapping=True)["offset_mapping"][1:])
+        p_col = np.asarray(p_col)
+        if len(offsets) != len(p_col):
+            return text
+        starts, ends = offsets[:, 0], offsets[:, 1]
+        token_sims = p_col @ np.asarray(q_col).T
 
         scored = []
-        for chunk, p_vec in zip(chunks, p_cols):
-            score = float(self.model.colbert_score(q_col, p_vec))
-            scored.append((chunk, score))
+        for start, end in sentences:
+            mask = (ends > start) & (starts < end) & (ends > starts)
+            n_tokens = int(mask.sum())
+            score = float(token_sims[mask].max(axis=0).mean()) if n_tokens else float("-inf")
+            scored.append((score, n_tokens))
 
-        if not scored:
-            return [], []
+        budget = settings.compress_token_budget
+        kept: List[int] = []
+        used = 0
+        for rank, n in enumerate(sorted(range(len(sentences)), key=lambda j: scored[j][0], reverse=True)):
+            score, n_tokens = scored[n]
+            if rank > 0 and score < settings.compress_threshold:
+                break
+            if rank > 0 and budget and used + n_tokens > budget:
+                continue
+            kept.append(n)
+            used += n_tokens
+        if len(kept) == len(sentences):
+            return text
 
-        scored.sort(key=lambda x: x[1], reverse=True)
-        top = scored[:top_n]
-        return [c for c, _ in top], [s for _, s in top]
+        kept.sort()
+        parts = [text[:sentences[0][0]]]
+        if kept[0] > 0:
+            parts.append("… ")
+        for prev, n in zip([None] + kept, kept):
+            if prev is not None:
+                parts.append(text[sentences[prev][1]:sentences[n][0]] if n == prev + 1 else " … ")
+            parts.append(text[sentences[n][0]:sentences[n][1]])
+        if kept[-1] < len(sentences) - 1:
+            parts.append(" …")
+        return "".join(parts)
 
     @staticmethod
     def _load_faiss(path: Path) -> faiss.Index:
@@ -149,16 +380,53 @@ class EmbeddingBackend:
             raise RuntimeError("Could not load FAISS index") from e
 
     @staticmethod
-    def _load_metadata(path: Path) -> List[str]:
+    def _load_metadata(path: Path) -> List[Dict[str, Any]]:
+        """
+        Load chunk metadata as {"text", "source"} dicts.
+        Plain-string entries from older builds get their source parsed from the chunk header once here.
+        """
         if not path.is_file():
             raise FileNotFoundError(path)
         try:
             with open(path, "rb") as f:
-                return pickle.load(f)
+                raw = pickle.load(f)
         except Exception as e:
             logger.exception(f"Failed to load metadata: {e}")
             raise RuntimeError("Could not load metadata") from e
 
+        metadata = []
+        for item in raw:
+            if isinstance(item, str):
+                m = LEGACY_SOURCE_PATTERN.match(item)
+                item = {"text": item, "source": m.group("name").strip() if m else None}
+            metadata.append(item)
+        return metadata
+
+
+def chunk_id(text: str) -> str:
+    """
+    Stable id of a chunk: a hash of its text, so it survives index rebuilds
+    and lets clients key cached embeddings by content.
+    """
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _split_sentences(text: str, start: int) -> List[Tuple[int, int]]:
+    """(start, end) character spans of the non-blank sentences of `text[start:]`."""
+    spans = []
+    pos = start
+    for m in SENTENCE_BOUNDARY.finditer(text, start):
+        if text[pos:m.start()].strip():
+            spans.append((pos, m.start()))
+        pos = m.end()
+    if text[pos:].strip():
+        spans.append((pos, len(text)))
+    return spans
+
+
+def _span(origin: float, start: float, end: float) -> Dict[str, float]:
+    return {"start_ms": (start - origin) * 1000, "duration_ms": (end - start) * 1000}
+
 
 @lru_cache(maxsize=1)
 def get_backend() -> EmbeddingBackend:
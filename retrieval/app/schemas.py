@@ -1,4 +1,4 @@
-from typing import List, Optional
+from typing import Dict, List, Optional
 from pydantic import BaseModel, Field
 
 
@@ -12,8 +12,24 @@ class RerankRequest(BaseModel):
 class RerankResponse(BaseModel):
     chunks: List[str] = Field(..., description="Final context chunks after reranking")
     scores: List[Optional[float]] = Field(..., description="Score for each chunk or None")
+    sources: List[Optional[str]] = Field(default_factory=list, description="Source document file name for each chunk or None")
     faiss_time: float = Field(..., description="FAISS search time in seconds")
     rerank_time: float = Field(..., description="Reranking time in seconds")
+    degradations: List[str] = Field(default_factory=list, description="Steps skipped or shrunk to meet the request budget")
+    spans: Dict[str, Dict[str, float]] = Field(default_factory=dict, description="encode/faiss/rerank/compress spans (start_ms, duration_ms) relative to the start of retrieval")
+    compression_ratio: Optional[float] = Field(None, description="Returned / original chunk characters if context compression ran")
+    chunk_ids: List[Optional[str]] = Field(default_factory=list, description="Stable id (text hash) of each chunk, None if compression changed it")
+
+
+class BatchRerankRequest(BaseModel):
+    questions: List[str] = Field(..., min_length=1, description="User questions")
+    k: int = Field(..., description="Number of nearest neighbors to retrieve from FAISS")
+    top_n: int = Field(..., description="Number of chunks to return after reranking")
+    use_reranker: bool = Field(..., description="Whether to apply the reranker")
+
+
+class BatchRerankResponse(BaseModel):
+    results: List[RerankResponse] = Field(..., description="Retrieval result for each question, in request order")
 
 
 class EncodeRequest(BaseModel):
@@ -22,3 +38,13 @@ class EncodeRequest(BaseModel):
 
 class EncodeResponse(BaseModel):
     embeddings: List[List[float]] = Field(..., description="List of dense embeddings (one per input text)")
+
+
+class VectorsRequest(BaseModel):
+    ids: List[str] = Field(..., min_length=1, description="Chunk ids as returned in `chunk_ids`")
+
+
+class VectorsResponse(BaseModel):
+    ids: List[str] = Field(..., description="Requested ids found in the index, in request order")
+    embeddings: List[List[float]] = Field(..., description="Stored dense vector of each found id")
+    missing: List[str] = Field(default_factory=list, description="Requested ids not in the index")
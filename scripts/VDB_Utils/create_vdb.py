@@ -1,6 +1,6 @@
 import sys
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 
 import numpy as np
 
@@ -31,6 +31,7 @@ def create_vdb(
 
     This function extracts text from documents, encodes them using a language model,
     creates a FAISS index from the embeddings, and saves the index and metadata.
+    Metadata keeps the source document name of every chunk, in index order.
 
     Args:
         documents_dir (Path): Directory containing the source documents.
@@ -45,14 +46,14 @@ def create_vdb(
     model = load_model()
 
     print("Extracting text from documents...")
-    chunks: List[str] = extract_all_text(str(documents_dir), use_tables)
+    chunks: List[Dict[str, str]] = extract_all_text(str(documents_dir), use_tables)
     print(f"Extracted {len(chunks)} chunks")
 
     print("Replacing documents in volume directory...")
     replace_documents(volume_documents, documents_dir)
 
     print("Encoding text chunks into embeddings...")
-    embeddings = encode_chunks(model, chunks, max_length=2048)
+    embeddings = encode_chunks(model, [c["text"] for c in chunks], max_length=2048)
 
     print("Creating FAISS index...")
     index = create_index(embeddings)
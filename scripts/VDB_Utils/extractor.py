@@ -201,7 +201,7 @@ def extract_themes_from_docx(docx_path: str) -> List[str]:
         return []
 
 
-def extract_all_text(root_dir: str, use_tables: bool) -> List[str]:
+def extract_all_text(root_dir: str, use_tables: bool) -> List[Dict[str, str]]:
     """
     Extract all relevant content from PDFs and DOCX files within a directory.
 
@@ -210,13 +210,13 @@ def extract_all_text(root_dir: str, use_tables: bool) -> List[str]:
         use_tables (bool): Whether to include LLM-based table summaries.
 
     Returns:
-        List[str]: List of extracted and processed text chunks.
+        List[Dict[str, str]]: Extracted chunks as {"text": ..., "source": <document file name>}.
     """
     if not Path(root_dir).exists():
         print(f"[!] Directory not found: {root_dir}")
         return []
 
-    documents: List[str] = []
+    documents: List[Dict[str, str]] = []
 
     pdf_files = list(Path(root_dir).rglob("*.pdf"))
     print(f"Found {len(pdf_files)} PDF files in {root_dir}")
@@ -224,13 +224,19 @@ def extract_all_text(root_dir: str, use_tables: bool) -> List[str]:
         try:
             chunks = extract_text_and_tables(str(pdf_file), use_tables)
             for chunk in chunks:
-                documents.append(f"Document {pdf_file.name} contains:\n{chunk}")
+                documents.append({
+                    "text": f"Document {pdf_file.name} contains:\n{chunk}",
+                    "source": pdf_file.name,
+                })
         except Exception as e:
             print(f"Error reading PDF {pdf_file}: {e}")
 
     docx_files = list(Path(root_dir).rglob("*.docx"))
     print(f"Found {len(docx_files)} DOCX files in {root_dir}")
     for docx_file in tqdm(docx_files, desc="Processing DOCX"):
-        documents.extend(extract_themes_from_docx(str(docx_file)))
+        documents.extend(
+            {"text": theme, "source": docx_file.name}
+            for theme in extract_themes_from_docx(str(docx_file))
+        )
 
     return documents
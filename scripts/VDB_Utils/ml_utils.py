@@ -1,5 +1,5 @@
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Union
 
 import pickle
 
@@ -94,15 +94,18 @@ def save_index(index: faiss.Index, index_path: Path) -> None:
     faiss.write_index(index, str(index_path))
 
 
-def load_metadata(metadata_path: Path) -> List[str]:
+def load_metadata(metadata_path: Path) -> List[Union[str, Dict[str, str]]]:
     """
     Load metadata (text chunks) from disk.
 
+    Older indexes store plain strings; newer ones store
+    {"text": ..., "source": ...} dicts. Both are returned as-is.
+
     Args:
         metadata_path (Path): Path to the metadata file.
 
     Returns:
-        List[str]: List of text chunks.
+        List[Union[str, Dict[str, str]]]: List of chunks in index order.
     """
     if not metadata_path.exists():
         return []
@@ -110,12 +113,12 @@ def load_metadata(metadata_path: Path) -> List[str]:
         return pickle.load(f)
 
 
-def save_metadata(metadata: List[str], metadata_path: Path) -> None:
+def save_metadata(metadata: List[Union[str, Dict[str, str]]], metadata_path: Path) -> None:
     """
-    Save metadata (text chunks) to disk.
+    Save metadata (text chunks with their source documents) to disk.
 
     Args:
-        metadata (List[str]): List of text chunks to save.
+        metadata (List[Union[str, Dict[str, str]]]): Chunks to save, in index order.
         metadata_path (Path): Path to the output file.
     """
     metadata_path.parent.mkdir(parents=True, exist_ok=True)
@@ -7,7 +7,7 @@ and appends it to the existing FAISS index and metadata.
 
 import sys
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 
 import numpy as np
 import faiss
@@ -29,12 +29,12 @@ from ml_utils import (
 )
 
 
-def process_embeddings(new_chunks: List[str]) -> None:
+def process_embeddings(new_chunks: List[Dict[str, str]]) -> None:
     """
     Encode new text chunks and append them to the existing FAISS index and metadata.
 
     Args:
-        new_chunks (List[str]): List of extracted text chunks.
+        new_chunks (List[Dict[str, str]]): Extracted chunks with their source document names.
     """
     if not new_chunks:
         print("No new chunks to index.")
@@ -44,7 +44,7 @@ def process_embeddings(new_chunks: List[str]) -> None:
     model = load_model()
 
     print(f"Encoding {len(new_chunks)} chunks...")
-    embeddings = encode_chunks(model, new_chunks)
+    embeddings = encode_chunks(model, [c["text"] for c in new_chunks])
 
     index_path = OUTPUT_FAISS_DIR / "index.faiss"
     if index_path.exists():
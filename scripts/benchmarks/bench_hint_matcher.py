@@ -0,0 +1,86 @@
+"""
+Benchmark: keyword hint matching, naive substring scan vs compiled Aho–Corasick automaton.
+
+Usage:
+    python scripts/benchmarks/bench_hint_matcher.py [--rules 500] [--keywords-per-rule 8] [--questions 2000]
+"""
+
+import argparse
+import random
+import string
+import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "rag_app" / "app"))
+
+from hint_matcher import HintMatcher  # noqa: E402
+
+ALPHABET = string.ascii_lowercase + "абвгдежзийклмнопрстуфхцчшщэюя"
+
+
+def _word(rng: random.Random) -> str:
+    return "".join(rng.choice(ALPHABET) for _ in range(rng.randint(4, 10)))
+
+
+def make_rules(rng: random.Random, n_rules: int, per_rule: int) -> List[Dict[str, Any]]:
+    return [
+        {"keywords": [_word(rng) for _ in range(per_rule)], "message": f"hint {i}"}
+        for i in range(n_rules)
+    ]
+
+
+def make_questions(rng: random.Random, rules: List[Dict[str, Any]], n: int) -> List[str]:
+    keywords = [k for rule in rules for k in rule["keywords"]]
+    questions = []
+    for _ in range(n):
+        words = [_word(rng) for _ in range(rng.randint(8, 30))]
+        for _ in range(rng.randint(0, 2)):
+            words.insert(rng.randrange(len(words)), rng.choice(keywords))
+        questions.append(" ".join(words).capitalize() + "?")
+    return questions
+
+
+def naive(rules: List[Dict[str, Any]], question: str) -> List[str]:
+    question = question.lower()
+    return [r["message"] for r in rules if any(k in question for k in r["keywords"])]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, default=500)
+    parser.add_argument("--keywords-per-rule", type=int, default=8)
+    parser.add_argument("--questions", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    rules = make_rules(rng, args.rules, args.keywords_per_rule)
+    questions = make_questions(rng, rules, args.questions)
+
+    matcher = HintMatcher(Path("/nonexistent"), normalize=False, reload_interval=1e9)
+    t0 = time.perf_counter()
+    matcher.compile(rules)
+    compile_ms = (time.perf_counter() - t0) * 1000
+
+    t0 = time.perf_counter()
+    expected = [naive(rules, q) for q in questions]
+    naive_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    got = [matcher.match(q) for q in questions]
+    automaton_s = time.perf_counter() - t0
+
+    assert got == expected, "automaton results differ from naive scan"
+
+    n_keywords = args.rules * args.keywords_per_rule
+    print(f"rules={args.rules} keywords={n_keywords} questions={args.questions}")
+    print(f"compile:   {compile_ms:8.1f} ms")
+    print(f"naive:     {naive_s / len(questions) * 1e6:8.1f} µs/question")
+    print(f"automaton: {automaton_s / len(questions) * 1e6:8.1f} µs/question")
+    print(f"speedup:   {naive_s / automaton_s:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Benchmark: retrieval latency over HTTP (retrieval container) vs in-process (retrieval_mode=local).
+
+Needs a running retrieval service for the HTTP mode and the retrieval
+requirements (torch, FlagEmbedding, faiss) plus its index for the local mode;
+the local backend reads FAISS_INDEX_PATH / METADATA_PATH / DEVICE like the service.
+
+Usage:
+    python scripts/benchmarks/bench_retrieval_modes.py [--url http://localhost:8004/get_chunks]
+        [--requests 200] [--concurrency 1] [--k 50] [--top-n 5] [--no-rerank]
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+ROOT = Path(__file__).resolve().parents[2]
+sys.path.insert(0, str(ROOT / "rag_app" / "app"))
+
+from config import Settings  # noqa: E402
+from llm_client import RetrieverClient  # noqa: E402
+from local_retriever import LocalRetrieverClient  # noqa: E402
+
+QUESTIONS = [
+    "Как оформить отпуск?",
+    "What are the occupational safety requirements?",
+    "Порядок согласования командировки",
+    "Where can I find the vacation policy?",
+    "Какие документы нужны для приёма на работу?",
+]
+
+
+async def run(client, args: argparse.Namespace) -> List[float]:
+    rng = random.Random(args.seed)
+    latencies: List[float] = []
+    slots = asyncio.Semaphore(args.concurrency)
+
+    async def _one() -> None:
+        async with slots:
+            t0 = time.perf_counter()
+            result = await client.get_chunks(
+                question=rng.choice(QUESTIONS),
+                k=args.k,
+                top_n=args.top_n,
+                use_reranker=not args.no_rerank,
+            )
+            latencies.append(time.perf_counter() - t0)
+            assert result.chunks, "retrieval returned no chunks"
+
+    for _ in range(args.warmup):
+        await _one()
+    latencies.clear()
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(_one() for _ in range(args.requests)))
+    wall = time.perf_counter() - t0
+    print(f"  throughput: {args.requests / wall:8.1f} req/s")
+    return latencies
+
+
+def report(name: str, latencies: List[float]) -> None:
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+    print(f"  {name}: mean {statistics.mean(ordered) * 1000:8.2f} ms | "
+          f"p50 {statistics.median(ordered) * 1000:8.2f} ms | p95 {p95 * 1000:8.2f} ms")
+
+
+async def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--url", default="http://localhost:8004/get_chunks")
+    parser.add_argument("--retrieval-app-dir", default=str(ROOT / "retrieval" / "app"))
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--k", type=int, default=50)
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--no-rerank", action="store_true")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    settings = Settings(retriever_url=args.url, retrieval_app_dir=args.retrieval_app_dir)
+    print(f"requests={args.requests} concurrency={args.concurrency} k={args.k} "
+          f"top_n={args.top_n} rerank={not args.no_rerank}")
+
+    for name, client in (
+        ("http ", RetrieverClient(settings)),
+        ("local", LocalRetrieverClient(settings)),
+    ):
+        print(f"{name.strip()}:")
+        try:
+            report(name, await run(client, args))
+        finally:
+            await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,142 @@
+"""
+Benchmark: JSON vs msgpack transport between rag_app / log_worker and retrieval.
+
+Offline part: serialization + parsing cost and payload size of a /get_chunks
+response (top_n chunks of ~1000 characters) and an /encode response
+(BGE-M3 sized float32 embeddings).
+Live part (with --url): p50/p99 latency of /get_chunks and /encode against a
+running retrieval service, negotiated through the Accept header.
+
+Usage:
+    python scripts/benchmarks/bench_transport.py [--top-n 5] [--texts 7] [--dim 1024]
+        [--url http://localhost:8004] [--requests 300]
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from pathlib import Path
+from typing import Any, Callable, List
+
+import httpx
+import msgpack
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "retrieval" / "app"))
+
+from codec import MSGPACK, pack_matrix  # noqa: E402
+
+WORDS = "охрана труда отпуск заявление сотрудник документ порядок согласование policy leave safety".split()
+
+
+def make_chunks_response(rng: random.Random, top_n: int) -> dict:
+    chunks = []
+    for i in range(top_n):
+        text = f"Document Doc{i}.pdf contains:\n"
+        while len(text) < 1000:
+            text += rng.choice(WORDS) + " "
+        chunks.append(text)
+    return {
+        "chunks": chunks,
+        "scores": [rng.random() for _ in chunks],
+        "sources": [f"Doc{i}.pdf" for i in range(top_n)],
+        "faiss_time": 0.004,
+        "rerank_time": 0.08,
+        "degradations": [],
+        "spans": {name: {"start_ms": 1.0, "duration_ms": 2.0} for name in ("encode", "faiss", "rerank")},
+    }
+
+
+def timeit(fn: Callable[[], Any], repeat: int) -> float:
+    fn()
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat * 1e6
+
+
+def offline(args: argparse.Namespace) -> None:
+    rng = random.Random(args.seed)
+    chunks = make_chunks_response(rng, args.top_n)
+    matrix = np.random.default_rng(args.seed).standard_normal((args.texts, args.dim)).astype(np.float32)
+
+    def chunks_json():
+        return json.loads(json.dumps(chunks, ensure_ascii=False).encode())
+
+    def chunks_msgpack():
+        return msgpack.unpackb(msgpack.packb(chunks, use_bin_type=True))
+
+    def encode_json():
+        body = json.dumps({"embeddings": matrix.tolist()}).encode()
+        return [np.array(v, dtype=np.float32) for v in json.loads(body)["embeddings"]]
+
+    def encode_msgpack():
+        packed = msgpack.unpackb(msgpack.packb({"embeddings": pack_matrix(matrix)}, use_bin_type=True))["embeddings"]
+        return np.frombuffer(packed["data"], dtype=packed["dtype"]).reshape(packed["shape"])
+
+    assert np.allclose(np.vstack(encode_json()), encode_msgpack())
+
+    sizes = {
+        "chunks": (
+            len(json.dumps(chunks, ensure_ascii=False).encode()),
+            len(msgpack.packb(chunks, use_bin_type=True)),
+        ),
+        "encode": (
+            len(json.dumps({"embeddings": matrix.tolist()}).encode()),
+            len(msgpack.packb({"embeddings": pack_matrix(matrix)}, use_bin_type=True)),
+        ),
+    }
+    print(f"offline (serialize + parse), top_n={args.top_n}, embeddings={args.texts}x{args.dim}")
+    for name, (fj, fm) in (("chunks", (chunks_json, chunks_msgpack)), ("encode", (encode_json, encode_msgpack))):
+        tj, tm = timeit(fj, args.repeat), timeit(fm, args.repeat)
+        bj, bm = sizes[name]
+        print(f"  {name:7s} json {tj:9.1f} µs {bj:8d} B | msgpack {tm:9.1f} µs {bm:8d} B | {tj / tm:5.1f}x")
+
+
+async def live(args: argparse.Namespace) -> None:
+    requests = {
+        "get_chunks": {"question": "Как оформить отпуск?", "k": 50, "top_n": args.top_n, "use_reranker": True},
+        "encode": {"texts": ["Как оформить отпуск?"] * args.texts},
+    }
+    print(f"live, {args.requests} requests each, {args.url}")
+    for endpoint, payload in requests.items():
+        for accept in ("application/json", MSGPACK):
+            async with httpx.AsyncClient(base_url=args.url, headers={"Accept": accept}, timeout=60) as client:
+                latencies: List[float] = []
+                for i in range(args.requests + 5):
+                    t0 = time.perf_counter()
+                    resp = await client.post(f"/{endpoint}", json=payload)
+                    resp.raise_for_status()
+                    if resp.headers["content-type"].startswith(MSGPACK):
+                        msgpack.unpackb(resp.content)
+                    else:
+                        resp.json()
+                    if i >= 5:
+                        latencies.append(time.perf_counter() - t0)
+            latencies.sort()
+            p50 = latencies[len(latencies) // 2] * 1000
+            p99 = latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))] * 1000
+            print(f"  {endpoint:10s} {accept:20s} p50 {p50:8.2f} ms | p99 {p99:8.2f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top-n", type=int, default=5)
+    parser.add_argument("--texts", type=int, default=7)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--requests", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    offline(args)
+    if args.url:
+        asyncio.run(live(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark: log_worker metrics per log vs per batch.
+
+Offline part: similarity cost of the per-log path (cosine similarity of each
+pair group, normalizing on every call, as sklearn's `cosine_similarity` does)
+vs one Gram matrix of the normalized embeddings of the deduplicated batch
+texts, on random unit vectors.
+Live part (with --url): logs/s of one /encode call per log vs one call per
+batch of deduplicated texts against a running retrieval service.
+
+Usage:
+    python scripts/benchmarks/bench_worker_metrics.py [--logs 256] [--batch 32] [--chunks 5]
+        [--dim 1024] [--url http://localhost:8004]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+import httpx
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[2] / "log_worker"))
+os.environ.setdefault("LOG_DIR", tempfile.gettempdir())  # the worker module sets up its log file on import
+os.environ.setdefault("METRICS_DB", "off")
+
+from main import log_metrics, normalize_rows  # noqa: E402
+
+WORDS = "охрана труда отпуск заявление сотрудник документ порядок согласование policy leave safety".split()
+
+Item = Tuple[str, List[str], str]
+
+
+def make_items(rng: random.Random, n: int, chunks: int) -> List[Item]:
+    """Logs over a small pool of questions and chunks, like repeated questions on one corpus."""
+    pool = [" ".join(rng.choices(WORDS, k=80)) for _ in range(chunks * 20)]
+    questions = [" ".join(rng.choices(WORDS, k=8)) for _ in range(max(1, n // 4))]
+    return [
+        (rng.choice(questions), rng.sample(pool, chunks), " ".join(rng.choices(WORDS, k=60)))
+        for _ in range(n)
+    ]
+
+
+def cos(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = np.atleast_2d(a)
+    b = np.atleast_2d(b)
+    return normalize_rows(a) @ normalize_rows(b).T
+
+
+def per_log(items: List[Item], vectors: Dict[str, np.ndarray]) -> None:
+    for question, chunks, answer in items:
+        q, a = vectors[question], vectors[answer]
+        c = np.vstack([vectors[t] for t in chunks])
+        cos(q, a)
+        cos(q, c)
+        cos(a, c)
+        sims = cos(c, c)
+        sims[np.triu_indices_from(sims, k=1)].mean()
+
+
+def batched(items: List[Item], vectors: Dict[str, np.ndarray], batch: int) -> None:
+    for start in range(0, len(items), batch):
+        index: Dict[str, int] = {}
+        rows = []
+        for question, chunks, answer in items[start:start + batch]:
+            q, a = index.setdefault(question, len(index)), index.setdefault(answer, len(index))
+            rows.append((q, a, [index.setdefault(t, len(index)) for t in chunks]))
+        embs = normalize_rows(np.vstack([vectors[t] for t in index]))
+        sims = embs @ embs.T
+        for q, a, c in rows:
+            log_metrics(sims, q, a, c, 0.7)
+
+
+def offline(args: argparse.Namespace, items: List[Item]) -> None:
+    rng = np.random.default_rng(args.seed)
+    texts = sorted({t for q, c, a in items for t in (q, a, *c)})
+    matrix = normalize_rows(rng.standard_normal((len(texts), args.dim)).astype(np.float32))
+    vectors = dict(zip(texts, matrix))
+
+    for name, fn in (
+        ("per log", lambda: per_log(items, vectors)),
+        ("batched", lambda: batched(items, vectors, args.batch)),
+    ):
+        fn()
+        t0 = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - t0
+        print(f"  {name:8s} {elapsed * 1000:9.2f} ms | {len(items) / elapsed:10.1f} logs/s")
+
+
+async def live(args: argparse.Namespace, items: List[Item]) -> None:
+    async with httpx.AsyncClient(base_url=args.url, timeout=120) as client:
+        async def encode(texts: List[str]) -> None:
+            resp = await client.post("/encode", json={"texts": texts})
+            resp.raise_for_status()
+
+        await encode(["warmup"])
+        t0 = time.perf_counter()
+        for question, chunks, answer in items:
+            await encode([question, answer] + chunks)
+        elapsed = time.perf_counter() - t0
+        total = sum(2 + len(c) for _, c, _ in items)
+        print(f"  per log  {elapsed:9.2f} s  | {len(items) / elapsed:10.1f} logs/s | {total} texts encoded")
+
+        t0 = time.perf_counter()
+        encoded = 0
+        for start in range(0, len(items), args.batch):
+            unique = list(dict.fromkeys(t for q, c, a in items[start:start + args.batch] for t in (q, a, *c)))
+            encoded += len(unique)
+            await encode(unique)
+        elapsed = time.perf_counter() - t0
+        print(f"  batched  {elapsed:9.2f} s  | {len(items) / elapsed:10.1f} logs/s | {encoded} texts encoded")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--logs", type=int, default=256)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--chunks", type=int, default=5)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--url", default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    items = make_items(random.Random(args.seed), args.logs, args.chunks)
+    print(f"offline similarities, {args.logs} logs, batch {args.batch}, {args.chunks} chunks, dim {args.dim}")
+    offline(args, items)
+    if args.url:
+        print(f"live /encode, {args.url}")
+        asyncio.run(live(args, items))
+
+
+if __name__ == "__main__":
+    main()
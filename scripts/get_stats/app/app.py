@@ -15,36 +15,58 @@ class LogReceiver:
         self.save_dir = Path("logs")
         self.log_prefix = "log_"
         self.date_format = "%Y%m%d"
+        self.cursor_file = self.save_dir / ".export_cursor"
+        self.page_size = 1000
 
         self.save_dir.mkdir(parents=True, exist_ok=True)
 
     def fetch_and_save_log(self) -> dict:
         """
-        Fetches logs from remote service and saves them locally with timestamp.
-        Also deletes logs older than N days.
+        Pulls the logs processed since the last run from the collector, page by
+        page from the saved cursor, and saves them locally with timestamp.
+        The cursor only advances past pages that are written to disk, so a
+        failed pull is resumed on the next run. Also deletes logs older than N days.
         """
-        try:
-            response = requests.get(self.sender_url, timeout=10)
-            response.raise_for_status()
-
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{self.log_prefix}{timestamp}.json"
-            save_path = self.save_dir / filename
-
-            self.clean_old_logs(max_days_old=30)
-
-            with open(save_path, "w", encoding="utf-8") as f:
-                json.dump(response.json(), f, ensure_ascii=False, indent=2)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        filename = f"{self.log_prefix}{timestamp}.json"
+        save_path = self.save_dir / filename
+        cursor = self.cursor_file.read_text(encoding="utf-8").strip() if self.cursor_file.exists() else ""
+        logs = []
+        error = None
 
-            return {"status": "success", "filename": filename}
+        self.clean_old_logs(max_days_old=30)
 
+        try:
+            while True:
+                params = {"limit": self.page_size}
+                if cursor:
+                    params["cursor"] = cursor
+                with requests.get(self.sender_url, params=params, stream=True, timeout=10) as response:
+                    response.raise_for_status()
+                    page = [json.loads(line) for line in response.iter_lines() if line]
+                    logs.extend(page)
+                    cursor = response.headers.get("X-Next-Cursor", cursor)
+                    has_more = response.headers.get("X-Has-More") == "true"
+                if not has_more:
+                    break
         except requests.exceptions.RequestException as e:
-            return {"status": "error", "error": f"Connection error: {str(e)}"}
+            error = f"Connection error: {str(e)}"
         except json.JSONDecodeError:
-            return {"status": "error", "error": "Invalid JSON received"}
+            error = "Invalid JSON received"
+
+        try:
+            if logs:
+                with open(save_path, "w", encoding="utf-8") as f:
+                    json.dump(logs, f, ensure_ascii=False, indent=2)
+            if cursor:
+                self.cursor_file.write_text(cursor, encoding="utf-8")
         except Exception as e:
             return {"status": "error", "error": str(e)}
 
+        if error:
+            return {"status": "error", "error": error, "saved": len(logs)}
+        return {"status": "success", "filename": filename if logs else None, "saved": len(logs)}
+
     def clean_old_logs(self, max_days_old: int = 30) -> list:
         """
         Deletes log files older than max_days_old based on filename timestamps.